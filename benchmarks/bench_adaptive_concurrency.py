@@ -0,0 +1,61 @@
+"""
+在不同并发容量的模拟服务上，对比固定并发（每个密钥1个请求）与自适应并发（AIMD）的吞吐量
+
+模拟服务的每个密钥同时最多处理 capacity 个请求，超出时返回529。
+
+用法:
+    python benchmarks/bench_adaptive_concurrency.py --capacities 1,4,8 --files 10 --keys 2
+"""
+import argparse
+import importlib
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_end_to_end import ENTRY_POINTS, run_entry  # noqa: E402
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+
+# (名称, 每个密钥初始并发数, 自适应并发上界)
+MODES = [("固定1", 1, 0), ("AIMD", 1, 16)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自适应并发吞吐量测试")
+    parser.add_argument("--entry", choices=ENTRY_POINTS, default="muliwork")
+    parser.add_argument("--capacities", default="1,4,8", help="每个密钥的并发容量，逗号分隔")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=40, help="每个文件的段落数")
+    parser.add_argument("--keys", type=int, default=2, help="模拟的API密钥个数")
+    parser.add_argument("--latency", type=float, default=0.2, help="首字节延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=400, help="每个请求的输出速度")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="每个分段的译文长度")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="显示入口脚本自身的输出")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.entry)
+    results = []
+    for capacity in map(int, args.capacities.split(",")):
+        for mode, max_in_flight, adaptive_limit in MODES:
+            module.MAX_IN_FLIGHT_PER_KEY = max_in_flight
+            module.ADAPTIVE_MAX_IN_FLIGHT = adaptive_limit
+            config = MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                reply="这是模拟的译文，其中包含行内公式 $x$。", reply_chars=args.reply_chars,
+                                capacity=capacity, seed=args.seed)
+            server, base_url = start_mock_server(config=config)
+            try:
+                result = run_entry(args.entry, base_url, config, args)
+            finally:
+                server.shutdown()
+            results.append((capacity, mode, result))
+
+    print(f"\n=== 自适应并发测试结果（{args.entry}，{args.files} 个文件，{args.keys} 个密钥）===")
+    print(f"{'容量':>4} {'模式':<6} {'耗时':>7} {'文件':>5} {'tokens/秒':>9} {'请求数':>6} {'p50':>6} {'p95':>6} {'529':>5}")
+    for capacity, mode, r in results:
+        print(f"{capacity:>4} {mode:<6} {r['elapsed']:>6.1f}s {r['files']:>5} {r['tokens_per_second']:>9.0f} "
+              f"{r['requests']:>6} {r['p50']:>5.2f}s {r['p95']:>5.2f}s {r['overloaded']:>5}")
+
+
+if __name__ == "__main__":
+    main()
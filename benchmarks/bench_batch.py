@@ -0,0 +1,82 @@
+"""
+在本地模拟服务上对比 mulidirct.py 同步模式与 --batch 批处理模式的耗时、吞吐量和成本
+
+用法:
+    python benchmarks/bench_batch.py --files 50 --latency 0.2 --batch-delay 2
+    python benchmarks/bench_batch.py --poll-error-rate 0.3  # 查询批次状态时注入错误，检查是否重复提交
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import mulidirct  # noqa: E402
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+
+PARAGRAPH = ("Let $X$ be a topological space and let $\\mathcal{F}$ be a filter on $X$. "
+             "We say that $\\mathcal{F}$ converges to $x$ if every neighbourhood of $x$ belongs to $\\mathcal{F}$.\n\n")
+
+
+def make_corpus(work_dir: Path, files: int, paragraphs: int):
+    """生成合成的待翻译文件"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        text = f"# Chapter {i + 1}\n\n" + PARAGRAPH * paragraphs
+        (work_dir / f"ch{i + 1}.md").write_text(text, encoding='utf-8')
+
+
+def run(mode: str, base_url: str, root: Path, batch: bool):
+    """在独立的目录中运行一次 mulidirct，返回耗时"""
+    mulidirct.BASE_URL = base_url
+    mulidirct.API_KEYS = ["mock-key-1", "mock-key-2"]
+    mulidirct.WORK_DIR = root / "workmd"
+    mulidirct.OUTPUT_DIR = root / f"outputmd-{mode}"
+    mulidirct.OUTPUT_DIR.mkdir(exist_ok=True)
+    mulidirct.CACHE_FILE = mulidirct.OUTPUT_DIR / "translation_cache.sqlite3"
+    mulidirct.JOURNAL_DIR = mulidirct.OUTPUT_DIR / ".journal"
+    mulidirct.MEMORY_FILE = mulidirct.OUTPUT_DIR / "translation_memory.sqlite3"
+    mulidirct.METRICS_FILE = mulidirct.OUTPUT_DIR / "metrics.jsonl"
+    mulidirct.PROMETHEUS_FILE = mulidirct.OUTPUT_DIR / "metrics.prom"
+    mulidirct.BATCH_POLL_INTERVAL = 0.2
+
+    start = time.perf_counter()
+    asyncio.run(mulidirct.process_markdown_files(batch=batch))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步模式与批处理模式对比")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟服务每个同步请求的延迟（秒）")
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="模拟服务每个批次的处理时间（秒）")
+    parser.add_argument("--poll-error-rate", type=float, default=0.0, help="模拟服务查询批次状态时返回529的概率")
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, batch_delay=args.batch_delay,
+                        batch_poll_error_rate=args.poll_error_rate, seed=0)
+    server, base_url = start_mock_server(config=config)
+    # Anthropic SDK 会自行拼接 /v1
+    base_url = base_url[:-len("/v1")]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            make_corpus(root / "workmd", args.files, args.paragraphs)
+            sync_time = run("sync", base_url, root, batch=False)
+            batch_time = run("batch", base_url, root, batch=True)
+    finally:
+        server.shutdown()
+
+    print("\n=== 对比结果 ===")
+    print(f"同步模式: {sync_time:.1f} 秒，{args.files / sync_time * 3600:.0f} 文件/小时")
+    print(f"批处理模式: {batch_time:.1f} 秒，{args.files / batch_time * 3600:.0f} 文件/小时")
+    print(f"批处理模式成本为同步模式的 {mulidirct.BATCH_COST_RATIO:.0%}")
+    print(f"模拟服务共收到 {config.batch_count} 个批次、{config.batch_request_count} 个批处理请求")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+对比旧的请求方式（每次新建 OpenAI 客户端 + ThreadPoolExecutor）与共享连接池的 AsyncOpenAI 的吞吐量
+
+用法:
+    python benchmarks/bench_client_pool.py --requests 500 --concurrency 16 --latency 0.02
+"""
+import argparse
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI  # noqa: E402
+from client_pool import ClientPool  # noqa: E402
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+
+MESSAGES = [{"role": "system", "content": "translate: hello world"}]
+
+
+async def run_old(base_url: str, total: int, concurrency: int):
+    """旧方式：每个请求新建客户端和线程池，在线程中阻塞调用同步SDK"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            client = OpenAI(base_url=base_url, api_key="mock")
+            with ThreadPoolExecutor() as executor:
+                await asyncio.get_event_loop().run_in_executor(
+                    executor,
+                    lambda: client.chat.completions.create(model="mock", messages=MESSAGES, timeout=300)
+                )
+
+    await asyncio.gather(*[one() for _ in range(total)])
+
+
+async def run_new(base_url: str, total: int, concurrency: int):
+    """新方式：整个运行共用一个连接池和异步客户端"""
+    semaphore = asyncio.Semaphore(concurrency)
+    clients = ClientPool(max_connections=concurrency, max_keepalive_connections=concurrency)
+    client = clients.openai(base_url, "mock")
+
+    async def one():
+        async with semaphore:
+            await client.chat.completions.create(model="mock", messages=MESSAGES, timeout=300)
+
+    await asyncio.gather(*[one() for _ in range(total)])
+    await clients.aclose()
+
+
+def measure(name: str, runner, base_url: str, total: int, concurrency: int):
+    start = time.perf_counter()
+    asyncio.run(runner(base_url, total, concurrency))
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {total} 个请求耗时 {elapsed:.2f} 秒，{total / elapsed:.1f} 请求/秒")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="客户端连接池吞吐量对比")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务每个请求的延迟（秒）")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(config=MockConfig(latency=args.latency))
+    try:
+        old = measure("旧方式（每次新建客户端+线程池）", run_old, base_url, args.requests, args.concurrency)
+        new = measure("新方式（共享连接池+AsyncOpenAI）", run_new, base_url, args.requests, args.concurrency)
+        print(f"吞吐量提升: {new / old:.2f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
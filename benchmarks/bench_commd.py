@@ -0,0 +1,73 @@
+"""
+合并数千个章节，对比原先整体读入重写的合并与 sendfile 增量合并的耗时
+
+用法:
+    python benchmarks/bench_commd.py --chapters 5000 --size-kb 32
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "后处理模块"))
+
+from commd import SEPARATOR, merge_markdown_files  # noqa: E402
+
+PARAGRAPH = "设 $X$ 为拓扑空间，$\\mathcal{F}$ 为 $X$ 上的滤子。若 $x$ 的每个邻域都属于 $\\mathcal{F}$，则称其收敛。\n\n"
+
+
+def legacy_merge(folder_path, output_file):
+    """原先的合并：按字典序排序，逐个读入内存后写出"""
+    markdown_files = sorted(str(f) for f in Path(folder_path).glob('*.md'))
+    with open(output_file, 'w', encoding='utf-8') as outfile:
+        for i, md_file in enumerate(markdown_files):
+            with open(md_file, 'r', encoding='utf-8') as infile:
+                content = infile.read()
+            if i > 0:
+                outfile.write(SEPARATOR)
+            outfile.write(content)
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    # 合并函数会逐个打印文件名，压测时不输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed:.2f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="章节合并耗时对比")
+    parser.add_argument("--chapters", type=int, default=5000)
+    parser.add_argument("--size-kb", type=int, default=32, help="每个章节的大小（KB）")
+    args = parser.parse_args()
+
+    text = PARAGRAPH * max(1, args.size_kb * 1024 // len(PARAGRAPH.encode('utf-8')))
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "chapters"
+        folder.mkdir()
+        for i in range(args.chapters):
+            (folder / f"ch{i + 1}.md").write_text(f"# 第 {i + 1} 章\n\n{text}", encoding='utf-8')
+        output_file = str(Path(tmp) / "merged_output.md")
+        print(f"{args.chapters} 个章节，共 {args.chapters * args.size_kb / 1024:.0f} MB")
+
+        timed("原合并（整体读入、全部重写）", lambda: legacy_merge(folder, Path(tmp) / "legacy.md"))
+        timed("首次合并（sendfile）", lambda: merge_markdown_files(folder, output_file))
+        timed("无变化时再次合并", lambda: merge_markdown_files(folder, output_file))
+
+        # 修改靠后和居中的一个章节
+        for position in (args.chapters * 9 // 10, args.chapters // 2):
+            chapter = folder / f"ch{position}.md"
+            chapter.write_text(chapter.read_text(encoding='utf-8') + "修改后的内容\n", encoding='utf-8')
+            timed(f"修改第 {position} 章后增量合并", lambda: merge_markdown_files(folder, output_file))
+
+        print(f"合并结果大小: {os.path.getsize(output_file) / 1024 / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
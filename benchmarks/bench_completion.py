@@ -0,0 +1,125 @@
+"""
+用模拟的模型行为对比两种判断分段是否译完的方式：只看完成提示语，与按结束原因加覆盖率判断
+
+不发送网络请求。模拟的模型会按概率：回复被max_tokens截断、译完时没有输出完成提示语
+（被要求继续时才单独输出）、以及提前结束回复（其中一部分提前输出了完成提示语）。
+报告每种方式的请求数、输入/输出token数和没有发现的未译完分段数。
+
+用法:
+    python benchmarks/bench_completion.py --segments 2000 --premature-rate 0.05
+"""
+import argparse
+import random
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chunker import SENTINEL, estimate_tokens, strip_sentinel  # noqa: E402
+from completion import CompletionTracker  # noqa: E402
+
+MAX_TURNS = 20
+PROMPT_TOKENS = 800
+WORD_PATTERN = re.compile(r'[A-Za-z]+')
+PROTECTED_PATTERN = re.compile(r'(\$\$.+?\$\$|\$[^$\n]+?\$|!\[[^\]\n]*\]\([^)\n]*\)|^#{1,6} )', re.S | re.M)
+
+
+def make_source(rng: random.Random, paragraphs: int) -> str:
+    """生成带标题、行内公式、公式块和图片的原文分段"""
+    parts = []
+    for i in range(paragraphs):
+        if i % 6 == 0:
+            parts.append(f"## Section {rng.randint(1, 99)}.{i}")
+        n = rng.randint(0, 10 ** 6)
+        parts.append(f"Let $f_{{{n}}}$ be a continuous map and suppose that $x_{{{n}}} \\to y$ as the index grows.")
+        if i % 4 == 1:
+            parts.append(f"$$\n\\int_0^{{{n}}} f(t)\\,dt = F({n})\n$$")
+        if i % 9 == 2:
+            parts.append(f"![Figure {i}](images/fig{n}.png)")
+    return "\n\n".join(parts) + "\n"
+
+
+def fake_translate(source: str) -> str:
+    """公式、图片和标题标记原样保留，其余每个英文单词换成一个汉字"""
+    pieces = PROTECTED_PATTERN.split(source)
+    return "".join(piece if i % 2 else WORD_PATTERN.sub("译", piece) for i, piece in enumerate(pieces))
+
+
+def make_script(rng: random.Random, source: str, args):
+    """模拟的模型对一个分段依次给出的回复 [(文本, 结束原因)]，脚本用完后续写请求只返回完成提示语"""
+    full = fake_translate(source)
+    boundaries = [m.end() for m in re.finditer(r'\n\n', full)]
+    cuts = {}
+    if rng.random() < args.truncate_rate:
+        # 回复被max_tokens截断，停在任意位置
+        for position in range(args.max_chars, len(full), args.max_chars):
+            cuts[position] = "length"
+    premature = rng.random() < args.premature_rate and boundaries
+    if premature:
+        cuts[rng.choice(boundaries[:max(1, len(boundaries) * 3 // 4)])] = "stop"
+
+    turns = []
+    start = 0
+    for position in sorted(cuts):
+        text = full[start:position]
+        if cuts[position] == "stop" and rng.random() < args.early_sentinel_rate:
+            text += SENTINEL
+        turns.append((text, cuts[position]))
+        start = position
+    tail = full[start:]
+    # 译完时忘记输出完成提示语，要到下一轮续写请求中才单独输出
+    turns.append((tail if rng.random() < args.missing_sentinel_rate else tail + SENTINEL, "stop"))
+    return full, turns
+
+
+def run_policy(source: str, full: str, turns, use_tracker: bool):
+    """返回 (请求数, 输入token, 输出token, 是否译完)"""
+    tracker = CompletionTracker(source)
+    translation = ""
+    requests = input_tokens = output_tokens = 0
+    for turn in range(MAX_TURNS):
+        reply, finish_reason = turns[turn] if turn < len(turns) else (SENTINEL, "stop")
+        requests += 1
+        input_tokens += PROMPT_TOKENS + estimate_tokens(source) + estimate_tokens(translation)
+        output_tokens += estimate_tokens(reply)
+        translation += reply
+        done = tracker.update(reply, finish_reason) if use_tracker else SENTINEL in reply
+        if done:
+            break
+    return requests, input_tokens, output_tokens, strip_sentinel(translation) == full.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分段完成判断的请求数对比")
+    parser.add_argument("--segments", type=int, default=2000)
+    parser.add_argument("--paragraphs", type=int, default=12, help="每个分段的段落数")
+    parser.add_argument("--max-chars", type=int, default=600, help="被截断的回复每轮的字符数")
+    parser.add_argument("--truncate-rate", type=float, default=0.3, help="回复被max_tokens截断的分段比例")
+    parser.add_argument("--missing-sentinel-rate", type=float, default=0.2, help="译完时没有输出完成提示语的比例")
+    parser.add_argument("--premature-rate", type=float, default=0.05, help="提前结束回复的比例")
+    parser.add_argument("--early-sentinel-rate", type=float, default=0.5, help="提前结束时同时输出完成提示语的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.segments):
+        source = make_source(rng, args.paragraphs)
+        cases.append((source, *make_script(rng, source, args)))
+
+    print(f"=== 分段完成判断（{args.segments} 个分段）===")
+    print(f"{'方式':<12} {'请求数':>7} {'输入tokens':>12} {'输出tokens':>11} {'未译完':>6}")
+    for name, use_tracker in (("完成提示语", False), ("结束原因+覆盖率", True)):
+        totals = [0, 0, 0, 0]
+        for source, full, turns in cases:
+            requests, input_tokens, output_tokens, complete = run_policy(source, full, turns, use_tracker)
+            totals[0] += requests
+            totals[1] += input_tokens
+            totals[2] += output_tokens
+            totals[3] += not complete
+        print(f"{name:<12} {totals[0]:>7,} {totals[1]:>12,} {totals[2]:>11,} {totals[3]:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+对比原先只数 $ 个数的检查与逐行分隔符校验（单进程和多进程）的吞吐量
+
+用法:
+    python benchmarks/bench_dollar_checker.py --files 200 --size-kb 512
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "后处理模块"))
+
+from dollar_checker import validate_file  # noqa: E402
+
+PARAGRAPH = ("设 $X$ 为拓扑空间，$\\mathcal{F}$ 为 $X$ 上的滤子，价格为 \\$5，代码 `a $ b` 不是公式。\n\n"
+             "$$\n\\int_0^1 f(x)\\,dx = \\lim_{n\\to\\infty} \\frac{1}{n}\\sum_{k=1}^n f\\left(\\frac{k}{n}\\right)\n$$\n\n"
+             "```python\nprice = '$5'\n```\n\n")
+
+
+def legacy_check_file(file_path):
+    """原先的检查：整个文件读入内存后只比较 $$ 和 $ 的个数"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    double_dollars = content.count('$$')
+    single_dollars = content.count('$') - (2 * double_dollars)
+    return double_dollars % 2 == 0 and single_dollars % 2 == 0
+
+
+def make_corpus(directory: Path, files: int, size_kb: int):
+    text = PARAGRAPH * max(1, size_kb * 1024 // len(PARAGRAPH.encode('utf-8')))
+    for i in range(files):
+        (directory / f"ch{i + 1}.md").write_text(text, encoding='utf-8')
+    return sorted(directory.glob('*.md'))
+
+
+def timed(label, total_mb, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed:.2f} 秒，{total_mb / elapsed:.1f} MB/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="公式分隔符检查吞吐量对比")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=512, help="每个文件的大小（KB）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = make_corpus(Path(tmp), args.files, args.size_kb)
+        total_mb = sum(f.stat().st_size for f in files) / 1024 / 1024
+        print(f"{len(files)} 个文件，共 {total_mb:.0f} MB")
+
+        timed("原检查（只数个数）", total_mb, lambda: [legacy_check_file(f) for f in files])
+        timed("逐行校验（单进程）", total_mb, lambda: [validate_file(f) for f in files])
+
+        def parallel():
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(validate_file, files))
+
+        timed(f"逐行校验（{args.workers} 进程）", total_mb, parallel)
+
+
+if __name__ == "__main__":
+    main()
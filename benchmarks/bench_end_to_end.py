@@ -0,0 +1,138 @@
+"""
+在本地模拟服务上端到端运行 muliwork.py、streaming.py 和 mulidirct.py，
+报告每个入口的 文件/小时、输出tokens/秒、请求延迟p50/p95和重试次数
+
+用法:
+    python benchmarks/bench_end_to_end.py --files 20 --latency 0.2 --tokens-per-second 400 \\
+        --max-tokens 600 --rate-limit-rate 0.05 --overload-rate 0.02
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import completion  # noqa: E402
+from metrics import percentile  # noqa: E402
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+
+ENTRY_POINTS = ["muliwork", "streaming", "mulidirct"]
+
+PARAGRAPH = ("Let $X$ be a topological space and let $\\mathcal{F}$ be a filter on $X$. "
+             "We say that $\\mathcal{F}$ converges to $x$ if every neighbourhood of $x$ belongs to $\\mathcal{F}$.\n\n")
+
+
+def make_corpus(work_dir: Path, files: int, paragraphs: int):
+    """生成合成的待翻译文件"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        sections = "".join(f"## Section {j + 1}\n\n" + PARAGRAPH * 5 for j in range(paragraphs // 5 + 1))
+        (work_dir / f"ch{i + 1}.md").write_text(f"# Chapter {i + 1}\n\n" + sections, encoding='utf-8')
+
+
+def configure(module, base_url: str, root: Path, keys: int):
+    """把入口脚本的全局配置指向模拟服务和临时目录"""
+    module.BASE_URL = base_url
+    module.API_KEYS = [f"mock-key-{i + 1}" for i in range(keys)]
+    module.WORK_DIR = root / "workmd"
+    module.OUTPUT_DIR = root / "outputmd"
+    module.OUTPUT_DIR.mkdir(exist_ok=True)
+    module.CACHE_FILE = module.OUTPUT_DIR / "translation_cache.sqlite3"
+    module.JOURNAL_DIR = module.OUTPUT_DIR / ".journal"
+    module.MEMORY_FILE = module.OUTPUT_DIR / "translation_memory.sqlite3"
+    module.METRICS_FILE = module.OUTPUT_DIR / "metrics.jsonl"
+    module.PROMETHEUS_FILE = module.OUTPUT_DIR / "metrics.prom"
+    module.RATE_LIMIT_COOLDOWN = 0.5
+    if hasattr(module, "SEGMENT_DIR"):
+        module.SEGMENT_DIR = module.OUTPUT_DIR / ".segments"
+    if hasattr(module, "STREAM_QUALITY_GATE"):
+        # 模拟的回复是同一句话的重复，会被循环检查中止
+        module.STREAM_QUALITY_GATE = False
+    # 模拟的回复不包含原文的标题和公式，不按覆盖率判断是否译完
+    completion.MIN_ANCHOR_COVERAGE = 0.0
+    completion.MIN_LENGTH_RATIO = 0.0
+
+
+def run_entry(name: str, base_url: str, config: MockConfig, args):
+    """在独立的临时目录中运行一个入口，返回统计结果"""
+    module = importlib.import_module(name)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        make_corpus(root / "workmd", args.files, args.paragraphs)
+        # Anthropic SDK 会自行拼接 /v1
+        configure(module, base_url[:-len("/v1")] if name == "mulidirct" else base_url, root, args.keys)
+
+        with config.lock:
+            first_record = len(config.records)
+        entry = module.process_markdown_files if name == "mulidirct" else module.main
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+            asyncio.run(entry())
+        elapsed = time.perf_counter() - start
+        translated = len(list(module.OUTPUT_DIR.glob("translated_*.md")))
+
+    with config.lock:
+        records = config.records[first_record:]
+    succeeded = [r for r in records if r["status"] == 200]
+    latencies = [r["end"] - r["start"] for r in succeeded]
+    first_bytes = [r["first_byte"] - r["start"] for r in succeeded if r["stream"] and r["first_byte"]]
+    output_tokens = sum(r["output_tokens"] for r in succeeded)
+    return {
+        "entry": name,
+        "elapsed": elapsed,
+        "files": translated,
+        "files_per_hour": translated / elapsed * 3600,
+        "tokens_per_second": output_tokens / elapsed,
+        "requests": len(records),
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "ttft_p50": percentile(first_bytes, 0.5),
+        "rate_limited": sum(1 for r in records if r["status"] == 429),
+        "overloaded": sum(1 for r in records if r["status"] == 529),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="翻译脚本端到端吞吐量测试")
+    parser.add_argument("--entry", action="append", choices=ENTRY_POINTS, help="只测试指定入口，可重复")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=40, help="每个文件的段落数")
+    parser.add_argument("--keys", type=int, default=4, help="模拟的API密钥个数")
+    parser.add_argument("--latency", type=float, default=0.2, help="首字节延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=400, help="每个请求的输出速度")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="每个分段的译文长度")
+    parser.add_argument("--max-tokens", type=int, default=None, help="每次回复的最大token数，超出时截断并续写")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="返回529的概率")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="显示入口脚本自身的输出")
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                        reply="这是模拟的译文，其中包含行内公式 $x$。", reply_chars=args.reply_chars,
+                        max_tokens=args.max_tokens, rate_limit_rate=args.rate_limit_rate,
+                        overload_rate=args.overload_rate, seed=args.seed)
+    server, base_url = start_mock_server(config=config)
+    try:
+        results = [run_entry(name, base_url, config, args) for name in (args.entry or ENTRY_POINTS)]
+    finally:
+        server.shutdown()
+
+    print(f"\n=== 端到端测试结果（{args.files} 个文件，{args.keys} 个密钥）===")
+    print(f"{'入口':<10} {'耗时':>7} {'文件':>5} {'文件/小时':>9} {'tokens/秒':>9} {'请求数':>6} "
+          f"{'p50':>6} {'p95':>6} {'首字p50':>7} {'429':>5} {'529':>5}")
+    for r in results:
+        print(f"{r['entry']:<10} {r['elapsed']:>6.1f}s {r['files']:>5} {r['files_per_hour']:>9.0f} "
+              f"{r['tokens_per_second']:>9.0f} {r['requests']:>6} {r['p50']:>5.2f}s {r['p95']:>5.2f}s "
+              f"{r['ttft_p50']:>6.2f}s {r['rate_limited']:>5} {r['overloaded']:>5}")
+
+
+if __name__ == "__main__":
+    main()
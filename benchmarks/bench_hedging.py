@@ -0,0 +1,70 @@
+"""
+用模拟的长尾延迟对比开启和关闭请求对冲时整批的总耗时和额外请求数
+
+不发送网络请求：每个请求按对数正态分布睡眠，少部分请求落在很慢的长尾上。
+
+用法:
+    python benchmarks/bench_hedging.py --segments 200 --keys 8 --slow-rate 0.03
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import hedging  # noqa: E402
+from hedging import Hedger  # noqa: E402
+from key_pool import KeyPool  # noqa: E402
+
+
+async def run_batch(args, enabled: bool):
+    rng = random.Random(args.seed)
+    key_pool = KeyPool([f"sk-bench-{i:04d}" for i in range(args.keys)])
+    hedger = Hedger(key_pool, enabled, min_delay=args.min_delay)
+    failures = []
+    outputs = [rng.randint(200, 2000) for _ in range(args.segments)]
+
+    async def translate(tokens: int):
+        async def send(key, hedge):
+            # 每个输出token约 scale 秒，长尾请求慢 slow_factor 倍
+            delay = tokens * args.scale * rng.lognormvariate(0, 0.3)
+            if rng.random() < args.slow_rate:
+                delay *= args.slow_factor
+            await asyncio.sleep(delay)
+            return tokens
+
+        return await hedger.run(f"seg{tokens}", tokens, tokens, tokens, send,
+                                lambda key, started, error: failures.append(error))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(translate(tokens) for tokens in outputs))
+    return time.perf_counter() - start, hedger
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求对冲的总耗时对比")
+    parser.add_argument("--segments", type=int, default=200)
+    parser.add_argument("--keys", type=int, default=8)
+    parser.add_argument("--scale", type=float, default=0.0005, help="每个输出token的模拟秒数")
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--min-delay", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # 模拟的请求只有几百毫秒，检查间隔相应缩短
+    hedging.POLL_INTERVAL = 0.02
+
+    for enabled in (False, True):
+        elapsed, hedger = asyncio.run(run_batch(args, enabled))
+        extra = hedger.hedge_tokens / hedger.primary_tokens if hedger.primary_tokens else 0.0
+        print(f"{'开启对冲' if enabled else '关闭对冲'}: 总耗时 {elapsed:.2f} 秒，对冲 {hedger.hedges} 次，"
+              f"先返回 {hedger.hedge_wins} 次，额外token {extra:.1%}，"
+              f"原请求比对冲请求多等待 {hedger.measured_saved:.2f} 秒（实测），"
+              f"预计还需等待 {hedger.saved_time:.2f} 秒（估计）")
+
+
+if __name__ == "__main__":
+    main()
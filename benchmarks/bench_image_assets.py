@@ -0,0 +1,87 @@
+"""
+放置数千张OCR页面截图：对比手工逐个复制与按内容哈希去重、并行硬链接的耗时和占用空间，以及重复运行的耗时
+
+用法:
+    python benchmarks/bench_image_assets.py --images 3000 --size-kb 200 --duplicate-rate 0.2
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "后处理模块"))
+
+from image import ImageAssets  # noqa: E402
+
+
+def make_corpus(root: Path, images: int, size: int, duplicate_rate: float, rng: random.Random):
+    """生成图片和引用它们的markdown文件；每页的图片放在各自的目录，文件名相同（如 fig1.png）"""
+    md_files = []
+    previous = None
+    for page in range(images):
+        page_dir = root / "ocr" / f"page{page:05d}"
+        page_dir.mkdir(parents=True)
+        data = previous if previous is not None and rng.random() < duplicate_rate else rng.randbytes(size)
+        (page_dir / "fig1.png").write_bytes(data)
+        previous = data
+        md_file = root / "ocr" / f"page{page:05d}.md"
+        md_file.write_text(f"第 {page} 页\n\n![]({page_dir.name}/fig1.png)\n", encoding='utf-8')
+        md_files.append(str(md_file))
+    return md_files
+
+
+def disk_usage(folder: Path) -> int:
+    """按inode统计目录占用的字节数，硬链接的文件只算一次"""
+    seen = set()
+    total = 0
+    for path in folder.rglob('*'):
+        stat = path.stat()
+        if path.is_file() and stat.st_ino not in seen:
+            seen.add(stat.st_ino)
+            total += stat.st_blocks * 512
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片放置耗时测试")
+    parser.add_argument("--images", type=int, default=3000)
+    parser.add_argument("--size-kb", type=int, default=200)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="与上一页图片内容相同的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        md_files = make_corpus(root, args.images, args.size_kb * 1024, args.duplicate_rate, rng)
+        source_bytes = disk_usage(root / "ocr")
+
+        # 手工做法：逐个复制到 images/，同名文件互相覆盖
+        manual_dir = root / "manual" / "images"
+        manual_dir.mkdir(parents=True)
+        start = time.perf_counter()
+        for md_file in md_files:
+            page_dir = Path(md_file).with_suffix('')
+            shutil.copy2(page_dir / "fig1.png", manual_dir / "fig1.png")
+        manual_time = time.perf_counter() - start
+        print(f"逐个复制: {manual_time:.2f} 秒，images/ 中只剩 {len(os.listdir(manual_dir))} 个文件（同名覆盖）")
+
+        assets = ImageAssets(root / "out" / "images")
+        start = time.perf_counter()
+        assets.sync(md_files)
+        first = time.perf_counter() - start
+        placed = len([p for p in (root / "out" / "images").iterdir() if p.suffix == '.png'])
+        extra = disk_usage(root) - source_bytes - disk_usage(root / "manual")
+        print(f"哈希去重并硬链接: {first:.2f} 秒，放置 {placed} 个文件，额外占用 {extra / 1024 / 1024:.1f} MB")
+
+        start = time.perf_counter()
+        ImageAssets(root / "out" / "images").sync(md_files)
+        print(f"重复运行: {time.perf_counter() - start:.2f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+流式质量检查的开销和效果：正常译文逐个delta检查的耗时，以及循环、公式错误和超长回复在多少token后被中止
+
+用法:
+    python benchmarks/bench_quality_gate.py --segments 200 --delta-chars 8
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from quality_gate import StreamGate  # noqa: E402
+
+SOURCE = "Let $X_{n}$ be a topological space with basis $\\mathcal{B}_{n}$ and let $x_{n} \\in X_{n}$.\n\n"
+TRANSLATION = "设 $X_{n}$ 是一个以 $\\mathcal{B}_{n}$ 为基的拓扑空间，并设 $x_{n} \\in X_{n}$。\n\n"
+
+
+def make_pair(rng: random.Random, paragraphs: int):
+    """生成每段编号不同的原文和对应的正常译文"""
+    numbers = [rng.randint(0, 10 ** 6) for _ in range(paragraphs)]
+    source = "".join(SOURCE.replace("{n}", f"{{{n}}}") for n in numbers)
+    translation = "".join(TRANSLATION.replace("{n}", f"{{{n}}}") for n in numbers)
+    return source, translation
+
+
+def feed(gate: StreamGate, reply: str, delta_chars: int):
+    """按delta喂给检查器，返回中止原因和中止时收到的token数（未中止时为None）"""
+    for i in range(0, len(reply), delta_chars):
+        reason = gate.feed(reply[i:i + delta_chars])
+        if reason is not None:
+            return reason, gate.abort(reason)
+    return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式质量检查测试")
+    parser.add_argument("--segments", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=20, help="每个分段的段落数")
+    parser.add_argument("--delta-chars", type=int, default=8, help="每个delta的字符数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pairs = [make_pair(rng, args.paragraphs) for _ in range(args.segments)]
+
+    start = time.perf_counter()
+    deltas = false_aborts = 0
+    for source, translation in pairs:
+        reason, _ = feed(StreamGate(source), translation, args.delta_chars)
+        deltas += -(-len(translation) // args.delta_chars)
+        false_aborts += reason is not None
+    elapsed = time.perf_counter() - start
+    print(f"正常译文: {args.segments} 个分段，{deltas} 个delta，每个delta {elapsed / deltas * 1e6:.1f} 微秒，"
+          f"误中止 {false_aborts} 次")
+
+    cases = {
+        "循环输出": lambda t: t[:len(t) // 3] + "我们再重复一遍上面的结论。" * 2000,
+        "公式未闭合": lambda t: t.replace("$。", "。"),
+        "远长于原文": lambda t: t * 10,
+    }
+    for name, broken in cases.items():
+        aborted = tokens = saved = 0
+        for source, translation in pairs:
+            reason, abort = feed(StreamGate(source), broken(translation), args.delta_chars)
+            if abort is not None:
+                aborted += 1
+                tokens += abort.output_tokens
+                saved += abort.saved_tokens
+        print(f"{name}: 中止 {aborted}/{args.segments} 个分段，平均在 {tokens / max(aborted, 1):.0f} tokens 后中止，"
+              f"估计共节省 {saved:,} 个输出token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+对比 repro.process_markdown_text 原先基于repr的多遍替换实现与一次扫描实现的耗时和峰值内存
+
+用法:
+    python benchmarks/bench_repro.py --sizes 1,10,100
+"""
+import argparse
+import ast
+import gc
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "后处理模块"))
+
+from repro import process_markdown_text  # noqa: E402
+
+PARAGRAPH = ("设 $X$ 为拓扑空间，$\\mathcal{F}$ 为 $X$ 上的滤子。若 $x$ 的每个邻域都属于 $\\mathcal{F}$，\n"
+             "则称 $\\mathcal{F}$ 收敛到 $x$，记作 $\\left( x_n ight)$ 与 $abla f$。\n\n"
+             "$$\n\\int_0^1 f(x)\\,dx = \\lim_{n\\to\\infty} \\sum_{k=1}^n f\\left(\\frac{k}{n}ight)\\frac{1}{n}\n$$\n"
+             "| a |\n| b |\n表格之后的正文，其中包含字面量 \\n 和 'quote'。\n")
+
+
+def legacy_process_markdown_text(content):
+    """原先的实现，作为对照"""
+    repr_content = repr(content)
+
+    formulas = []
+
+    def save_formula(match):
+        formulas.append(match.group(0))
+        return f"###FORMULA###" + str(len(formulas) - 1) + "###"
+
+    pattern = r'\$\$[^$]+\$\$|\$[^$]+\$'
+    protected_text = re.sub(pattern, save_formula, repr_content)
+    protected_text = re.sub(r'\|\\n\|', r'###PIPE_N###', protected_text)
+    protected_text = re.sub(r'(?<!\\n)\\n(?!\\n)', r'\\n\\n', protected_text)
+    protected_text = protected_text.replace('###PIPE_N###', r'|\n|')
+
+    def process_formula(formula):
+        formula = re.sub(r'ightbrack', r'ight\\\\rbrack', formula)
+        formula = re.sub(r'(?<![rR])(ight)', r'\\\\right', formula)
+        formula = re.sub(r'(?<!n)abla(?![a-zA-Z])', r'\\\\nabla', formula)
+        return formula
+
+    def restore_formula(match):
+        formula_str = match.group(0)
+        index = int(formula_str.split('###')[2])
+        formula = formulas[index]
+        return process_formula(formula)
+
+    final_repr_text = re.sub(r'###FORMULA###\d+###', restore_formula, protected_text)
+    return ast.literal_eval(final_repr_text)
+
+
+def make_document(size_mb: float) -> str:
+    """生成约 size_mb MB（UTF-8）的合成文档"""
+    paragraph_bytes = len(PARAGRAPH.encode('utf-8'))
+    return PARAGRAPH * max(1, int(size_mb * 1024 * 1024 / paragraph_bytes))
+
+
+def measure(func, content):
+    """返回 (结果, 耗时, 峰值内存MB)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(content)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="repro 处理速度与内存对比")
+    parser.add_argument("--sizes", default="1,10", help="文档大小（MB），逗号分隔")
+    args = parser.parse_args()
+
+    print(f"{'大小':>8} {'原实现耗时':>10} {'原实现峰值':>10} {'新实现耗时':>10} {'新实现峰值':>10} {'加速':>6}")
+    for size in (float(s) for s in args.sizes.split(',')):
+        content = make_document(size)
+        legacy, legacy_time, legacy_peak = measure(legacy_process_markdown_text, content)
+        current, current_time, current_peak = measure(process_markdown_text, content)
+        if legacy != current:
+            raise AssertionError(f"{size} MB 文档的输出与原实现不一致")
+        del legacy, current
+        print(f"{size:>6.0f}MB {legacy_time:>9.2f}s {legacy_peak:>8.0f}MB "
+              f"{current_time:>9.2f}s {current_peak:>8.0f}MB {legacy_time / current_time:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
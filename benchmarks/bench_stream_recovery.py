@@ -0,0 +1,86 @@
+"""
+流式回复中途断开时，对比丢弃重来与保留已收到的段落后从断点继续：总耗时、请求数、计费的输出token数，
+并检查拼接后的译文与完整回复一致（没有重复或缺失的段落）
+
+用法:
+    python benchmarks/bench_stream_recovery.py --files 5 --disconnect-rate 0.3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import streaming  # noqa: E402
+from bench_end_to_end import configure, make_corpus  # noqa: E402
+from chunker import assemble_segments, split_markdown, strip_sentinel  # noqa: E402
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+
+REPLY = "这是模拟的译文，其中包含行内公式 $x$。\n\n"
+
+
+def run(args, salvage: bool):
+    config = MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second, reply=REPLY,
+                        reply_chars=args.reply_chars, disconnect_rate=args.disconnect_rate, seed=args.seed)
+    server, base_url = start_mock_server(config=config)
+    streaming.SALVAGE_PARTIAL_STREAMS = salvage
+    # 只比较断开后的处理方式，关闭对冲
+    streaming.HEDGE_REQUESTS = False
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            make_corpus(root / "workmd", args.files, args.paragraphs)
+            configure(streaming, base_url, root, args.keys)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                asyncio.run(streaming.main())
+            elapsed = time.perf_counter() - start
+
+            expected = strip_sentinel(config.full_reply())
+            correct = 0
+            for source in sorted((root / "workmd").glob("*.md")):
+                output = root / "outputmd" / f"translated_{source.name}"
+                segments = split_markdown(source.read_text(encoding='utf-8'), streaming.SEGMENT_MAX_TOKENS)
+                if output.exists() and output.read_text(encoding='utf-8') == \
+                        assemble_segments([expected] * len(segments)):
+                    correct += 1
+    finally:
+        server.shutdown()
+
+    return {
+        "elapsed": elapsed,
+        "requests": len(config.records),
+        "cuts": sum(1 for r in config.records if r["status"] == "cut"),
+        "output_tokens": sum(r["output_tokens"] for r in config.records),
+        "correct": correct,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流中断恢复测试")
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=40, help="每个文件的段落数")
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.1, help="首字节延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="每个请求的输出速度")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="每个分段的译文长度")
+    parser.add_argument("--disconnect-rate", type=float, default=0.3, help="流式回复中途断开的概率")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="显示入口脚本自身的输出")
+    args = parser.parse_args()
+
+    print(f"=== 流中断恢复（{args.files} 个文件，断开概率 {args.disconnect_rate:.0%}）===")
+    print(f"{'模式':<8} {'耗时':>7} {'请求数':>6} {'断开':>5} {'输出tokens':>10} {'译文正确':>8}")
+    for salvage in (False, True):
+        r = run(args, salvage)
+        print(f"{'断点续写' if salvage else '丢弃重来':<8} {r['elapsed']:>6.1f}s {r['requests']:>6} {r['cuts']:>5} "
+              f"{r['output_tokens']:>10,} {r['correct']:>5}/{args.files}")
+
+
+if __name__ == "__main__":
+    main()
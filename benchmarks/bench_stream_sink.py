@@ -0,0 +1,75 @@
+"""
+对比旧的流式写入方式（每个delta重新打开文件 + 字符串 += 拼接）与 StreamSink 的吞吐量
+
+用法:
+    python benchmarks/bench_stream_sink.py --chunks 20000
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chunker import SENTINEL  # noqa: E402
+from stream_sink import StreamSink  # noqa: E402
+
+
+def make_chunks(count: int, seed: int = 0):
+    """生成模拟的delta序列，提示语被拆在最后两个delta之间"""
+    rng = random.Random(seed)
+    text = "设 $X$ 是一个拓扑空间，$\\mathcal{F}$ 是 $X$ 上的一个滤子。"
+    chunks = []
+    for _ in range(count):
+        start = rng.randrange(len(text))
+        chunks.append(text[start:start + rng.randint(1, 12)])
+    chunks.append("\n\n" + SENTINEL[:3])
+    chunks.append(SENTINEL[3:])
+    return chunks
+
+
+def old_sink(chunks, output_file):
+    """旧方式：每个delta都重新打开文件追加，并用 += 拼接完整回复"""
+    full_response = ""
+    for content in chunks:
+        full_response += content
+        with open(output_file, 'a', encoding='utf-8') as f:
+            f.write(content)
+    return full_response, SENTINEL in full_response
+
+
+def new_sink(chunks, output_file):
+    """新方式：StreamSink 缓冲写入并增量检测提示语"""
+    with StreamSink(output_file) as sink:
+        for content in chunks:
+            sink.write(content)
+    return sink.getvalue(), sink.completed
+
+
+def measure(name, sink, chunks, workdir: Path):
+    output_file = workdir / f"{name}.md"
+    start = time.perf_counter()
+    reply, completed = sink(chunks, output_file)
+    elapsed = time.perf_counter() - start
+    assert completed, f"{name} 没有检测到完成提示语"
+    assert output_file.read_text(encoding='utf-8') == reply
+    print(f"{name}: {len(chunks)} 个delta耗时 {elapsed:.3f} 秒，{len(chunks) / elapsed:,.0f} delta/秒")
+    return len(chunks) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式写入吞吐量对比")
+    parser.add_argument("--chunks", type=int, default=20000)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    with tempfile.TemporaryDirectory() as tmp:
+        old = measure("old", old_sink, chunks, Path(tmp))
+        new = measure("new", new_sink, chunks, Path(tmp))
+    print(f"吞吐量提升: {new / old:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+向翻译记忆写入数十万条合成段落，测量每个段落的查询耗时和近似重复段落的召回率
+
+用法:
+    python benchmarks/bench_translation_memory.py --entries 300000 --queries 2000
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from metrics import percentile  # noqa: E402
+from translation_memory import REUSE_THRESHOLD, TranslationMemory  # noqa: E402
+
+WORDS = ("space set filter point open closed compact map function sequence limit converges every neighbourhood "
+         "belongs subset topology metric continuous bounded measure integral random variable process martingale "
+         "theorem lemma proof definition let be we say that if then for all there exists such the of a an is").split()
+# 每个段落写入一个分段，分段内段落数
+PARAGRAPHS_PER_SEGMENT = 50
+
+
+def make_paragraph(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(20, 80))]
+    return f"{' '.join(words).capitalize()} with $x_{{{rng.randint(1, 999)}}}$."
+
+
+def mutate(rng: random.Random, paragraph: str) -> str:
+    """替换一个词，得到近似重复的段落"""
+    words = paragraph.split()
+    position = rng.randrange(len(words) - 2)
+    words[position] = rng.choice(WORDS)
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="翻译记忆查询耗时测试")
+    parser.add_argument("--entries", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    paragraphs = [make_paragraph(rng) for _ in range(args.entries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "translation_memory.sqlite3"
+        memory = TranslationMemory(db_path, "prompt", "model")
+        start = time.perf_counter()
+        for i in range(0, len(paragraphs), PARAGRAPHS_PER_SEGMENT):
+            chunk = paragraphs[i:i + PARAGRAPHS_PER_SEGMENT]
+            memory.add("\n\n".join(chunk), "\n\n".join(f"译文{j}" for j in range(i, i + len(chunk))))
+        print(f"写入 {len(memory.signatures)} 条记忆: {time.perf_counter() - start:.1f} 秒")
+        memory.close()
+        memory = None
+
+        start = time.perf_counter()
+        memory = TranslationMemory(db_path, "prompt", "model")
+        print(f"重新加载索引: {time.perf_counter() - start:.1f} 秒")
+
+        def timed_lookups(texts, threshold):
+            latencies = []
+            hits = 0
+            for text in texts:
+                begin = time.perf_counter()
+                hits += bool(memory.lookup(text, threshold))
+                latencies.append((time.perf_counter() - begin) * 1000)
+            return latencies, hits
+
+        samples = rng.sample(paragraphs, min(args.queries, len(paragraphs)))
+        cases = [
+            ("完全相同", samples, REUSE_THRESHOLD),
+            ("替换一个词", [mutate(rng, p) for p in samples], 0.6),
+            ("新段落", [make_paragraph(rng) for _ in samples], 0.6),
+        ]
+        for label, texts, threshold in cases:
+            latencies, hits = timed_lookups(texts, threshold)
+            print(f"{label}: 命中 {hits}/{len(texts)}，每段 p50 {percentile(latencies, 0.5):.3f} 毫秒，"
+                  f"p99 {percentile(latencies, 0.99):.3f} 毫秒")
+        memory.close()
+
+
+if __name__ == "__main__":
+    main()
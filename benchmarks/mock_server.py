@@ -0,0 +1,476 @@
+"""
+本地模拟大模型服务，用于在不花钱的情况下测试和压测翻译脚本
+
+支持 OpenAI chat completions 和 Anthropic messages（均支持流式和非流式）以及 message batches 接口，
+可以配置首字节延迟、输出速度、max_tokens截断、429/529错误注入、流式回复中途断开、每个密钥的并发容量和完成提示语，
+以及查询批次状态时的错误注入（批次取消后未到结束时间的请求结果为 canceled）。
+回复被截断后，带着已输出内容的续写请求会从截断处继续，直到输出完成提示语。
+
+用法:
+    python benchmarks/mock_server.py --port 8765 --latency 0.05 --tokens-per-second 200 --max-tokens 500
+    然后把 muliwork.py/streaming.py 的 BASE_URL 设为 http://127.0.0.1:8765/v1，
+    mulidirct.py 的 BASE_URL 设为 http://127.0.0.1:8765
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SENTINEL = "本次翻译任务完成"
+DEFAULT_REPLY = "这是模拟的译文。" + DEFAULT_SENTINEL
+
+
+class StreamCut(Exception):
+    """流式回复在中途断开连接"""
+
+
+class MockConfig:
+    """模拟服务的行为参数，以及收到的每个请求的记录"""
+
+    def __init__(self, latency: float = 0.05, reply: str = DEFAULT_REPLY, chunk_size: int = 8,
+                 batch_delay: float = 1.0, tokens_per_second: float = 0, max_tokens: int = None,
+                 reply_chars: int = 0, sentinel: str = DEFAULT_SENTINEL, rate_limit_rate: float = 0.0,
+                 overload_rate: float = 0.0, capacity: int = 0, disconnect_rate: float = 0.0,
+                 batch_poll_error_rate: float = 0.0, seed: int = None):
+        self.latency = latency  # 收到请求到返回首个字节的延迟（秒）
+        self.reply = reply  # 每次请求返回的文本
+        self.chunk_size = chunk_size  # 流式返回时每个delta的字符数
+        self.batch_delay = batch_delay  # 批次从提交到结束的时间（秒）
+        self.tokens_per_second = tokens_per_second  # 输出速度（每个字符按一个token计），0表示不限制
+        self.max_tokens = max_tokens  # 每次回复的最大token数，请求中的max_tokens更小时以请求为准
+        self.reply_chars = reply_chars  # 大于0时把reply重复到这个长度，再加上完成提示语
+        self.sentinel = sentinel  # 完成提示语
+        self.rate_limit_rate = rate_limit_rate  # 返回429的概率
+        self.overload_rate = overload_rate  # 返回529的概率
+        self.capacity = capacity  # 每个密钥同时处理的请求数上限，超出时返回529，0表示不限制
+        self.disconnect_rate = disconnect_rate  # chat completions 流式回复在随机位置断开连接的概率
+        self.batch_poll_error_rate = batch_poll_error_rate  # 查询批次状态时返回529的概率
+        self.active = {}  # 密钥 -> 正在处理的请求数
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.records = []  # 每个请求一条：路径、状态码、开始/首字节/结束时间、输出token数
+        self.batches = {}
+        self.batch_count = 0  # 创建的批次数
+        self.batch_request_count = 0  # 所有批次中的请求总数
+        self.lock = threading.Lock()
+
+    def count_request(self):
+        with self.lock:
+            self.request_count += 1
+
+    def full_reply(self) -> str:
+        """一个分段的完整回复"""
+        if self.reply_chars <= 0:
+            return self.reply
+        body = self.reply.replace(self.sentinel, "") if self.sentinel else self.reply
+        body = (body * (self.reply_chars // max(1, len(body)) + 1))[:self.reply_chars]
+        return body + self.sentinel
+
+    def next_reply(self, body) -> tuple:
+        """
+        根据请求生成本次回复，返回 (文本, 是否被max_tokens截断)
+
+        请求中已有的assistant消息视为已经输出的部分，从其后继续。
+        """
+        full = self.full_reply()
+        delivered = sum(len(message_text(m)) for m in body.get('messages', []) if m.get('role') == 'assistant')
+        remaining = full[delivered:] if delivered < len(full) else self.sentinel
+
+        limits = [n for n in (self.max_tokens, body.get('max_tokens'), body.get('max_completion_tokens')) if n]
+        if limits and len(remaining) > min(limits):
+            return remaining[:min(limits)], True
+        return remaining, False
+
+    def inject_error(self):
+        """按配置的概率返回要注入的错误状态码，不注入时返回None"""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.overload_rate:
+            return 529
+        return None
+
+    def inject_poll_error(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.batch_poll_error_rate
+
+    def cut_point(self, reply: str):
+        """按配置的概率返回流式回复断开的位置（字符数），不断开时返回None"""
+        with self.lock:
+            if len(reply) < 2 or self.random.random() >= self.disconnect_rate:
+                return None
+            return self.random.randrange(1, len(reply))
+
+    def enter(self, api_key: str) -> bool:
+        """占用该密钥的一个并发名额，超出容量时返回False"""
+        with self.lock:
+            if self.capacity and self.active.get(api_key, 0) >= self.capacity:
+                return False
+            self.active[api_key] = self.active.get(api_key, 0) + 1
+            return True
+
+    def leave(self, api_key: str):
+        with self.lock:
+            self.active[api_key] -= 1
+
+    def record(self, **fields):
+        with self.lock:
+            self.records.append(fields)
+
+
+def message_text(message) -> str:
+    """取出消息中的文本，兼容字符串和内容块列表两种格式"""
+    content = message.get('content', '')
+    if isinstance(content, str):
+        return content
+    return "".join(block.get('text', '') for block in content if isinstance(block, dict))
+
+
+def prompt_tokens(body) -> int:
+    system = body.get('system', '')
+    system_text = system if isinstance(system, str) else message_text({'content': system})
+    return (len(system_text) + sum(len(message_text(m)) for m in body.get('messages', []))) // 4
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_events(self, events):
+        """
+        以SSE格式逐个发送事件，使用分块传输编码以保持长连接，返回首个事件发出的时间
+
+        事件生成器抛出 StreamCut 时不发送结束块，直接关闭连接。
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        first_byte = None
+        try:
+            for event in events:
+                data = event.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+                first_byte = first_byte or time.monotonic()
+        except StreamCut:
+            self.close_connection = True
+            return first_byte
+        self.wfile.write(b"0\r\n\r\n")
+        return first_byte
+
+    def send_error_payload(self, status):
+        """按请求的接口格式返回429限流或529过载错误"""
+        anthropic_style = self.path.endswith('/messages')
+        if status == 429:
+            error_type, message = "rate_limit_error", "Rate limit exceeded (injected by mock server)"
+        else:
+            error_type, message = "overloaded_error", "Overloaded (injected by mock server)"
+        if anthropic_style:
+            payload = {"type": "error", "error": {"type": error_type, "message": message}}
+        else:
+            payload = {"error": {"message": message, "type": error_type, "code": error_type}}
+        self.send_json(payload, status=status)
+
+    def pace(self, text):
+        """按配置的输出速度等待输出这段文本所需的时间"""
+        if self.config.tokens_per_second > 0 and text:
+            time.sleep(len(text) / self.config.tokens_per_second)
+
+    def do_POST(self):
+        body = self.read_json()
+        self.config.count_request()
+        start = time.monotonic()
+
+        if self.path.endswith('/messages/batches'):
+            self.create_batch(body)
+            return
+        if '/messages/batches/' in self.path and self.path.endswith('/cancel'):
+            self.cancel_batch(self.path.rstrip('/').split('/')[-2])
+            return
+
+        api_key = self.headers.get('x-api-key') or self.headers.get('Authorization', '')
+        if not self.config.enter(api_key):
+            time.sleep(self.config.latency)
+            self.send_error_payload(529)
+            self.config.record(path=self.path, stream=bool(body.get('stream')), status=529,
+                               start=start, first_byte=None, end=time.monotonic(), output_tokens=0)
+            return
+        try:
+            self.respond(body, start)
+        finally:
+            self.config.leave(api_key)
+
+    def respond(self, body, start: float):
+        time.sleep(self.config.latency)
+        status = self.config.inject_error()
+        if status is not None:
+            self.send_error_payload(status)
+            self.config.record(path=self.path, stream=bool(body.get('stream')), status=status,
+                               start=start, first_byte=None, end=time.monotonic(), output_tokens=0)
+            return
+
+        reply, truncated = self.config.next_reply(body)
+        self.output_chars = len(reply)  # 流式回复中途断开时为实际发出的字符数
+        self.cut = False
+        if self.path.endswith('/chat/completions'):
+            first_byte = self.chat_completions(body, reply, truncated)
+        elif self.path.endswith('/messages'):
+            first_byte = self.messages(body, reply, truncated)
+        else:
+            self.send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+            return
+        self.config.record(path=self.path, stream=bool(body.get('stream')), status="cut" if self.cut else 200,
+                           start=start, first_byte=first_byte, end=time.monotonic(), output_tokens=self.output_chars)
+
+    def do_GET(self):
+        parts = self.path.rstrip('/').split('/')
+        if 'batches' in parts and parts[-1] == 'results':
+            self.batch_results(parts[-2])
+        elif 'batches' in parts:
+            self.retrieve_batch(parts[-1])
+        else:
+            self.send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def chat_completions(self, body, reply, truncated):
+        tokens = prompt_tokens(body)
+        usage = {"prompt_tokens": tokens, "completion_tokens": len(reply),
+                 "total_tokens": tokens + len(reply)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        finish_reason = "length" if truncated else "stop"
+
+        if not body.get('stream'):
+            self.pace(reply)
+            self.send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get('model', ''),
+                "choices": [{"index": 0, "finish_reason": finish_reason,
+                             "message": {"role": "assistant", "content": reply}}],
+                "usage": usage,
+            })
+            return time.monotonic()
+
+        def events():
+            size = self.config.chunk_size
+            cut = self.config.cut_point(reply)
+            for i in range(0, len(reply), size):
+                if cut is not None and i >= cut:
+                    self.output_chars, self.cut = i, True
+                    raise StreamCut()
+                piece = reply[i:i + size]
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get('model', ''),
+                    "choices": [{"index": 0, "finish_reason": None,
+                                 "delta": {"content": piece}}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                self.pace(piece)
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', ''),
+                "choices": [{"index": 0, "finish_reason": finish_reason, "delta": {}}],
+                "usage": usage,
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return self.send_events(events())
+
+    def message_payload(self, body, reply=None, truncated=False):
+        """构造一个 Anthropic messages 响应"""
+        if reply is None:
+            reply, truncated = self.config.next_reply(body)
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get('model', ''),
+            "content": [{"type": "text", "text": reply}],
+            "stop_reason": "max_tokens" if truncated else "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": prompt_tokens(body), "output_tokens": len(reply)},
+        }
+
+    def messages(self, body, reply, truncated):
+        message = self.message_payload(body, reply, truncated)
+        if not body.get('stream'):
+            self.pace(reply)
+            self.send_json(message)
+            return time.monotonic()
+
+        def sse(event_type, payload):
+            return f"event: {event_type}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        def events():
+            start = dict(message, content=[], stop_reason=None,
+                         usage={"input_tokens": message["usage"]["input_tokens"], "output_tokens": 0})
+            yield sse("message_start", {"type": "message_start", "message": start})
+            yield sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                              "content_block": {"type": "text", "text": ""}})
+            size = self.config.chunk_size
+            for i in range(0, len(reply), size):
+                piece = reply[i:i + size]
+                yield sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                  "delta": {"type": "text_delta", "text": piece}})
+                self.pace(piece)
+            yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield sse("message_delta", {"type": "message_delta",
+                                        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                                        "usage": {"output_tokens": len(reply)}})
+            yield sse("message_stop", {"type": "message_stop"})
+
+        return self.send_events(events())
+
+    def batch_payload(self, batch):
+        """构造批次状态，超过 batch_delay 后批次结束"""
+        now = datetime.now(timezone.utc)
+        ended = now >= batch["ends_at"]
+        count = len(batch["results"])
+        canceled = sum(1 for result in batch["results"] if result["result"]["type"] == "canceled")
+        host, port = self.server.server_address[:2]
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else count,
+                               "succeeded": count - canceled if ended else 0,
+                               "errored": 0, "canceled": canceled, "expired": 0},
+            "created_at": batch["created_at"].isoformat(),
+            "expires_at": (batch["created_at"] + timedelta(hours=24)).isoformat(),
+            "ended_at": batch["ends_at"].isoformat() if ended else None,
+            "cancel_initiated_at": batch["canceled_at"].isoformat() if batch["canceled_at"] else None,
+            "archived_at": None,
+            "results_url": f"http://{host}:{port}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+    def create_batch(self, body):
+        now = datetime.now(timezone.utc)
+        batch = {
+            "id": f"msgbatch_{uuid.uuid4().hex}",
+            "created_at": now,
+            "ends_at": now + timedelta(seconds=self.config.batch_delay),
+            "canceled_at": None,
+            "results": [
+                {"custom_id": request["custom_id"],
+                 "result": {"type": "succeeded", "message": self.message_payload(request["params"])}}
+                for request in body.get('requests', [])
+            ],
+        }
+        with self.config.lock:
+            self.config.batches[batch["id"]] = batch
+            self.config.batch_count += 1
+            self.config.batch_request_count += len(batch["results"])
+        self.send_json(self.batch_payload(batch))
+
+    def retrieve_batch(self, batch_id):
+        batch = self.config.batches.get(batch_id)
+        if batch is None:
+            self.send_json({"error": {"message": f"unknown batch {batch_id}"}}, status=404)
+            return
+        if self.config.inject_poll_error():
+            self.send_error_payload(529)
+            return
+        self.send_json(self.batch_payload(batch))
+
+    def cancel_batch(self, batch_id):
+        """取消批次：未到结束时间的批次立即结束，其中的请求结果记为 canceled"""
+        batch = self.config.batches.get(batch_id)
+        if batch is None:
+            self.send_json({"error": {"message": f"unknown batch {batch_id}"}}, status=404)
+            return
+        now = datetime.now(timezone.utc)
+        with self.config.lock:
+            if now < batch["ends_at"]:
+                batch["canceled_at"] = now
+                batch["ends_at"] = now
+                batch["results"] = [{"custom_id": result["custom_id"], "result": {"type": "canceled"}}
+                                    for result in batch["results"]]
+        self.send_json(self.batch_payload(batch))
+
+    def batch_results(self, batch_id):
+        batch = self.config.batches.get(batch_id)
+        if batch is None:
+            self.send_json({"error": {"message": f"unknown batch {batch_id}"}}, status=404)
+            return
+        data = "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in batch["results"]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/binary')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, config: MockConfig = None):
+    """在后台线程中启动模拟服务，返回 (server, base_url)"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="首字节延迟（秒）")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="返回的文本")
+    parser.add_argument("--reply-chars", type=int, default=0, help="大于0时把返回文本重复到这个长度")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="输出速度，0表示不限制")
+    parser.add_argument("--max-tokens", type=int, default=None, help="每次回复的最大token数，超出时截断")
+    parser.add_argument("--sentinel", default=DEFAULT_SENTINEL, help="完成提示语，为空时不输出")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="返回529的概率")
+    parser.add_argument("--capacity", type=int, default=0, help="每个密钥的并发容量，超出时返回529，0表示不限制")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="流式回复中途断开连接的概率")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="批次从提交到结束的时间（秒）")
+    parser.add_argument("--batch-poll-error-rate", type=float, default=0.0, help="查询批次状态时返回529的概率")
+    parser.add_argument("--seed", type=int, default=None, help="错误注入的随机种子")
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, reply=args.reply, batch_delay=args.batch_delay,
+                        tokens_per_second=args.tokens_per_second, max_tokens=args.max_tokens,
+                        reply_chars=args.reply_chars, sentinel=args.sentinel,
+                        rate_limit_rate=args.rate_limit_rate, overload_rate=args.overload_rate,
+                        capacity=args.capacity, disconnect_rate=args.disconnect_rate,
+                        batch_poll_error_rate=args.batch_poll_error_rate, seed=args.seed)
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"模拟服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n模拟服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import re
+from dataclasses import dataclass
+
+# 完成提示语，模型在译完一个分段后输出
+SENTINEL = "本次翻译任务完成"
+
+# 默认分段参数
+DEFAULT_MAX_TOKENS = 2000  # 每个分段的token预算
+DEFAULT_CONTEXT_CHARS = 300  # 传给模型的前后文字符数
+
+heading_pattern = re.compile(r'^\s{0,3}#{1,6}\s')
+cjk_pattern = re.compile(r'[　-〿一-鿿＀-￯]')
+
+
+@dataclass
+class Segment:
+    """源文件中的一个分段，start/end 为在源文本中的字符偏移"""
+    index: int
+    start: int
+    end: int
+    text: str
+    tokens: int
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数：中文约一字一token，英文和LaTeX约3.5字符一token"""
+    cjk_count = len(cjk_pattern.findall(text))
+    return cjk_count + (len(text) - cjk_count) * 2 // 7 + 1
+
+
+def split_blocks(content: str):
+    """
+    按标题和段落边界把文本切成块，返回 (start, end, is_heading) 列表
+
+    $$...$$ 公式块和 ``` 代码块内部不会被切开。
+    """
+    blocks = []
+    block_start = 0
+    block_is_heading = False
+    pos = 0
+    in_math = False
+    in_code = False
+    prev_blank = False
+
+    for line in content.splitlines(keepends=True):
+        stripped = line.strip()
+        if not in_math and not in_code and pos > block_start:
+            is_heading = bool(heading_pattern.match(line))
+            # 标题行或空行之后的非空行都可以作为切分点
+            if is_heading or (prev_blank and stripped):
+                blocks.append((block_start, pos, block_is_heading))
+                block_start = pos
+                block_is_heading = is_heading
+        elif pos == block_start:
+            block_is_heading = bool(heading_pattern.match(line))
+
+        if not in_math and stripped.startswith('```'):
+            in_code = not in_code
+        elif not in_code and line.count('$$') % 2 == 1:
+            in_math = not in_math
+
+        prev_blank = not stripped
+        pos += len(line)
+
+    if pos > block_start:
+        blocks.append((block_start, pos, block_is_heading))
+    return blocks
+
+
+def clean_prefix(text: str) -> str:
+    """
+    返回写了一半的回复中到最后一个完整块为止的前缀
+
+    最后一块可能被截断，只保留它之前的部分；不会停在 $$...$$ 公式块或 ``` 代码块内部。
+    """
+    # 末尾追加一个探测行：文本以空行结尾且不在公式块或代码块中时，探测行自成一块，前面的内容全部保留
+    blocks = split_blocks(text + "\0")
+    return text[:blocks[-1][0]]
+
+
+def split_markdown(content: str, max_tokens: int = DEFAULT_MAX_TOKENS):
+    """
+    将markdown文本切分为不超过token预算的分段
+
+    优先在标题处切分，其次在段落边界切分；单个超出预算的块（如很长的公式块）保持完整。
+    所有分段按顺序拼接后与原文完全一致。
+
+    Args:
+        content (str): 源markdown文本
+        max_tokens (int): 每个分段的token预算
+
+    Returns:
+        list[Segment]: 按顺序排列的分段
+    """
+    segments = []
+    pending = []  # 当前分段中的块: (start, end, is_heading, tokens)
+
+    def flush(blocks):
+        start, end = blocks[0][0], blocks[-1][1]
+        tokens = sum(b[3] for b in blocks)
+        segments.append(Segment(len(segments), start, end, content[start:end], tokens))
+
+    for start, end, is_heading in split_blocks(content):
+        block = (start, end, is_heading, estimate_tokens(content[start:end]))
+        used = sum(b[3] for b in pending)
+        has_body = any(not b[2] for b in pending)
+        if has_body:
+            # 标题处在分段已用过半预算时就切分，使分段尽量与章节对齐
+            if is_heading and used >= max_tokens // 2:
+                flush(pending)
+                pending = []
+            elif used + block[3] > max_tokens:
+                # 分段末尾的标题随下一段走，不与正文分离
+                carry = []
+                while pending[-1][2]:
+                    carry.insert(0, pending.pop())
+                flush(pending)
+                pending = carry
+        pending.append(block)
+
+    if pending:
+        flush(pending)
+    return segments
+
+
+def build_segment_content(segments, index: int, context_chars: int = DEFAULT_CONTEXT_CHARS, text: str = None) -> str:
+    """构造单个分段的翻译内容，附带少量前后文供模型保持连贯；text 用于替换分段正文（如公式已替换为占位符）"""
+    parts = []
+    if index > 0 and context_chars > 0:
+        previous = segments[index - 1].text.rstrip()
+        before = previous[-context_chars:]
+        # 尽量从完整的一行开始，避免半句话
+        if len(previous) > context_chars and before.find('\n') != -1:
+            before = before[before.index('\n') + 1:]
+        if before.strip():
+            parts.append(f"【上文，仅供参考，不要翻译】\n{before.strip()}")
+
+    parts.append(f"【需要翻译的内容】\n{(segments[index].text if text is None else text).strip()}")
+
+    if index + 1 < len(segments) and context_chars > 0:
+        following = segments[index + 1].text.lstrip()
+        after = following[:context_chars]
+        if len(following) > context_chars and after.find('\n') != -1:
+            after = after[:after.rindex('\n')]
+        if after.strip():
+            parts.append(f"【下文，仅供参考，不要翻译】\n{after.strip()}")
+
+    return "\n\n".join(parts)
+
+
+def strip_sentinel(text: str) -> str:
+    """去掉译文中的完成提示语"""
+    return text.replace(SENTINEL, "").strip()
+
+
+def assemble_segments(translations) -> str:
+    """按顺序拼接各分段的译文"""
+    return "\n\n".join(t.strip() for t in translations if t.strip()) + "\n"
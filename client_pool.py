@@ -0,0 +1,71 @@
+import httpx
+
+# 连接池默认参数
+DEFAULT_MAX_CONNECTIONS = 100  # 每个base_url的最大连接数
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20  # 保持空闲的长连接数
+DEFAULT_KEEPALIVE_EXPIRY = 60.0  # 空闲长连接的保留时间（秒）
+DEFAULT_TIMEOUT = 300.0  # 单次请求超时（秒）
+# SDK内部不再重试，429等错误交给脚本和密钥池处理，以便换密钥重试
+SDK_MAX_RETRIES = 0
+
+
+class ClientPool:
+    """
+    整个运行期间共用的异步客户端池
+
+    每个base_url共用一个httpx连接池，复用TLS连接；每个(base_url, api_key)缓存一个SDK客户端。
+    """
+
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = timeout
+        self.http_clients = {}
+        self.clients = {}
+
+    def http_client(self, base_url) -> httpx.AsyncClient:
+        """获取某个base_url共用的httpx连接池"""
+        if base_url not in self.http_clients:
+            self.http_clients[base_url] = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self.http_clients[base_url]
+
+    def openai(self, base_url: str, api_key: str):
+        """获取OpenAI兼容接口的异步客户端"""
+        from openai import AsyncOpenAI
+
+        key = ("openai", base_url, api_key)
+        if key not in self.clients:
+            self.clients[key] = AsyncOpenAI(
+                base_url=base_url or None,
+                api_key=api_key,
+                http_client=self.http_client(base_url),
+                max_retries=SDK_MAX_RETRIES
+            )
+        return self.clients[key]
+
+    def anthropic(self, api_key: str, base_url: str = None):
+        """获取Anthropic直连接口的异步客户端"""
+        from anthropic import AsyncAnthropic
+
+        key = ("anthropic", base_url, api_key)
+        if key not in self.clients:
+            self.clients[key] = AsyncAnthropic(
+                base_url=base_url or None,
+                api_key=api_key,
+                http_client=self.http_client(base_url),
+                max_retries=SDK_MAX_RETRIES
+            )
+        return self.clients[key]
+
+    async def aclose(self):
+        """关闭所有连接池"""
+        for http_client in self.http_clients.values():
+            await http_client.aclose()
+        self.http_clients.clear()
+        self.clients.clear()
@@ -0,0 +1,112 @@
+import re
+
+from chunker import SENTINEL, estimate_tokens, strip_sentinel
+from masking import MASK_PATTERN, PLACEHOLDER_PATTERN
+
+# 表示回复因达到输出上限被截断的结束原因（OpenAI 为 length，Anthropic 为 max_tokens）
+TRUNCATED_REASONS = {"length", "max_tokens"}
+# 表示模型自行结束回复的结束原因
+ENDED_REASONS = {"stop", "end_turn", "stop_sequence"}
+
+# 模型自行结束时，译文按顺序覆盖原文标题、公式和图片的比例不低于该值才算完成
+MIN_ANCHOR_COVERAGE = 0.9
+# 同时译文的token数不低于原文的该比例；原文没有标题、公式和图片时只看长度
+MIN_LENGTH_RATIO = 0.5
+# 判为提前停止后最多继续的轮数，每轮都必须让覆盖率或长度有明显增加
+MAX_PREMATURE_CONTINUES = 2
+MIN_LENGTH_PROGRESS = 0.1
+# 原文中每个标志在译文中向后查找的范围，避免重复出现的短公式把进度拉得太远
+ANCHOR_LOOKAHEAD = 8
+
+heading_anchor_pattern = re.compile(r'^ {0,3}(#{1,6})\s', re.M)
+formula_delimiter_pattern = re.compile(r'^(\$\$|\$|\\\[|\\\()|(\$\$|\$|\\\]|\\\))$')
+image_source_pattern = re.compile(r'\]\(([^)\s]*)|src=["\']?([^"\'\s>]+)')
+whitespace_pattern = re.compile(r'\s+')
+
+
+def extract_anchors(text: str):
+    """
+    按出现顺序取出文本中翻译前后保持不变的标志：标题级别、公式、图片地址和占位符
+
+    公式去掉分隔符和空白后比较（模型常把 \\[...\\] 改成 $$...$$）；图片只比较地址，替代文字可能被翻译。
+    """
+    found = [(m.start(), m.group(1)) for m in heading_anchor_pattern.finditer(text)]
+    for m in MASK_PATTERN.finditer(text):
+        if m.lastindex == 1:
+            body = formula_delimiter_pattern.sub('', m.group(1).strip())
+            found.append((m.start(), "$" + whitespace_pattern.sub('', body)))
+        else:
+            source = image_source_pattern.search(m.group(2))
+            found.append((m.start(), "!" + (source.group(1) or source.group(2) if source else m.group(2))))
+    found.extend((m.start(), m.group(0)) for m in PLACEHOLDER_PATTERN.finditer(text))
+    return [anchor for _, anchor in sorted(found)]
+
+
+def anchor_coverage(source_anchors, translation: str) -> float:
+    """译文按顺序覆盖到原文第几个标志，返回所占比例"""
+    position = 0
+    for anchor in extract_anchors(translation):
+        window = source_anchors[position:position + ANCHOR_LOOKAHEAD]
+        if anchor in window:
+            position += window.index(anchor) + 1
+            if position == len(source_anchors):
+                break
+    return position / len(source_anchors)
+
+
+class CompletionTracker:
+    """
+    判断一个分段是否已经译完
+
+    优先看回复的结束原因：被截断时继续；模型自行结束时，用译文对原文标题、公式、图片的顺序覆盖率
+    和长度比估计是否译完，覆盖不足时判为提前停止并继续。没有结束原因时退回到完成提示语。
+    提前停止后继续翻译也没有进展，或已继续 MAX_PREMATURE_CONTINUES 轮时不再继续，记为可能有遗漏。
+    """
+
+    def __init__(self, source: str, translation: str = ""):
+        self.source_anchors = extract_anchors(source)
+        self.source_tokens = estimate_tokens(source)
+        self.translation = translation
+        self.coverage, self.length_ratio = self.measure()
+        self.note = ""  # 最近一次判断的说明，供调用方打印
+        self.premature = 0  # 判为提前停止的次数
+        self.saved_turns = 0  # 没有完成提示语但判为完成、省去的续写轮数
+
+    def measure(self):
+        """返回 (标志覆盖率, 长度比)；原文没有标志时覆盖率记为1"""
+        translation = strip_sentinel(self.translation)
+        coverage = anchor_coverage(self.source_anchors, translation) if self.source_anchors else 1.0
+        return coverage, estimate_tokens(translation) / max(self.source_tokens, 1)
+
+    def covered(self) -> bool:
+        return self.coverage >= MIN_ANCHOR_COVERAGE and self.length_ratio >= MIN_LENGTH_RATIO
+
+    def describe(self) -> str:
+        anchors = f"标志覆盖 {self.coverage:.0%}，" if self.source_anchors else ""
+        return f"{anchors}长度为原文的 {self.length_ratio:.0%}"
+
+    def update(self, reply: str, finish_reason) -> bool:
+        """记入一轮回复，返回分段是否已经译完"""
+        previous_coverage, previous_length = self.coverage, self.length_ratio
+        self.translation += reply
+        self.coverage, self.length_ratio = self.measure()
+        self.note = ""
+
+        if finish_reason in TRUNCATED_REASONS:
+            return False
+        # 中转服务没有返回结束原因时按完成提示语判断
+        if finish_reason not in ENDED_REASONS and SENTINEL not in reply:
+            return False
+
+        if self.covered():
+            if SENTINEL not in reply:
+                self.saved_turns += 1
+                self.note = f"模型已结束回复，{self.describe()}，判为完成"
+            return True
+        progressed = self.coverage > previous_coverage or self.length_ratio >= previous_length + MIN_LENGTH_PROGRESS
+        if (self.premature and not progressed) or self.premature >= MAX_PREMATURE_CONTINUES:
+            self.note = f"继续翻译后仍未覆盖原文，{self.describe()}，可能有遗漏"
+            return True
+        self.premature += 1
+        self.note = f"模型提前结束回复，{self.describe()}，继续翻译"
+        return False
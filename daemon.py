@@ -0,0 +1,306 @@
+"""
+常驻模式：持续监视 workmd，新增或修改的文件进入持久化队列，翻译完成后自动后处理
+
+整个运行期间共用一组连接池、密钥池、缓存和翻译记忆，不必为每批文件重新启动。
+翻译参数沿用 muliwork.py 的配置；状态（队列长度、正在翻译的文件、吞吐量）定期写入状态文件。
+监视采用轮询：每隔 WATCH_INTERVAL 秒比较文件的大小和修改时间，写入稳定 SETTLE_SECONDS 秒后按内容哈希判断是否变化。
+
+用法:
+    python daemon.py
+    python daemon.py --once            # 处理完当前队列后退出
+    python daemon.py --no-postprocess  # 只翻译，不自动后处理
+"""
+import argparse
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import muliwork
+from client_pool import ClientPool
+from hedging import Hedger
+from journal import atomic_write
+from key_pool import KeyPool
+from metrics import MetricsCollector
+from postprocessing import file_hash, merge_markdown_files, process_file
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
+
+# 轮询间隔和文件写入稳定的时间（秒），OCR仍在写入的文件等写完再入队
+WATCH_INTERVAL = 2.0
+SETTLE_SECONDS = 5.0
+# 同时翻译的文件数，各文件的分段共用密钥池
+MAX_ACTIVE_FILES = 4
+# 后处理进程数
+POSTPROCESS_WORKERS = 2
+# 状态文件的刷新间隔（秒）
+STATUS_INTERVAL = 5.0
+
+QUEUE_FILE = muliwork.OUTPUT_DIR / "daemon_queue.sqlite3"
+STATUS_FILE = muliwork.OUTPUT_DIR / "daemon_status.json"
+
+# 后处理输出，与在 后处理模块 目录下运行 pipeline.py 的默认位置相同
+POSTPROCESS_DIR = Path("后处理模块")
+PASSED_DIR = POSTPROCESS_DIR / "reprocessing"
+FAILED_DIR = POSTPROCESS_DIR / "pending"
+MERGED_FILE = POSTPROCESS_DIR / "merged_output.md"
+
+
+class WorkQueue:
+    """
+    持久化的文件队列，存放在输出目录下的SQLite文件中
+
+    每个源文件一行，记录内容哈希和状态（queued/running/done/failed）。
+    启动时上次中断（running）和失败（failed）的文件重新入队，已提交的回复由翻译日志恢复。
+    """
+
+    def __init__(self, db_path: Path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS queue (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                state TEXT NOT NULL,
+                enqueued REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("UPDATE queue SET state = 'queued' WHERE state IN ('running', 'failed')")
+        self.conn.commit()
+
+    def digest(self, path: Path):
+        row = self.conn.execute("SELECT sha256 FROM queue WHERE path = ?", (str(path),)).fetchone()
+        return row[0] if row else None
+
+    def enqueue(self, path: Path, digest: str):
+        self.conn.execute(
+            "INSERT INTO queue (path, sha256, state, enqueued) VALUES (?, ?, 'queued', ?) "
+            "ON CONFLICT (path) DO UPDATE SET sha256 = excluded.sha256, state = 'queued', "
+            "enqueued = excluded.enqueued, attempts = 0",
+            (str(path), digest, time.time())
+        )
+        self.conn.commit()
+
+    def claim(self, busy=()):
+        """
+        取出最早入队的文件并标记为 running，返回 (路径, 哈希)，没有可处理的文件时返回None
+
+        busy 中的文件正在翻译（翻译期间又被修改而重新入队），等这一次结束后再取。
+        """
+        for path, digest in self.conn.execute(
+                "SELECT path, sha256 FROM queue WHERE state = 'queued' ORDER BY enqueued").fetchall():
+            if Path(path) in busy:
+                continue
+            self.conn.execute("UPDATE queue SET state = 'running', attempts = attempts + 1 WHERE path = ?", (path,))
+            self.conn.commit()
+            return Path(path), digest
+        return None
+
+    def finish(self, path: Path, digest: str, state: str):
+        """记录处理结果；处理期间文件又被修改（哈希已变）时保持 queued，稍后重新翻译"""
+        self.conn.execute("UPDATE queue SET state = ? WHERE path = ? AND sha256 = ?", (state, str(path), digest))
+        self.conn.commit()
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM queue GROUP BY state").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class Daemon:
+    """监视、翻译和后处理的常驻服务，翻译所需的客户端和缓存在整个运行期间保持打开"""
+
+    def __init__(self, queue: WorkQueue, postprocess: bool, once: bool):
+        self.queue = queue
+        self.postprocess = postprocess
+        self.once = once
+        self.key_pool = KeyPool(muliwork.API_KEYS, muliwork.REQUESTS_PER_MINUTE, muliwork.TOKENS_PER_MINUTE,
+                                muliwork.MAX_IN_FLIGHT_PER_KEY, muliwork.RATE_LIMIT_COOLDOWN,
+                                adaptive_limit=muliwork.ADAPTIVE_MAX_IN_FLIGHT)
+        self.cache = TranslationCache(muliwork.CACHE_FILE, muliwork.CACHE_MAX_MB * 1024 * 1024)
+        self.memory = TranslationMemory(muliwork.MEMORY_FILE, muliwork.initial_prompt, muliwork.MODEL)
+        self.clients = ClientPool(muliwork.MAX_CONNECTIONS, muliwork.MAX_KEEPALIVE_CONNECTIONS,
+                                  muliwork.KEEPALIVE_EXPIRY)
+        self.metrics = MetricsCollector("daemon", muliwork.METRICS_FILE, muliwork.PROMETHEUS_FILE,
+                                        muliwork.METRICS_REFRESH_INTERVAL)
+        self.hedger = Hedger(self.key_pool, muliwork.HEDGE_REQUESTS, muliwork.HEDGE_PERCENTILE,
+                             muliwork.HEDGE_MAX_EXTRA_FRACTION)
+        self.executor = ProcessPoolExecutor(max_workers=POSTPROCESS_WORKERS) if postprocess else None
+        self.wakeup = asyncio.Event()
+        self.seen = {}  # 路径 -> ((大小, 修改时间), 最近一次变化的时刻, 是否已核对哈希)
+        self.running = {}  # 路径 -> 开始翻译的时刻
+        self.started = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.merge_lock = asyncio.Lock()
+
+    async def scan(self):
+        """
+        扫描一次 workmd，把写入已稳定且内容有变化的文件入队，返回新入队的文件数
+
+        大小和修改时间没有变化的文件不重新计算哈希；哈希在线程中计算，不阻塞正在进行的翻译请求。
+        """
+        now = time.monotonic()
+        added = 0
+        for path in sorted(muliwork.WORK_DIR.glob("*.md")):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self.seen.get(path)
+            if previous is None or previous[0] != signature:
+                self.seen[path] = (signature, now, False)
+                continue
+            _, changed_at, checked = previous
+            if checked or now - changed_at < SETTLE_SECONDS:
+                continue
+            self.seen[path] = (signature, changed_at, True)
+            try:
+                digest = await asyncio.to_thread(file_hash, path)
+            except FileNotFoundError:
+                continue
+            if digest != self.queue.digest(path):
+                print(f"文件 {path.name} 已入队")
+                self.queue.enqueue(path, digest)
+                added += 1
+        return added
+
+    def seed(self):
+        """启动前已经存在的文件视为写入已稳定，第一次扫描直接比较哈希"""
+        settled = time.monotonic() - SETTLE_SECONDS
+        for path in muliwork.WORK_DIR.glob("*.md"):
+            stat = path.stat()
+            self.seen[path] = ((stat.st_size, stat.st_mtime_ns), settled, False)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            if await self.scan():
+                self.wakeup.set()
+
+    async def worker(self):
+        while True:
+            item = self.queue.claim(self.running)
+            if item is None:
+                if self.once and not self.running:
+                    return
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), WATCH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            path, digest = item
+            self.running[path] = time.time()
+            try:
+                ok = path.exists() and await muliwork.translate_file(
+                    path, self.key_pool, self.cache, self.memory, self.clients, self.metrics, self.hedger)
+                if ok and self.postprocess:
+                    await self.run_postprocess(muliwork.OUTPUT_DIR / f"translated_{path.name}")
+            except Exception as e:
+                print(f"文件 {path.name} 处理失败: {e}")
+                ok = False
+            finally:
+                del self.running[path]
+            self.queue.finish(path, digest, "done" if ok else "failed")
+            self.completed += ok
+            self.failed += not ok
+            # 翻译期间重新入队的同一文件现在可以取出
+            self.wakeup.set()
+
+    async def run_postprocess(self, output_file: Path):
+        """在常驻的进程池中后处理一个译文文件，通过检查的文件增量合并"""
+        loop = asyncio.get_running_loop()
+        name, content, passed, _, error = await loop.run_in_executor(self.executor, process_file, output_file)
+        if error is not None:
+            print(f"文件 {name} 后处理出错: {error}")
+            return
+        target, other = (PASSED_DIR, FAILED_DIR) if passed else (FAILED_DIR, PASSED_DIR)
+        target.mkdir(parents=True, exist_ok=True)
+        atomic_write(target / name, content)
+        # 同一文件上次的结果可能在另一个目录，删除以免合并旧译文
+        (other / name).unlink(missing_ok=True)
+        if not passed:
+            print(f"文件 {name} 检查未通过，已写入 {FAILED_DIR}，可用 repair.py 修复")
+        async with self.merge_lock:
+            if any(PASSED_DIR.glob("*.md")):
+                await loop.run_in_executor(None, merge_markdown_files, str(PASSED_DIR), str(MERGED_FILE))
+
+    def write_status(self):
+        counts = self.queue.counts()
+        uptime = time.time() - self.started
+        output_tokens = sum(m.output_tokens for m in self.metrics.keys.values())
+        status = {
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "uptime_seconds": round(uptime, 1),
+            "queued": counts.get("queued", 0),
+            "running": [{"file": path.name, "seconds": round(time.time() - since, 1)}
+                        for path, since in self.running.items()],
+            "done_total": counts.get("done", 0),
+            "failed_total": counts.get("failed", 0),
+            "completed_this_run": self.completed,
+            "failed_this_run": self.failed,
+            "files_per_hour": round(self.completed / uptime * 3600, 2) if uptime > 0 else 0.0,
+            "output_tokens_per_second": round(output_tokens / uptime, 2) if uptime > 0 else 0.0,
+            "keys_in_flight": {key.name: f"{key.in_flight}/{key.max_in_flight}" for key in self.key_pool.keys},
+        }
+        atomic_write(STATUS_FILE, json.dumps(status, ensure_ascii=False, indent=1) + "\n")
+
+    async def report(self):
+        while True:
+            self.write_status()
+            await asyncio.sleep(STATUS_INTERVAL)
+
+    async def run(self):
+        print(f"开始监视 {muliwork.WORK_DIR}，状态写入 {STATUS_FILE}")
+        self.seed()
+        await self.scan()
+        watcher = asyncio.create_task(self.watch())
+        reporter = asyncio.create_task(self.report())
+        try:
+            await asyncio.gather(*(self.worker() for _ in range(MAX_ACTIVE_FILES)))
+        finally:
+            watcher.cancel()
+            reporter.cancel()
+            self.write_status()
+
+    async def aclose(self):
+        self.key_pool.print_summary()
+        self.hedger.print_summary()
+        self.metrics.print_summary()
+        self.metrics.close()
+        self.cache.print_summary()
+        self.cache.close()
+        self.memory.print_summary()
+        self.memory.close()
+        await self.clients.aclose()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+async def main(postprocess: bool, once: bool):
+    muliwork.OUTPUT_DIR.mkdir(exist_ok=True)
+    queue = WorkQueue(QUEUE_FILE)
+    daemon = Daemon(queue, postprocess, once)
+    try:
+        await daemon.run()
+    finally:
+        await daemon.aclose()
+        queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="监视 workmd 并持续翻译")
+    parser.add_argument("--once", action="store_true", help="处理完当前队列后退出")
+    parser.add_argument("--no-postprocess", action="store_true", help="只翻译，不自动后处理和合并")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(not args.no_postprocess, args.once))
+    except KeyboardInterrupt:
+        print("\n常驻服务已停止，未完成的文件下次启动时继续")
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from key_pool import KeyPool, KeyState
+from metrics import percentile
+
+# 超过历史延迟的该分位数仍未返回的请求才发送对冲请求
+DEFAULT_PERCENTILE = 0.9
+# 对冲请求的预计token数不超过全部请求的该比例
+DEFAULT_MAX_EXTRA_FRACTION = 0.1
+# 至少完成这么多次请求后才开始对冲，样本太少时分位数不可靠
+MIN_SAMPLES = 20
+# 等待时间不足该秒数的请求不对冲
+MIN_HEDGE_DELAY = 10.0
+# 请求已超时但暂时没有空闲密钥时，每隔多少秒再检查一次
+POLL_INTERVAL = 1.0
+# 用于计算分位数的最近完成请求数
+HISTORY_SIZE = 1000
+
+
+@dataclass
+class Attempt:
+    """一次请求：使用的密钥、是否为对冲请求、发出时刻和预计token数，完成后记录结果和耗时"""
+    key: KeyState
+    hedge: bool
+    started: float = 0.0
+    tokens: float = 0
+    latency: float = 0.0
+    result: object = None
+
+
+class Hedger:
+    """
+    长尾请求对冲
+
+    批次末尾多数密钥空闲、少数请求迟迟不返回时，对等待时间超过历史延迟分位数的请求，
+    在另一个空闲密钥上发送一份相同的请求，先成功返回的结果生效，另一个请求被取消。
+    对冲只使用没有请求排队时的空闲容量，额外的token数有上限。
+    延迟按每个预计输出token折算，长短分段使用同一个阈值分布。
+    """
+
+    def __init__(self, key_pool: KeyPool, enabled: bool = True, hedge_percentile: float = DEFAULT_PERCENTILE,
+                 max_extra_fraction: float = DEFAULT_MAX_EXTRA_FRACTION, min_delay: float = MIN_HEDGE_DELAY):
+        self.key_pool = key_pool
+        self.enabled = enabled
+        self.hedge_percentile = hedge_percentile
+        self.max_extra_fraction = max_extra_fraction
+        self.min_delay = min_delay
+        self.seconds_per_token = deque(maxlen=HISTORY_SIZE)
+        self.primary_tokens = 0.0
+        self.hedge_tokens = 0.0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.measured_saved = 0.0  # 原请求被取消时已等待的时间减去对冲请求的耗时（实测）
+        self.saved_time = 0.0  # 按历史延迟估计的节省时间
+        self.estimated_wins = 0  # 有历史样本可以估计的胜出次数
+
+    def threshold(self, expected_tokens: int):
+        """预计输出 expected_tokens 个token的请求等待多少秒后对冲；样本不足时返回None"""
+        if len(self.seconds_per_token) < MIN_SAMPLES:
+            return None
+        return max(self.min_delay, percentile(self.seconds_per_token, self.hedge_percentile) * expected_tokens)
+
+    def estimate_saved(self, expected_tokens: int, elapsed: float):
+        """
+        对冲请求胜出时估计节省的时间：原请求预计的耗时减去已等待的 elapsed 秒
+
+        用历史上超过这一耗时的已完成请求的平均耗时估计原请求的耗时；没有这样的样本时返回None。
+        被取消的原请求只知道耗时的下限，不计入历史。
+        """
+        slower = [rate * expected_tokens for rate in self.seconds_per_token if rate * expected_tokens > elapsed]
+        return sum(slower) / len(slower) - elapsed if slower else None
+
+    def within_budget(self, tokens: float) -> bool:
+        return self.hedge_tokens + tokens <= self.max_extra_fraction * self.primary_tokens
+
+    async def attempt(self, attempt: Attempt, send):
+        try:
+            attempt.result = await send(attempt.key, attempt.hedge)
+        except BaseException as e:
+            await self.key_pool.release(attempt.key, e, attempt.started, attempt.tokens)
+            raise
+        attempt.latency = time.monotonic() - attempt.started
+        await self.key_pool.release(attempt.key, None, attempt.started, attempt.tokens)
+        return attempt
+
+    async def run(self, label: str, tokens: float, priority: float, expected_tokens: int, send, on_failure):
+        """
+        取得密钥发送一轮请求，必要时发送对冲请求，返回先成功的 Attempt
+
+        send(key, hedge) 用给定的密钥发出请求并返回结果，hedge 为True时是对冲请求；
+        每个失败的请求都调用 on_failure(key, started, error)，全部失败时抛出最后一个异常。
+        """
+        primary = Attempt(await self.key_pool.acquire(tokens, priority), False, time.monotonic(), tokens)
+        self.primary_tokens += tokens
+        primary_task = asyncio.ensure_future(self.attempt(primary, send))
+        running = {primary_task: primary}
+        hedged = not self.enabled
+        error = None
+        try:
+            while running:
+                timeout = None
+                if not hedged:
+                    threshold = self.threshold(expected_tokens)
+                    elapsed = time.monotonic() - primary.started
+                    if threshold is not None and elapsed >= threshold and self.within_budget(tokens):
+                        key = self.key_pool.try_acquire(tokens, exclude=primary.key)
+                        if key is not None:
+                            print(f"分段 {label} 已等待 {elapsed:.1f} 秒，在密钥 {key.name} 上发送对冲请求")
+                            hedge = Attempt(key, True, time.monotonic(), tokens)
+                            running[asyncio.ensure_future(self.attempt(hedge, send))] = hedge
+                            self.hedge_tokens += tokens
+                            self.hedges += 1
+                            hedged = True
+                    if not hedged:
+                        timeout = POLL_INTERVAL if threshold is None or elapsed >= threshold \
+                            else threshold - elapsed
+
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt = running.pop(task)
+                    if task.exception() is None:
+                        self.seconds_per_token.append(attempt.latency / max(expected_tokens, 1))
+                        if attempt.hedge and primary_task in running:
+                            waited = time.monotonic() - primary.started
+                            measured = waited - attempt.latency
+                            saved = self.estimate_saved(expected_tokens, waited)
+                            self.hedge_wins += 1
+                            self.measured_saved += measured
+                            estimate = ""
+                            if saved is not None:
+                                self.saved_time += saved
+                                self.estimated_wins += 1
+                                estimate = f"，按历史延迟估计还可节省 {saved:.1f} 秒"
+                            print(f"分段 {label} 对冲请求先返回，原请求已等待 {waited:.1f} 秒，"
+                                  f"对冲请求耗时 {attempt.latency:.1f} 秒{estimate}")
+                        return attempt
+                    error = task.exception()
+                    on_failure(attempt.key, attempt.started, error)
+                    # 原请求已失败时不再对冲，交给调用方的重试
+                    hedged = True
+            raise error
+        finally:
+            # 先返回的请求之外的请求都取消，等它们归还密钥
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def print_summary(self):
+        if not self.enabled:
+            return
+        extra = self.hedge_tokens / self.primary_tokens if self.primary_tokens else 0.0
+        print("\n=== 请求对冲统计 ===")
+        print(f"对冲请求: {self.hedges} 次，先返回 {self.hedge_wins} 次")
+        print(f"额外token（预计）: {self.hedge_tokens:,.0f}，占全部请求的 {extra:.1%}")
+        print(f"原请求取消时比对冲请求多等待（实测）: {self.measured_saved:.1f} 秒")
+        if self.estimated_wins:
+            print(f"原请求预计还需等待（估计，{self.estimated_wins}/{self.hedge_wins} 次有历史样本）: "
+                  f"{self.saved_time:.1f} 秒")
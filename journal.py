@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def atomic_write(path: Path, text: str):
+    """先写临时文件再替换，保证目标文件要么是旧内容要么是完整的新内容"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def segment_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+class TranslationJournal:
+    """
+    单个文件的翻译日志（JSON Lines），每一行记录一个被接受的回复及其在源文件中的位置
+
+    中断后重新运行时，已完成的分段直接复用，未完成的分段从最后一轮回复继续。
+    只有完整写入并落盘的行才算提交，写了一半的行在加载时被丢弃。
+    """
+
+    def __init__(self, journal_path: Path, segments):
+        self.path = Path(journal_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hashes = {segment.index: segment_hash(segment.text) for segment in segments}
+        self.records = {}  # 分段序号 -> 按轮次排列的记录
+        self.load(segments)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def load(self, segments):
+        """读取已提交的记录，只保留源文本未变的分段"""
+        if not self.path.exists():
+            return
+        positions = {segment.index: (segment.start, segment.end) for segment in segments}
+        committed = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                committed += len(line)
+                index = record["segment"]
+                if self.hashes.get(index) != record["hash"] or positions[index] != (record["start"], record["end"]):
+                    continue
+                turns = self.records.setdefault(index, [])
+                if record["turn"] == len(turns):
+                    turns.append(record)
+
+        # 截掉末尾写了一半的记录，避免与之后追加的记录粘在一起
+        if committed < self.path.stat().st_size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(committed)
+
+    def replies(self, index: int):
+        """已提交的各轮回复"""
+        return [record["reply"] for record in self.records.get(index, [])]
+
+    def is_done(self, index: int) -> bool:
+        turns = self.records.get(index)
+        return bool(turns) and turns[-1]["done"]
+
+    def append(self, segment, reply: str, done: bool):
+        """提交一轮回复：整行一次写入并落盘"""
+        turns = self.records.setdefault(segment.index, [])
+        record = {
+            "segment": segment.index,
+            "start": segment.start,
+            "end": segment.end,
+            "hash": self.hashes[segment.index],
+            "turn": len(turns),
+            "done": done,
+            "reply": reply,
+        }
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        turns.append(record)
+
+    def resumed_count(self) -> int:
+        """可以复用的回复轮数"""
+        return sum(len(turns) for turns in self.records.values())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def remove(self):
+        """文件全部完成后删除日志"""
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
@@ -0,0 +1,264 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+# 被限流后的冷却时间（秒），连续限流时指数增长
+DEFAULT_COOLDOWN = 10.0
+DEFAULT_MAX_COOLDOWN = 300.0
+
+# 自适应并发（AIMD）：请求成功且延迟正常时并发上限每轮加1，遇到限流、过载或超时时乘以该系数
+DECREASE_FACTOR = 0.5
+# 每token耗时超过基线的该倍数时视为延迟变差，并发上限不再增加
+LATENCY_TOLERANCE = 2.0
+# 基线取最近的最小每token耗时，每次成功的请求允许基线上浮的比例，跟上服务速度的变化
+BASELINE_DRIFT = 1.02
+# 回到上次过载时的并发数之前放慢增加，每次在同一并发数再次过载时放慢一倍，最多慢这么多倍
+MAX_PROBE_BACKOFF = 64
+
+
+def redact_key(api_key: str) -> str:
+    """隐藏密钥，只保留末尾4位用于区分"""
+    return f"...{api_key[-4:]}" if len(api_key) > 4 else "..."
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为429限流"""
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+
+def is_overload_error(error: Exception) -> bool:
+    """判断异常是否说明服务端已过载：429限流、529/503过载或超时"""
+    return is_rate_limit_error(error) or getattr(error, 'status_code', None) in (503, 529) \
+        or 'overloaded' in str(error).lower() or 'Timeout' in type(error).__name__
+
+
+class TokenBucket:
+    """按分钟补充的令牌桶，rate_per_minute 为0表示不限制"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.rate_per_minute:
+            elapsed = now - self.updated
+            self.tokens = min(self.rate_per_minute, self.tokens + elapsed * self.rate_per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需要等待多少秒才能取出 amount 个令牌"""
+        if not self.rate_per_minute:
+            return 0.0
+        self.refill(now)
+        # 单次请求超过桶容量时，只要桶满就放行
+        amount = min(amount, self.rate_per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate_per_minute
+
+    def consume(self, amount: float):
+        if self.rate_per_minute:
+            self.tokens -= amount
+
+
+class KeyState:
+    """单个API密钥的状态"""
+
+    def __init__(self, api_key: str, requests_per_minute: float, tokens_per_minute: float, max_in_flight: int,
+                 adaptive_limit: int = 0):
+        self.api_key = api_key
+        self.name = redact_key(api_key)
+        self.rpm = TokenBucket(requests_per_minute)
+        self.tpm = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        # 自适应并发：adaptive_limit 为并发上限的上界，0表示固定为 max_in_flight
+        self.adaptive_limit = adaptive_limit
+        self.limit = float(max_in_flight)
+        self.peak_in_flight = max_in_flight
+        self.baseline = None  # 最近的最小每token耗时（秒）
+        self.last_decrease = 0.0
+        self.ceiling = None  # 上次过载时的并发上限
+        self.probe_backoff = 1
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.strikes = 0  # 连续限流次数
+        self.request_count = 0
+        self.rate_limit_count = 0
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        """该密钥还需要等待多少秒才能接收一个请求"""
+        return max(self.cooldown_until - now, self.rpm.wait_time(1, now), self.tpm.wait_time(tokens, now))
+
+    def adapt(self, started: float, overloaded: bool, latency: float = None, tokens: float = 0):
+        """
+        按一次请求的结果调整并发上限
+
+        过载时乘性减少，但在上次减少之前发出的请求不再重复减少；并发已用满、请求成功且每token耗时
+        不超过基线的 LATENCY_TOLERANCE 倍时加性增加，约每轮并发请求加1。
+        回到上次过载的并发数时放慢增加，容量很小的服务不会在过载和恢复之间反复。在请求归还密钥之前调用。
+        """
+        if not self.adaptive_limit:
+            return
+        old = self.max_in_flight
+        if overloaded:
+            if started < self.last_decrease:
+                return
+            self.last_decrease = time.monotonic()
+            if self.ceiling is not None and self.max_in_flight <= self.ceiling:
+                self.probe_backoff = min(self.probe_backoff * 2, MAX_PROBE_BACKOFF)
+            else:
+                self.probe_backoff = 2
+            self.ceiling = self.max_in_flight
+            self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+        elif latency is not None:
+            rate = latency / max(tokens, 1)
+            self.baseline = rate if self.baseline is None else min(rate, self.baseline * BASELINE_DRIFT)
+            if rate > self.baseline * LATENCY_TOLERANCE or self.in_flight < self.max_in_flight:
+                return
+            step = 1 / self.limit
+            if self.ceiling is not None and int(self.limit) < self.ceiling <= int(self.limit + step):
+                step /= self.probe_backoff
+            self.limit = min(float(self.adaptive_limit), self.limit + step)
+        self.max_in_flight = int(self.limit)
+        self.peak_in_flight = max(self.peak_in_flight, self.max_in_flight)
+        if self.max_in_flight != old:
+            print(f"密钥 {self.name} 并发上限 {old} -> {self.max_in_flight}")
+
+
+class KeyPool:
+    """
+    所有文件共用的密钥池
+
+    每个请求都交给当前有余量的密钥：每个密钥有自己的每分钟请求数和token数令牌桶，
+    收到429后进入冷却，期间的请求自动转给其他密钥。
+    等待中的请求按优先级取得密钥，优先级相同时先到先得。
+    adaptive_limit 大于0时每个密钥的并发数从 max_in_flight 开始按AIMD自适应，最多到 adaptive_limit。
+    """
+
+    def __init__(self, api_keys, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_in_flight: int = 1, cooldown: float = DEFAULT_COOLDOWN,
+                 max_cooldown: float = DEFAULT_MAX_COOLDOWN, adaptive_limit: int = 0):
+        self.keys = [KeyState(key, requests_per_minute, tokens_per_minute, max_in_flight, adaptive_limit)
+                     for key in api_keys]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.condition = asyncio.Condition()
+        self.waiting = []  # 等待中的请求 (-优先级, 到达序号)，堆顶的请求先取得密钥
+        self.sequence = itertools.count()
+
+    def pick(self, tokens: float, now: float, exclude: KeyState = None):
+        """选出可以立即接收请求的密钥，优先在途请求少、token余量多的；没有则返回None"""
+        ready = [
+            key for key in self.keys
+            if key is not exclude and key.in_flight < key.max_in_flight and key.wait_time(tokens, now) == 0
+        ]
+        if not ready:
+            return None
+        return min(ready, key=lambda key: (key.in_flight / key.max_in_flight, -key.tpm.tokens))
+
+    async def acquire(self, tokens: float = 0, priority: float = 0) -> KeyState:
+        """
+        等待并取得一个有余量的密钥
+
+        tokens 为本次请求预计消耗的token数；priority 越大越先取得密钥，
+        调用方按分段长度设置优先级时长分段先开始，整批的总耗时不会被最后才开始的长分段拖长。
+        """
+        ticket = (-priority, next(self.sequence))
+        async with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    timeout = None
+                    # 只有排在最前的请求取密钥，其余请求等它取走后再被唤醒
+                    if self.waiting[0] == ticket:
+                        now = time.monotonic()
+                        key = self.pick(tokens, now)
+                        if key is not None:
+                            heapq.heappop(self.waiting)
+                            self.take(key, tokens)
+                            self.condition.notify_all()
+                            return key
+
+                        # 所有密钥都忙或都没有余量时，等到最早可用的时刻或有请求结束
+                        waits = [key.wait_time(tokens, now) for key in self.keys
+                                 if key.in_flight < key.max_in_flight]
+                        timeout = max(min(waits), 0.01) if waits else None
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                # 被取消的请求退出队列
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+
+    def take(self, key: KeyState, tokens: float):
+        key.in_flight += 1
+        key.request_count += 1
+        key.rpm.consume(1)
+        key.tpm.consume(tokens)
+
+    def try_acquire(self, tokens: float = 0, exclude: KeyState = None):
+        """
+        不等待地取得一个空闲密钥，没有请求在排队且有除 exclude 外的密钥有余量时返回该密钥，否则返回None
+
+        用于只占用空闲容量的额外请求，不会抢在排队的请求之前。
+        """
+        if self.waiting:
+            return None
+        key = self.pick(tokens, time.monotonic(), exclude)
+        if key is not None:
+            self.take(key, tokens)
+        return key
+
+    async def release(self, key: KeyState, error: BaseException = None, started: float = None, tokens: float = 0):
+        """
+        归还密钥；error 为429时让该密钥进入冷却
+
+        started 为请求发出时的 time.monotonic()，给出时按请求结果调整该密钥的并发上限；
+        被取消的请求不参与调整。
+        """
+        rate_limited = isinstance(error, Exception) and is_rate_limit_error(error)
+        async with self.condition:
+            if started is not None and (error is None or isinstance(error, Exception)):
+                overloaded = error is not None and is_overload_error(error)
+                if error is None or overloaded:
+                    key.adapt(started, overloaded, time.monotonic() - started, tokens)
+            key.in_flight -= 1
+            if rate_limited:
+                key.rate_limit_count += 1
+                key.strikes += 1
+                delay = min(self.cooldown * (2 ** (key.strikes - 1)), self.max_cooldown)
+                key.cooldown_until = time.monotonic() + delay
+                print(f"密钥 {key.name} 被限流，冷却 {delay:.1f} 秒")
+            else:
+                key.strikes = 0
+            self.condition.notify_all()
+
+    def record_usage(self, key: KeyState, used_tokens: int, estimated_tokens: float):
+        """用实际消耗的token数修正预估值"""
+        key.tpm.consume(used_tokens - estimated_tokens)
+
+    @asynccontextmanager
+    async def lease(self, tokens: float = 0, priority: float = 0):
+        """取得密钥执行一次请求，请求抛出429时自动让该密钥冷却"""
+        key = await self.acquire(tokens, priority)
+        started = time.monotonic()
+        try:
+            yield key
+        except BaseException as e:
+            await self.release(key, e, started, tokens)
+            raise
+        else:
+            await self.release(key, None, started, tokens)
+
+    def print_summary(self):
+        print("\n=== 密钥使用统计 ===")
+        for key in self.keys:
+            adaptive = f"，并发上限 {key.max_in_flight}（最高 {key.peak_in_flight}）" if key.adaptive_limit else ""
+            print(f"密钥 {key.name}: 请求 {key.request_count} 次，限流 {key.rate_limit_count} 次{adaptive}")
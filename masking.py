@@ -0,0 +1,111 @@
+import re
+from collections import Counter
+
+from chunker import estimate_tokens
+
+# 比占位符还短的公式替换后反而更费token，不替换
+MIN_MASK_CHARS = 8
+
+# 一次扫描识别公式（分组1）和图片（分组2），转义的 \$ 不算公式分隔符
+MASK_PATTERN = re.compile(
+    r'((?<!\\)\$\$.+?(?<!\\)\$\$|\\\[.+?\\\]|(?<!\\)\$[^$\n]+?(?<!\\)\$|\\\(.+?\\\))'
+    r'|(!\[[^\]\n]*\]\([^)\n]*\)|<img\b[^>]*>)',
+    re.S
+)
+PLACEHOLDER_PATTERN = re.compile(r'\[\[([FI])(\d+)\]\]')
+
+MASK_INSTRUCTION = ("【占位符说明】形如[[F1]]的占位符代表公式，形如[[I1]]的占位符代表图片，"
+                    "译文中在对应位置原样保留每个占位符，不要修改、删除或重复")
+
+
+def placeholder(kind: str, number: int) -> str:
+    return f"[[{kind}{number}]]"
+
+
+def mask(text: str, min_chars: int = MIN_MASK_CHARS):
+    """
+    把公式和图片替换为编号的占位符，返回 (替换后的文本, 原文列表)
+
+    第 n 个占位符对应原文列表的第 n-1 项；编号只由文本决定，同一分段每次替换的结果相同，
+    从日志恢复的回复可以直接还原。
+    """
+    originals = []
+
+    def save(match):
+        original = match.group(0)
+        if match.lastindex == 1 and len(original) < min_chars:
+            return original
+        originals.append(original)
+        return placeholder("F" if match.lastindex == 1 else "I", len(originals))
+
+    return MASK_PATTERN.sub(save, text), originals
+
+
+def unmask(text: str, originals):
+    """
+    还原占位符，返回 (还原后的文本, 问题列表)
+
+    缺失、重复或编号未知的占位符都记为问题；重复的占位符每处都还原，未知的占位符保持原样。
+    """
+    counts = Counter()
+
+    def restore(match):
+        number = int(match.group(2))
+        if not 1 <= number <= len(originals):
+            return match.group(0)
+        counts[number] += 1
+        return originals[number - 1]
+
+    restored = PLACEHOLDER_PATTERN.sub(restore, text)
+    issues = []
+    for number, original in enumerate(originals, 1):
+        kind = "I" if original.startswith(("!", "<")) else "F"
+        if counts[number] == 0:
+            issues.append(f"缺少占位符 {placeholder(kind, number)}（{original[:60]}）")
+        elif counts[number] > 1:
+            issues.append(f"占位符 {placeholder(kind, number)} 出现 {counts[number]} 次（{original[:60]}）")
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        if not 1 <= int(match.group(2)) <= len(originals):
+            issues.append(f"未知的占位符 {match.group(0)}")
+    return restored, issues
+
+
+def saved_tokens(originals) -> int:
+    """占位符比原文少用的token数（估计值）"""
+    return sum(estimate_tokens(original) - estimate_tokens(placeholder("F", number))
+               for number, original in enumerate(originals, 1))
+
+
+class MaskReport:
+    """单个文件的占位符统计：替换数量、估计节省的输入/输出token和生成时间"""
+
+    def __init__(self):
+        self.placeholders = 0
+        self.input_saved = 0
+        self.output_saved = 0
+        self.output_tokens = 0
+        self.generation_time = 0.0
+        self.flagged = 0
+
+    def add_segment(self, originals, issues):
+        """记录一个完成的分段；还原成功时模型少输出的token与少输入的相同"""
+        self.placeholders += len(originals)
+        self.input_saved += saved_tokens(originals)
+        if issues:
+            self.flagged += 1
+        else:
+            self.output_saved += saved_tokens(originals)
+
+    def add_request(self, output_tokens: int, latency: float):
+        self.output_tokens += output_tokens
+        self.generation_time += latency
+
+    def print_summary(self, name: str):
+        if not self.placeholders:
+            return
+        # 按本文件实际的输出速度，把少输出的token折算成节省的生成时间
+        speed = self.output_tokens / self.generation_time if self.generation_time > 0 else 0.0
+        saved_time = self.output_saved / speed if speed > 0 else 0.0
+        print(f"文件 {name} 占位符：替换 {self.placeholders} 处公式和图片，输入约少 {self.input_saved:,} tokens，"
+              f"输出约少 {self.output_saved:,} tokens，约节省 {saved_time:.1f} 秒生成时间"
+              + (f"；{self.flagged} 个分段占位符异常" if self.flagged else ""))
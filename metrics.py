@@ -0,0 +1,177 @@
+import json
+import os
+import time
+from pathlib import Path
+
+# Prometheus直方图的延迟分桶（秒）
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+# 默认每隔多少秒刷新一次Prometheus文本文件
+DEFAULT_REFRESH_INTERVAL = 10.0
+
+
+def openai_usage_tokens(usage):
+    """从 OpenAI 的 usage 中取出 (输入, 输出, 缓存命中) token数，没有usage时返回None"""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached
+
+
+def percentile(values, fraction):
+    """最近秩法求分位数"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class KeyMetrics:
+    """单个密钥的汇总指标"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = {}  # 异常类名 -> 次数
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.retries = 0
+        self.latencies = []
+        self.ttfts = []
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class MetricsCollector:
+    """
+    三个入口共用的请求指标收集器
+
+    每个请求（包括失败的请求）写一行JSON到 jsonl_path，并按密钥汇总后定期写成
+    Prometheus文本文件（node_exporter textfile 格式），运行期间即可查看各密钥的延迟和错误。
+    """
+
+    def __init__(self, entry: str, jsonl_path: Path = None, prom_path: Path = None,
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.entry = entry
+        self.prom_path = Path(prom_path) if prom_path else None
+        self.refresh_interval = refresh_interval
+        self.keys = {}
+        self.last_refresh = 0.0
+        self.file = None
+        if jsonl_path:
+            Path(jsonl_path).parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(jsonl_path, 'a', encoding='utf-8')
+
+    def record(self, file: str, key: str, turn: int, latency: float, ttft: float = None,
+               input_tokens: int = 0, output_tokens: int = 0, cached_tokens: int = 0,
+               retries: int = 0, error: str = None, batch: bool = False):
+        """记录一次请求，error 为失败时的异常类名；batch 为True时是批处理请求，latency 为批次从提交到结束的时间"""
+        generation_time = latency - (ttft or 0)
+        record = {
+            "ts": time.time(),
+            "entry": self.entry,
+            "file": file,
+            "key": key,
+            "turn": turn,
+            "ttft": round(ttft, 4) if ttft is not None else None,
+            "latency": round(latency, 4),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens,
+            "output_tokens_per_second": round(output_tokens / generation_time, 2) if generation_time > 0 else None,
+            "retries": retries,
+            "error": error,
+            "batch": batch,
+        }
+        if self.file is not None:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+        metrics = self.keys.setdefault(key or "-", KeyMetrics())
+        metrics.requests += 1
+        metrics.retries += retries if error is None else 0
+        if error is not None:
+            metrics.errors[error] = metrics.errors.get(error, 0) + 1
+        else:
+            metrics.input_tokens += input_tokens
+            metrics.output_tokens += output_tokens
+            metrics.cached_tokens += cached_tokens
+            metrics.latencies.append(latency)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    metrics.buckets[i] += 1
+            if ttft is not None:
+                metrics.ttfts.append(ttft)
+
+        if self.prom_path and time.monotonic() - self.last_refresh >= self.refresh_interval:
+            self.write_prometheus()
+
+    def record_failure(self, file: str, key, turn: int, started: float, retries: int, error: Exception):
+        """记录一次失败的请求，started 为请求发出时的 time.monotonic()，未发出时为None"""
+        latency = time.monotonic() - started if started is not None else 0.0
+        self.record(file, getattr(key, "name", key), turn, latency, retries=retries, error=type(error).__name__)
+
+    def write_prometheus(self):
+        """把按密钥汇总的指标写成Prometheus文本文件，先写临时文件再替换"""
+        self.last_refresh = time.monotonic()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        def labels(key, **extra):
+            return {"entry": self.entry, "key": key, **extra}
+
+        items = sorted(self.keys.items())
+        metric("translator_requests_total", "counter", "Requests sent, including failed ones",
+               [(labels(k), m.requests) for k, m in items])
+        metric("translator_request_errors_total", "counter", "Failed requests by exception class",
+               [(labels(k, error=e), n) for k, m in items for e, n in sorted(m.errors.items())])
+        metric("translator_retries_total", "counter", "Retries before successful requests",
+               [(labels(k), m.retries) for k, m in items])
+        metric("translator_tokens_total", "counter", "Tokens by type",
+               [(labels(k, type=t), v) for k, m in items
+                for t, v in (("input", m.input_tokens), ("output", m.output_tokens), ("cached", m.cached_tokens))])
+
+        # 直方图的 _bucket/_sum/_count 共用一组 HELP/TYPE
+        name = "translator_request_latency_seconds"
+        lines.append(f"# HELP {name} Latency of successful requests")
+        lines.append(f"# TYPE {name} histogram")
+        for k, m in items:
+            key_labels = f'entry="{escape_label(self.entry)}",key="{escape_label(k)}"'
+            for bound, count in zip(LATENCY_BUCKETS, m.buckets):
+                lines.append(f'{name}_bucket{{{key_labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{key_labels},le="+Inf"}} {len(m.latencies)}')
+            lines.append(f"{name}_sum{{{key_labels}}} {sum(m.latencies):.4f}")
+            lines.append(f"{name}_count{{{key_labels}}} {len(m.latencies)}")
+        metric("translator_time_to_first_token_seconds", "gauge", "Median time to first token of streamed requests",
+               [(labels(k), f"{percentile(m.ttfts, 0.5):.4f}") for k, m in items if m.ttfts])
+
+        self.prom_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.prom_path.with_name(self.prom_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+    def print_summary(self):
+        print("\n=== 请求指标 ===")
+        for key, m in sorted(self.keys.items()):
+            errors = sum(m.errors.values())
+            generation = sum(m.latencies) - sum(m.ttfts)
+            speed = m.output_tokens / generation if generation > 0 else 0.0
+            print(f"密钥 {key}: 请求 {m.requests} 次，失败 {errors} 次，"
+                  f"延迟 p50 {percentile(m.latencies, 0.5):.1f} 秒 / p95 {percentile(m.latencies, 0.95):.1f} 秒，"
+                  f"输出 {speed:.1f} tokens/秒")
+
+    def close(self):
+        if self.prom_path:
+            self.write_prometheus()
+        if self.file is not None and not self.file.closed:
+            self.file.close()
@@ -1,63 +1,192 @@
 import anthropic
-import time
+import argparse
+import asyncio
 import random
+import time
 from pathlib import Path
+from chunker import estimate_tokens, split_markdown, build_segment_content, strip_sentinel, assemble_segments
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
+from journal import TranslationJournal, atomic_write
+from client_pool import ClientPool
+from completion import CompletionTracker
+from key_pool import KeyPool, redact_key
+from masking import MASK_INSTRUCTION, MaskReport, mask, unmask
+from metrics import MetricsCollector
+from preflight import load_throughput, plan_files, print_forecast
 
 # Token费用计算参考值（美元/1K tokens）
 INPUT_COST_PER_1K = 0.003  # $3 per million = $0.003 per 1K
 OUTPUT_COST_PER_1K = 0.015  # $15 per million = $0.015 per 1K
+CACHE_WRITE_COST_PER_1K = 0.00375  # 写入缓存按输入价格的1.25倍计费
+CACHE_READ_COST_PER_1K = 0.0003  # 读取缓存按输入价格的0.1倍计费
+# 命中和未命中缓存的请求都至少有这么多次时，才用两者每个输入token的平均耗时之差估算缓存节省的时间
+MIN_LATENCY_SAMPLES = 5
 
 # 初始化文件夹路径
 WORK_DIR = Path("workmd")
 OUTPUT_DIR = Path("outputmd")
 
+# 分段参数：每段的token预算和传给模型的前后文长度
+SEGMENT_MAX_TOKENS = 2000
+CONTEXT_CHARS = 300
+
+# 分段译文缓存，重复运行时未改动的分段直接复用
+CACHE_FILE = OUTPUT_DIR / "translation_cache.sqlite3"
+CACHE_MAX_MB = 512
+
+# 跨文档的模糊翻译记忆：几乎相同的段落直接复用译文，相似的段落作为参考译文发给模型
+MEMORY_FILE = OUTPUT_DIR / "translation_memory.sqlite3"
+
+# 可选：发送前把较长的公式和图片链接替换为占位符，收到译文后还原，模型不必原样复述LaTeX（仅同步模式）
+MASK_FORMULAS = False
+
+# 翻译日志目录，中断后重新运行时从最后提交的回复继续
+JOURNAL_DIR = OUTPUT_DIR / ".journal"
+
+MODEL = "claude-3-5-sonnet-20241022"
+# 直连官方API时留空；使用本地模拟服务测试时填写 http://127.0.0.1:8765
+BASE_URL = ""
+
+# 连接池参数，整个运行期间共用一个连接池
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60
+
+# 每个密钥的速率限制，0表示不限制；被429限流后冷却的初始秒数
+REQUESTS_PER_MINUTE = 0
+TOKENS_PER_MINUTE = 0
+MAX_IN_FLIGHT_PER_KEY = 1
+RATE_LIMIT_COOLDOWN = 10
+# 自适应并发：每个密钥的并发数从 MAX_IN_FLIGHT_PER_KEY 开始，请求成功且延迟正常时逐步增加到最多该值，
+# 遇到429、529过载或超时时减半；设为0时固定为 MAX_IN_FLIGHT_PER_KEY
+ADAPTIVE_MAX_IN_FLIGHT = 8
+
+# 每个请求的指标写入JSON Lines，按密钥汇总的指标定期写成Prometheus文本文件
+METRICS_FILE = OUTPUT_DIR / "metrics.jsonl"
+PROMETHEUS_FILE = OUTPUT_DIR / "metrics.prom"
+METRICS_REFRESH_INTERVAL = 10
+
+# 批处理模式（--batch）参数
+BATCH_MAX_REQUESTS = 1000  # 每个批次的最大请求数
+BATCH_POLL_INTERVAL = 30  # 轮询批次状态的间隔（秒）
+BATCH_MAX_ATTEMPTS = 5  # 单个分段出错或过期后的最大重新提交次数
+BATCH_COST_RATIO = 0.5  # 批处理价格相对同步调用的比例
+BATCH_POLL_MAX_ERRORS = 8  # 查询批次状态或结果连续出错的最大次数，超过后取消批次
+
 # 确保输出目录存在
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-# 客户端初始化
-client = anthropic.Anthropic(
-    api_key=""
-)
+# API密钥列表，一个文件的各分段在所有密钥上并行翻译
+API_KEYS = [
+    ""
+]
 
 
 class TokenCounter:
     def __init__(self):
         self.total_input_tokens = 0
         self.total_output_tokens = 0
+        self.total_cache_creation_tokens = 0
+        self.total_cache_read_tokens = 0
         self.call_count = 0
         self.file_count = 0
-
-    def add_usage(self, input_tokens, output_tokens):
+        # 分别统计命中和未命中缓存的请求耗时和输入token数
+        self.cached_latency = 0.0
+        self.cached_calls = 0
+        self.cached_input_tokens = 0
+        self.cached_read_tokens = 0
+        self.uncached_latency = 0.0
+        self.uncached_calls = 0
+        self.uncached_input_tokens = 0
+
+    def add_usage(self, input_tokens, output_tokens, cache_creation_tokens=0, cache_read_tokens=0, latency=None):
         self.total_input_tokens += input_tokens
         self.total_output_tokens += output_tokens
+        self.total_cache_creation_tokens += cache_creation_tokens
+        self.total_cache_read_tokens += cache_read_tokens
         self.call_count += 1
+        if latency is not None:
+            all_input_tokens = input_tokens + cache_creation_tokens + cache_read_tokens
+            if cache_read_tokens:
+                self.cached_latency += latency
+                self.cached_calls += 1
+                self.cached_input_tokens += all_input_tokens
+                self.cached_read_tokens += cache_read_tokens
+            else:
+                self.uncached_latency += latency
+                self.uncached_calls += 1
+                self.uncached_input_tokens += all_input_tokens
 
     def add_file(self):
         self.file_count += 1
 
+    def total_cost(self):
+        """按同步调用价格计算的总成本"""
+        return (self.total_input_tokens / 1000) * INPUT_COST_PER_1K \
+            + (self.total_output_tokens / 1000) * OUTPUT_COST_PER_1K \
+            + (self.total_cache_creation_tokens / 1000) * CACHE_WRITE_COST_PER_1K \
+            + (self.total_cache_read_tokens / 1000) * CACHE_READ_COST_PER_1K
+
     def print_summary(self):
         input_cost = (self.total_input_tokens / 1000) * INPUT_COST_PER_1K
         output_cost = (self.total_output_tokens / 1000) * OUTPUT_COST_PER_1K
-        total_cost = input_cost + output_cost
+        cache_write_cost = (self.total_cache_creation_tokens / 1000) * CACHE_WRITE_COST_PER_1K
+        cache_read_cost = (self.total_cache_read_tokens / 1000) * CACHE_READ_COST_PER_1K
+        total_cost = self.total_cost()
+
+        # 不使用缓存时，写入和读取缓存的token都按普通输入计费
+        uncached_cost = input_cost + output_cost + (
+            (self.total_cache_creation_tokens + self.total_cache_read_tokens) / 1000) * INPUT_COST_PER_1K
+        all_input_tokens = self.total_input_tokens + self.total_cache_creation_tokens + self.total_cache_read_tokens
 
         print("\n=== Token 使用统计 ===")
         print(f"处理文件数: {self.file_count}")
         print(f"API调用次数: {self.call_count}")
-        print(f"总输入tokens: {self.total_input_tokens:,}")
+        print(f"总输入tokens: {all_input_tokens:,}")
+        print(f"  其中未缓存: {self.total_input_tokens:,}")
+        print(f"  其中写入缓存: {self.total_cache_creation_tokens:,}")
+        print(f"  其中读取缓存: {self.total_cache_read_tokens:,}")
         print(f"总输出tokens: {self.total_output_tokens:,}")
-        print(f"总tokens: {self.total_input_tokens + self.total_output_tokens:,}")
+        print(f"总tokens: {all_input_tokens + self.total_output_tokens:,}")
         print("\n=== 成本统计（美元）===")
         print(f"输入成本: ${input_cost:.4f}")
+        print(f"缓存写入成本: ${cache_write_cost:.4f}")
+        print(f"缓存读取成本: ${cache_read_cost:.4f}")
         print(f"输出成本: ${output_cost:.4f}")
         print(f"总成本: ${total_cost:.4f}")
-        print(f"使用prompt caching节省成本: ${total_cost * 0.9:.4f}")
-        print(f"平均每个文件成本: ${total_cost / self.file_count:.4f}")
+        print(f"使用prompt caching节省成本: ${uncached_cost - total_cost:.4f}")
+        if self.file_count:
+            print(f"平均每个文件成本: ${total_cost / self.file_count:.4f}")
+
+        print("\n=== 延迟统计 ===")
+        if self.cached_calls:
+            print(f"命中缓存的请求平均耗时: {self.cached_latency / self.cached_calls:.1f} 秒（{self.cached_calls} 次）")
+        if self.uncached_calls:
+            print(f"未命中缓存的请求平均耗时: {self.uncached_latency / self.uncached_calls:.1f} 秒（{self.uncached_calls} 次）")
+        saved = self.cache_time_saved()
+        if saved is not None:
+            print(f"估算缓存节省的预填充时间: {saved:.1f} 秒（按实测每个输入token的耗时之差）")
+
+    def cache_time_saved(self):
+        """
+        用实测数据估算读取缓存节省的时间：未命中与命中缓存的请求每个输入token的平均耗时之差，乘以读取缓存的token数
+
+        样本不足或命中缓存的请求并不更快时返回None。
+        """
+        if self.cached_calls < MIN_LATENCY_SAMPLES or self.uncached_calls < MIN_LATENCY_SAMPLES \
+                or not self.cached_input_tokens or not self.uncached_input_tokens:
+            return None
+        difference = self.uncached_latency / self.uncached_input_tokens \
+            - self.cached_latency / self.cached_input_tokens
+        return difference * self.cached_read_tokens if difference > 0 else None
 
 
 def get_translation_prompt():
     """定义固定的翻译提示模板"""
     return """你是一个专门从事将学术的markdown文本翻译成学术中文的AI助手并且精通数学。
     最重要的要求：将全部文本翻译完后，再生成提示"本次翻译任务完成"，一定确保全部翻译完后再回复，绝对不要提前回复。
+    标注为【上文】【下文】的内容仅供理解上下文，不要翻译也不要输出，只翻译【需要翻译的内容】部分。
     重要的基本要求:
     1. 对于markdown文档的处理，保持markdown内联latex的格式，公式块使用双美元符$$ $$，双美元符公式块需要单独成行，行内公式使用单美元符$ $。正文使用中文全角标点符号，数学文本中使用英文半角标点符号。
     3. 你不会生成任何除了翻译内容以外的其他文本，由于我一次给你的文本很长，你可能不能通过一次回答完整，不用担心，你的单次回答被截断后，我会提示你继续。
@@ -85,111 +214,470 @@ def get_retry_delay(retry_count):
     return delay + jitter
 
 
-def translate_markdown(input_file: Path, output_file: Path, token_counter: TokenCounter):
-    """翻译单个markdown文件的函数"""
-    print(f"\n开始处理文件: {input_file.name}")
-
-    # 读取文件内容
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # 准备输出文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write("")
-
+def build_request(content: str, accumulated_translation: str):
+    """构造一次翻译请求的参数，已有译文时构造继续翻译的请求"""
+    # 系统提示和原文标记为可缓存，继续翻译的轮次直接读取缓存
+    source_message = {"role": "user", "content": [
+        {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
+    ]}
+    return {
+        "model": MODEL,
+        "max_tokens": 8192,
+        "system": [{"type": "text", "text": get_translation_prompt(), "cache_control": {"type": "ephemeral"}}],
+        "messages": [
+            source_message
+        ] if not accumulated_translation else [
+            source_message,
+            {"role": "assistant", "content": accumulated_translation},
+            {"role": "user", "content": "继续翻译剩余内容，一次尽可能多地翻译内容，避免生成其他文本"}
+        ],
+    }
+
+
+async def translate_segment(key_pool: KeyPool, clients: ClientPool, segment, content: str, label: str,
+                            token_counter: TokenCounter, journal: TranslationJournal, metrics: MetricsCollector,
+                            priority: float = 0, report: MaskReport = None, source: str = None):
+    """
+    翻译单个分段的异步函数，回复被截断时在分段内继续，失败返回None
+
+    priority 越大越先取得密钥；report 不为None时把每轮的输出token和耗时记入占位符统计；
+    source 为发送的分段正文（替换占位符后），用于判断是否译完，默认为分段原文。
+    """
     max_retries = 20
     retry_count = 0
-    accumulated_translation = ""
+    # 从日志中恢复已提交的回复
+    accumulated_translation = "".join(journal.replies(segment.index))
+    if journal.is_done(segment.index):
+        print(f"分段 {label} 从日志恢复")
+        return strip_sentinel(accumulated_translation)
+    if accumulated_translation:
+        print(f"分段 {label} 从日志恢复已提交的回复，继续翻译")
+    # 按结束原因和译文对原文的覆盖情况判断是否译完
+    tracker = CompletionTracker(source or segment.text, accumulated_translation)
 
     while True:
+        key = None
+        request_start = None
+        turn = len(journal.replies(segment.index))
         try:
-            print(f"发送翻译请求...")
-
-            response = client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=8192,
-                system=get_translation_prompt(),
-                messages=[
-                    {"role": "user", "content": content}
-                ] if not accumulated_translation else [
-                    {"role": "user", "content": content},
-                    {"role": "assistant", "content": accumulated_translation},
-                    {"role": "user", "content": "继续翻译剩余内容，一次尽可能多地翻译内容，避免生成其他文本"}
-                ]
-            )
+            print(f"分段 {label} 发送翻译请求...")
+
+            # 预计token数：提示词和已有译文作为输入，再加上与原文相当的输出
+            request_tokens = estimate_tokens(get_translation_prompt()) + 2 * estimate_tokens(content) \
+                + estimate_tokens(accumulated_translation)
+
+            # 每一轮请求都交给当前有余量的密钥，被429限流的密钥自动冷却
+            async with key_pool.lease(request_tokens, priority) as key:
+                request_start = time.monotonic()
+                response = await clients.anthropic(key.api_key, BASE_URL).messages.create(
+                    **build_request(content, accumulated_translation)
+                )
+                latency = time.monotonic() - request_start
+                key_pool.record_usage(key, response.usage.input_tokens + response.usage.output_tokens,
+                                      request_tokens)
 
             reply = response.content[0].text.strip()
             accumulated_translation += reply
+            done = tracker.update(reply, response.stop_reason)
+            journal.append(segment, reply, done)
 
+            cache_creation_tokens = getattr(response.usage, "cache_creation_input_tokens", None) or 0
+            cache_read_tokens = getattr(response.usage, "cache_read_input_tokens", None) or 0
             token_counter.add_usage(
                 response.usage.input_tokens,
-                response.usage.output_tokens
+                response.usage.output_tokens,
+                cache_creation_tokens,
+                cache_read_tokens,
+                latency
             )
+            metrics.record(label, key.name, turn, latency,
+                           input_tokens=response.usage.input_tokens + cache_creation_tokens,
+                           output_tokens=response.usage.output_tokens, cached_tokens=cache_read_tokens,
+                           retries=retry_count)
+            if report is not None:
+                report.add_request(response.usage.output_tokens, latency)
 
             input_cost = (response.usage.input_tokens / 1000) * INPUT_COST_PER_1K
             output_cost = (response.usage.output_tokens / 1000) * OUTPUT_COST_PER_1K
+            cache_cost = (cache_creation_tokens / 1000) * CACHE_WRITE_COST_PER_1K \
+                + (cache_read_tokens / 1000) * CACHE_READ_COST_PER_1K
 
-            print(f"\n当前请求token使用:")
+            print(f"\n分段 {label} 当前请求token使用:")
             print(f"输入tokens: {response.usage.input_tokens:,}")
+            print(f"缓存写入/读取tokens: {cache_creation_tokens:,} / {cache_read_tokens:,}")
             print(f"输出tokens: {response.usage.output_tokens:,}")
-            print(f"成本: ${input_cost + output_cost:.4f}")
+            print(f"成本: ${input_cost + output_cost + cache_cost:.4f}")
+            print(f"耗时: {latency:.1f} 秒")
             print(f"收到回复，长度：{len(reply)}")
+            if tracker.note:
+                print(f"分段 {label} {tracker.note}")
 
-            with open(output_file, 'a', encoding='utf-8') as f:
-                f.write(reply + "\n\n")
-
-            if "本次翻译任务完成" in reply:
-                print(f"文件 {input_file.name} 翻译完成")
-                token_counter.add_file()
-                break
+            if done:
+                return strip_sentinel(accumulated_translation)
 
             retry_count = 0
 
+        except (anthropic.RateLimitError, anthropic.APIConnectionError) as e:
+            print(f"分段 {label} 连接错误或速率限制: {e}")
+            metrics.record_failure(label, key, turn, request_start, retry_count, e)
+            retry_count += 1
+            if retry_count > max_retries:
+                print("超过最大重试次数，任务终止。")
+                return None
+            # 被限流的密钥已进入冷却，直接换其他密钥重试
+            if isinstance(e, anthropic.RateLimitError):
+                continue
+            retry_delay = get_retry_delay(retry_count)
+            print(f"重试第 {retry_count} 次，将在 {retry_delay:.1f} 秒后重试...")
+            await asyncio.sleep(retry_delay)
+
         except anthropic.APIError as e:
+            metrics.record_failure(label, key, turn, request_start, retry_count, e)
             if "overloaded_error" in str(e) or "529" in str(e):
-                print(f"服务器过载，等待重试...")
+                print(f"分段 {label} 服务器过载，等待重试...")
                 retry_delay = get_retry_delay(retry_count)
                 print(f"将在 {retry_delay:.1f} 秒后重试")
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
                 retry_count += 1
                 if retry_count > max_retries:
                     print("超过最大重试次数，任务终止。")
-                    return False
+                    return None
                 continue
 
-            print(f"API错误: {e}")
+            print(f"分段 {label} API错误: {e}")
             retry_count += 1
             if retry_count > max_retries:
                 print("超过最大重试次数，任务终止。")
-                return False
+                return None
             retry_delay = get_retry_delay(retry_count)
             print(f"重试第 {retry_count} 次，将在 {retry_delay:.1f} 秒后重试...")
-            time.sleep(retry_delay)
-
-        except (anthropic.RateLimitError, anthropic.APIConnectionError) as e:
-            print(f"连接错误或速率限制: {e}")
-            retry_count += 1
-            if retry_count > max_retries:
-                print("超过最大重试次数，任务终止。")
-                return False
-            retry_delay = get_retry_delay(retry_count)
-            print(f"重试第 {retry_count} 次，将在 {retry_delay:.1f} 秒后重试...")
-            time.sleep(retry_delay)
+            await asyncio.sleep(retry_delay)
 
         except Exception as e:
-            print(f"未预期的错误: {str(e)}")
+            print(f"分段 {label} 未预期的错误: {str(e)}")
+            metrics.record_failure(label, key, turn, request_start, retry_count, e)
             retry_count += 1
             if retry_count > max_retries:
                 print("超过最大重试次数，任务终止。")
-                return False
+                return None
             retry_delay = get_retry_delay(retry_count)
             print(f"重试第 {retry_count} 次，将在 {retry_delay:.1f} 秒后重试...")
-            time.sleep(retry_delay)
+            await asyncio.sleep(retry_delay)
+
 
+async def translate_markdown(input_file: Path, output_file: Path, token_counter: TokenCounter,
+                             cache: TranslationCache, memory: TranslationMemory, clients: ClientPool,
+                             key_pool: KeyPool, metrics: MetricsCollector):
+    """翻译单个markdown文件的函数：按标题和段落切分后在所有密钥上并行翻译，再按顺序拼接"""
+    print(f"\n开始处理文件: {input_file.name}")
+
+    # 读取文件内容
+    with open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    segments = split_markdown(content, SEGMENT_MAX_TOKENS)
+    print(f"文件 {input_file.name} 共 {len(segments)} 个分段")
+
+    # 先查缓存，只有未命中的分段才发送请求
+    prompt = get_translation_prompt()
+    cache_keys = [cache.make_key(segment.text, prompt, MODEL) for segment in segments]
+    translations = [cache.get(key) for key in cache_keys]
+    pending = [segment for segment in segments if translations[segment.index] is None]
+    print(f"缓存命中 {len(segments) - len(pending)} 个分段，需要翻译 {len(pending)} 个分段")
+
+    # 替换了占位符的回复单独记日志，切换 MASK_FORMULAS 后不会混用
+    journal_name = f"{input_file.name}.masked.jsonl" if MASK_FORMULAS else f"{input_file.name}.jsonl"
+    journal = TranslationJournal(JOURNAL_DIR / journal_name, segments)
+    # 每个段落都有几乎相同的已译段落时直接复用，不发送请求
+    for segment in pending:
+        if not journal.replies(segment.index):
+            translations[segment.index] = memory.reuse(segment.text)
+            if translations[segment.index] is not None:
+                cache.put(cache_keys[segment.index], translations[segment.index])
+    reused = sum(1 for segment in pending if translations[segment.index] is not None)
+    if reused:
+        print(f"翻译记忆复用 {reused} 个分段")
+        pending = [segment for segment in pending if translations[segment.index] is None]
+
+    report = MaskReport() if MASK_FORMULAS else None
+    masks = {segment.index: mask(segment.text) if report is not None else (None, []) for segment in pending}
+
+    def segment_content(segment):
+        masked_text, originals = masks[segment.index]
+        content = build_segment_content(segments, segment.index, CONTEXT_CHARS, masked_text)
+        if originals:
+            content = f"{MASK_INSTRUCTION}\n\n{content}"
+        return memory.with_references(content, segment.text)
+
+    results = await asyncio.gather(*[
+        translate_segment(
+            key_pool,
+            clients,
+            segment,
+            segment_content(segment),
+            f"{input_file.name}[{segment.index + 1}/{len(segments)}]",
+            token_counter,
+            journal,
+            metrics,
+            priority=segment.tokens,
+            report=report,
+            source=masks[segment.index][0]
+        )
+        for segment in pending
+    ])
+    for segment, translation in zip(pending, results):
+        translations[segment.index] = translation
+        if translation is None:
+            continue
+        if report is not None:
+            # 占位符有问题的译文不写入缓存和翻译记忆，重新运行时再次翻译
+            translations[segment.index], issues = unmask(translation, masks[segment.index][1])
+            report.add_segment(masks[segment.index][1], issues)
+            if issues:
+                print(f"分段 {input_file.name}[{segment.index + 1}/{len(segments)}] 占位符校验失败: "
+                      f"{'；'.join(issues)}")
+                continue
+        cache.put(cache_keys[segment.index], translations[segment.index])
+        memory.add(segment.text, translations[segment.index])
+    if report is not None:
+        report.print_summary(input_file.name)
+
+    if any(t is None for t in translations):
+        journal.close()
+        print(f"文件 {input_file.name} 有分段翻译失败，已完成的部分保存在日志中")
+        return False
+
+    # 整个文件一次性原子写入，写完后删除日志
+    atomic_write(output_file, assemble_segments(translations))
+    journal.remove()
+
+    print(f"文件 {input_file.name} 翻译完成")
+    token_counter.add_file()
     return True
 
 
-def process_markdown_files():
+class BatchFile:
+    """批处理模式下一个文件的状态"""
+
+    def __init__(self, input_file: Path, segments, translations, cache_keys, journal: TranslationJournal):
+        self.input_file = input_file
+        self.output_file = OUTPUT_DIR / f"translated_{input_file.name}"
+        self.segments = segments
+        self.translations = translations
+        self.cache_keys = cache_keys
+        self.journal = journal
+        self.failed = False
+
+    def remaining(self):
+        return sum(1 for t in self.translations if t is None)
+
+    def write_if_complete(self, token_counter: TokenCounter):
+        """所有分段都完成后原子写入输出文件并删除日志"""
+        if self.failed or self.remaining():
+            return
+        atomic_write(self.output_file, assemble_segments(self.translations))
+        self.journal.remove()
+        token_counter.add_file()
+        print(f"文件 {self.input_file.name} 翻译完成")
+
+
+class BatchItem:
+    """批处理中一个分段的下一轮请求"""
+
+    def __init__(self, state: BatchFile, segment, accumulated_translation: str, content: str):
+        self.state = state
+        self.segment = segment
+        self.content = content
+        self.accumulated_translation = accumulated_translation
+        self.tracker = CompletionTracker(segment.text, accumulated_translation)
+        self.attempts = 0
+        self.label = f"{state.input_file.name}[{segment.index + 1}/{len(state.segments)}]"
+
+
+def handle_batch_success(item: BatchItem, message, token_counter: TokenCounter, cache: TranslationCache,
+                         memory: TranslationMemory, metrics: MetricsCollector, key_name: str, latency: float):
+    """处理一个成功的批处理结果，分段未完成时返回继续翻译的请求；latency 为批次从提交到结束的时间"""
+    usage = message.usage
+    cache_creation_tokens = getattr(usage, "cache_creation_input_tokens", None) or 0
+    cache_read_tokens = getattr(usage, "cache_read_input_tokens", None) or 0
+    token_counter.add_usage(usage.input_tokens, usage.output_tokens, cache_creation_tokens, cache_read_tokens)
+    metrics.record(item.label, key_name, len(item.state.journal.replies(item.segment.index)), latency,
+                   input_tokens=usage.input_tokens + cache_creation_tokens, output_tokens=usage.output_tokens,
+                   cached_tokens=cache_read_tokens, retries=item.attempts, batch=True)
+
+    reply = message.content[0].text.strip()
+    item.accumulated_translation += reply
+    done = item.tracker.update(reply, message.stop_reason)
+    if item.tracker.note:
+        print(f"分段 {item.label} {item.tracker.note}")
+    item.state.journal.append(item.segment, reply, done)
+    if not done:
+        return item
+
+    translation = strip_sentinel(item.accumulated_translation)
+    item.state.translations[item.segment.index] = translation
+    cache.put(item.state.cache_keys[item.segment.index], translation)
+    memory.add(item.segment.text, translation)
+    item.state.write_if_complete(token_counter)
+    return None
+
+
+def handle_batch_failure(item: BatchItem, reason: str):
+    """出错、过期或取消的请求重新提交，超过次数后放弃该分段所在的文件"""
+    item.attempts += 1
+    if item.attempts <= BATCH_MAX_ATTEMPTS:
+        print(f"分段 {item.label} {reason}，将重新提交（第 {item.attempts} 次）")
+        return item
+    print(f"分段 {item.label} {reason}，超过最大重新提交次数")
+    if not item.state.failed:
+        item.state.failed = True
+        item.state.journal.close()
+        print(f"文件 {item.state.input_file.name} 处理失败，已完成的部分保存在日志中")
+    return None
+
+
+async def wait_for_batch(client, batch):
+    """轮询批次直到结束；查询出错时保留批次id退避重试，连续出错超过 BATCH_POLL_MAX_ERRORS 次时返回最后的状态"""
+    errors = 0
+    while batch.processing_status != "ended":
+        await asyncio.sleep(get_retry_delay(errors) if errors else BATCH_POLL_INTERVAL)
+        try:
+            batch = await client.messages.batches.retrieve(batch.id)
+            errors = 0
+        except anthropic.APIError as e:
+            errors += 1
+            print(f"查询批次 {batch.id} 状态出错（第 {errors} 次）: {e}")
+            if errors >= BATCH_POLL_MAX_ERRORS:
+                break
+    return batch
+
+
+async def run_batch(client, key_name: str, items, token_counter: TokenCounter, cache: TranslationCache,
+                    memory: TranslationMemory, metrics: MetricsCollector):
+    """
+    提交一个批次并轮询到结束，结果到达后立即写回；返回需要继续或重新提交的请求
+
+    批次提交后查询出错时不重新提交（服务端的批次仍在运行，重新提交会重复计费），
+    一直查询不到时先取消批次并取回已完成的结果，只重新提交剩下的请求。
+    """
+    by_id = {f"req-{i}": item for i, item in enumerate(items)}
+    next_items = []
+    try:
+        batch = await client.messages.batches.create(requests=[
+            {"custom_id": custom_id, "params": build_request(item.content, item.accumulated_translation)}
+            for custom_id, item in by_id.items()
+        ])
+    except anthropic.APIError as e:
+        print(f"批次提交失败: {e}")
+        batch = None
+    else:
+        submitted = time.monotonic()
+        print(f"已提交批次 {batch.id}，共 {len(items)} 个请求")
+        batch = await wait_for_batch(client, batch)
+        if batch.processing_status != "ended":
+            try:
+                batch = await client.messages.batches.cancel(batch.id)
+                print(f"批次 {batch.id} 状态查询多次失败，已取消，等待取回已完成的结果")
+            except anthropic.APIError as e:
+                print(f"取消批次 {batch.id} 失败: {e}")
+            batch = await wait_for_batch(client, batch)
+        latency = time.monotonic() - submitted
+
+    for attempt in range(BATCH_POLL_MAX_ERRORS):
+        if batch is None or batch.processing_status != "ended":
+            break
+        try:
+            # 已处理的结果从 by_id 中移除，重新读取时跳过
+            async for entry in await client.messages.batches.results(batch.id):
+                item = by_id.pop(entry.custom_id, None)
+                if item is None:
+                    continue
+                if entry.result.type == "succeeded":
+                    next_item = handle_batch_success(item, entry.result.message, token_counter, cache, memory,
+                                                     metrics, key_name, latency)
+                else:
+                    metrics.record(item.label, key_name, len(item.state.journal.replies(item.segment.index)),
+                                   latency, retries=item.attempts, error=entry.result.type, batch=True)
+                    next_item = handle_batch_failure(item, f"批处理结果为 {entry.result.type}")
+                if next_item is not None:
+                    next_items.append(next_item)
+            print(f"批次 {batch.id} 已结束")
+            break
+        except anthropic.APIError as e:
+            retry_delay = get_retry_delay(attempt)
+            print(f"读取批次 {batch.id} 结果出错: {e}，将在 {retry_delay:.1f} 秒后重试")
+            await asyncio.sleep(retry_delay)
+
+    # 没有返回结果的请求也重新提交
+    for item in by_id.values():
+        next_item = handle_batch_failure(item, "没有返回结果")
+        if next_item is not None:
+            next_items.append(next_item)
+    return next_items
+
+
+async def process_markdown_files_batch(md_files, token_counter: TokenCounter, cache: TranslationCache,
+                                       memory: TranslationMemory, clients: ClientPool, metrics: MetricsCollector):
+    """批处理模式：所有文件的分段通过批处理接口提交，未完成的分段作为继续翻译的请求再次提交"""
+    start = time.monotonic()
+    items = []
+    prompt = get_translation_prompt()
+    for input_file in md_files:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        segments = split_markdown(content, SEGMENT_MAX_TOKENS)
+        cache_keys = [cache.make_key(segment.text, prompt, MODEL) for segment in segments]
+        translations = [cache.get(key) for key in cache_keys]
+        journal = TranslationJournal(JOURNAL_DIR / f"{input_file.name}.jsonl", segments)
+        state = BatchFile(input_file, segments, translations, cache_keys, journal)
+
+        for segment in segments:
+            if translations[segment.index] is not None:
+                continue
+            accumulated_translation = "".join(journal.replies(segment.index))
+            if journal.is_done(segment.index):
+                translations[segment.index] = strip_sentinel(accumulated_translation)
+                continue
+            if not accumulated_translation:
+                translations[segment.index] = memory.reuse(segment.text)
+                if translations[segment.index] is not None:
+                    cache.put(cache_keys[segment.index], translations[segment.index])
+                    continue
+            content = memory.with_references(build_segment_content(segments, segment.index, CONTEXT_CHARS),
+                                             segment.text)
+            items.append(BatchItem(state, segment, accumulated_translation, content))
+        state.write_if_complete(token_counter)
+
+    print(f"共 {len(items)} 个分段需要通过批处理翻译")
+
+    round_count = 0
+    while items:
+        round_count += 1
+        print(f"\n=== 第 {round_count} 轮批处理，{len(items)} 个请求 ===")
+        # 请求按批次上限拆分，各批次轮流使用不同的密钥
+        batches = [items[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(items), BATCH_MAX_REQUESTS)]
+        keys = [API_KEYS[i % len(API_KEYS)] for i in range(len(batches))]
+        results = await asyncio.gather(*[
+            run_batch(clients.anthropic(api_key, BASE_URL), redact_key(api_key), batch, token_counter, cache, memory,
+                      metrics)
+            for api_key, batch in zip(keys, batches)
+        ])
+        items = [item for next_items in results for item in next_items]
+
+    elapsed = time.monotonic() - start
+    sync_cost = token_counter.total_cost()
+    print("\n=== 批处理统计 ===")
+    print(f"批处理轮数: {round_count}")
+    print(f"总耗时: {elapsed:.1f} 秒")
+    if elapsed > 0:
+        print(f"吞吐量: {token_counter.file_count / elapsed * 3600:.1f} 文件/小时，"
+              f"{token_counter.total_output_tokens / elapsed:.1f} 输出tokens/秒")
+    print(f"同步调用成本: ${sync_cost:.4f}")
+    print(f"批处理成本: ${sync_cost * BATCH_COST_RATIO:.4f}")
+    print(f"批处理节省: ${sync_cost * (1 - BATCH_COST_RATIO):.4f}")
+
+
+async def process_markdown_files(batch: bool = False):
     """处理文件夹中的所有markdown文件"""
     # 获取所有markdown文件
     md_files = list(WORK_DIR.glob("*.md"))
@@ -199,39 +687,75 @@ def process_markdown_files():
 
     print(f"找到 {len(md_files)} 个markdown文件")
 
-    # 初始化计数器
+    # 初始化计数器和缓存
     token_counter = TokenCounter()
-
-    # 遍历处理每个文件
-    for i, input_file in enumerate(md_files, 1):
-        print(f"\n=== 处理第 {i}/{len(md_files)} 个文件 ===")
-
-        # 构建输出文件路径
-        output_file = OUTPUT_DIR / f"translated_{input_file.name}"
-
-        try:
-            success = translate_markdown(input_file, output_file, token_counter)
-            if not success:
-                print(f"文件 {input_file.name} 处理失败")
+    cache = TranslationCache(CACHE_FILE, CACHE_MAX_MB * 1024 * 1024)
+    memory = TranslationMemory(MEMORY_FILE, get_translation_prompt(), MODEL)
+    clients = ClientPool(MAX_CONNECTIONS, MAX_KEEPALIVE_CONNECTIONS, KEEPALIVE_EXPIRY)
+    # 密钥池按每个密钥的余量分配请求，同时限制每个密钥的并发数
+    key_pool = KeyPool(API_KEYS, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                       MAX_IN_FLIGHT_PER_KEY, RATE_LIMIT_COOLDOWN,
+                       adaptive_limit=ADAPTIVE_MAX_IN_FLIGHT)
+    metrics = MetricsCollector("mulidirct", METRICS_FILE, PROMETHEUS_FILE, METRICS_REFRESH_INTERVAL)
+
+    # 发送请求前先估计每个文件的token数、费用和总耗时，预计耗时长的文件排在前面
+    throughput = load_throughput(METRICS_FILE)
+    plans = plan_files(md_files, SEGMENT_MAX_TOKENS, CONTEXT_CHARS, get_translation_prompt(), MODEL, cache,
+                       throughput)
+    cost_ratio = BATCH_COST_RATIO if batch else 1.0
+    print_forecast(plans, md_files, len(API_KEYS), MAX_IN_FLIGHT_PER_KEY, throughput,
+                   INPUT_COST_PER_1K * cost_ratio, OUTPUT_COST_PER_1K * cost_ratio,
+                   REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, sequential=True, estimate_makespan=not batch,
+                   adaptive_limit=ADAPTIVE_MAX_IN_FLIGHT)
+    md_files = [plan.path for plan in plans]
+
+    if batch:
+        # 批处理模式：所有分段一起提交
+        await process_markdown_files_batch(md_files, token_counter, cache, memory, clients, metrics)
+    else:
+        # 遍历处理每个文件
+        for i, input_file in enumerate(md_files, 1):
+            print(f"\n=== 处理第 {i}/{len(md_files)} 个文件 ===")
+
+            # 构建输出文件路径
+            output_file = OUTPUT_DIR / f"translated_{input_file.name}"
+
+            try:
+                success = await translate_markdown(input_file, output_file, token_counter, cache, memory, clients,
+                                                   key_pool, metrics)
+                if not success:
+                    print(f"文件 {input_file.name} 处理失败")
+                    continue
+
+            except Exception as e:
+                print(f"处理文件 {input_file.name} 时发生错误: {e}")
                 continue
 
-        except Exception as e:
-            print(f"处理文件 {input_file.name} 时发生错误: {e}")
-            continue
-
     # 打印总体统计信息
     print("\n=== 批量处理完成 ===")
     token_counter.print_summary()
+    key_pool.print_summary()
+    metrics.print_summary()
+    metrics.close()
+    cache.print_summary()
+    cache.close()
+    memory.print_summary()
+    memory.close()
+    await clients.aclose()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="直连API翻译workmd中的markdown文件")
+    parser.add_argument("--batch", action="store_true", help="通过批处理接口提交所有分段，适合不赶时间的大批量任务")
+    args = parser.parse_args()
+
     try:
         # 检查工作目录是否存在
         if not WORK_DIR.exists():
             print(f"错误：工作目录 {WORK_DIR} 不存在")
             return
 
-        process_markdown_files()
+        asyncio.run(process_markdown_files(batch=args.batch))
 
     except KeyboardInterrupt:
         print("\n程序被用户中断")
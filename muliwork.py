@@ -1,8 +1,17 @@
 import asyncio
 import os
 from pathlib import Path
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor
+from chunker import estimate_tokens, split_markdown, build_segment_content, strip_sentinel, assemble_segments
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
+from journal import TranslationJournal, atomic_write
+from client_pool import ClientPool
+from completion import CompletionTracker
+from hedging import Hedger
+from key_pool import KeyPool, is_rate_limit_error
+from masking import MASK_INSTRUCTION, MaskReport, mask, unmask
+from metrics import MetricsCollector, openai_usage_tokens
+from preflight import load_throughput, plan_files, print_forecast
 
 
 # API密钥列表
@@ -12,11 +21,59 @@ API_KEYS = [
 
 BASE_URL = ""
 
+MODEL = "claude-3-5-sonnet-20241022"
+
 
 # 初始化文件夹路径
 WORK_DIR = Path("workmd")
 OUTPUT_DIR = Path("outputmd")
 
+# 分段参数：每段的token预算和传给模型的前后文长度
+SEGMENT_MAX_TOKENS = 2000
+CONTEXT_CHARS = 300
+
+# 分段译文缓存，重复运行时未改动的分段直接复用
+CACHE_FILE = OUTPUT_DIR / "translation_cache.sqlite3"
+CACHE_MAX_MB = 512
+
+# 跨文档的模糊翻译记忆：几乎相同的段落直接复用译文，相似的段落作为参考译文发给模型
+MEMORY_FILE = OUTPUT_DIR / "translation_memory.sqlite3"
+
+# 可选：发送前把较长的公式和图片链接替换为占位符，收到译文后还原，模型不必原样复述LaTeX
+MASK_FORMULAS = False
+
+# 翻译日志目录，中断后重新运行时从最后提交的回复继续
+JOURNAL_DIR = OUTPUT_DIR / ".journal"
+CONTINUE_PROMPT = "继续翻译，一次翻译尽可能多的内容，若全部文本翻译完，则生成提示'本次翻译任务完成'"
+
+# 连接池参数，整个运行期间每个base_url共用一个连接池
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60
+
+# 每个密钥的速率限制，0表示不限制；被429限流后冷却的初始秒数
+REQUESTS_PER_MINUTE = 0
+TOKENS_PER_MINUTE = 0
+MAX_IN_FLIGHT_PER_KEY = 1
+RATE_LIMIT_COOLDOWN = 10
+# 自适应并发：每个密钥的并发数从 MAX_IN_FLIGHT_PER_KEY 开始，请求成功且延迟正常时逐步增加到最多该值，
+# 遇到429、529过载或超时时减半；设为0时固定为 MAX_IN_FLIGHT_PER_KEY
+ADAPTIVE_MAX_IN_FLIGHT = 8
+
+# 长尾请求对冲：有空闲密钥时，等待超过历史延迟分位数的请求在另一个密钥上再发一份，先返回的生效
+HEDGE_REQUESTS = True
+HEDGE_PERCENTILE = 0.9
+HEDGE_MAX_EXTRA_FRACTION = 0.1  # 对冲请求的token数不超过全部请求的比例
+
+# 每个请求的指标写入JSON Lines，按密钥汇总的指标定期写成Prometheus文本文件
+METRICS_FILE = OUTPUT_DIR / "metrics.jsonl"
+PROMETHEUS_FILE = OUTPUT_DIR / "metrics.prom"
+METRICS_REFRESH_INTERVAL = 10
+
+# 预检时估算费用的参考价格（美元/1K tokens），按所用模型的价格修改
+INPUT_COST_PER_1K = 0.003
+OUTPUT_COST_PER_1K = 0.015
+
 initial_prompt = """
     你是一个专门从事将学术的markdown文本翻译成学术中文的AI助手并且精通数理金融。
     最重要的要求：
@@ -24,6 +81,7 @@ initial_prompt = """
     1. 对于markdown文档的处理，保持markdown内联latex的格式，公式块使用双美元符$$ $$，双美元符公式块需要单独成行，行内公式使用单美元符$ $。正文使用中文全角标点符号，数学文本中使用英文半角标点符号。
     2. 原markdown插入图片的代码保持原状不要作任何改动，文本中出现的HTML格式的表格转换为markdown内联表格的形式，并且保持表格中的内容不变。
     4. 原文文本中会遇到识别错乱的代码块，将其修正并
+    5. 标注为【上文】【下文】的内容仅供理解上下文，不要翻译也不要输出，只翻译【需要翻译的内容】部分。
     翻译的细节要求:
     1. 英文的长句翻译通常不会直接对应中文句式，你需要作出逻辑叙述的调整。
     3. 为照顾汉语的习惯，采用一词两译的做法。例如"set"在汉语中有时译成"集合"有时译成"集"，单独使用时常译成"集合"，而在与其他词汇连用时则译成"集"（如可数集等）。
@@ -35,72 +93,171 @@ initial_prompt = """
 """
 
 
-async def translate_file(file_path: Path, api_key: str, semaphore: asyncio.Semaphore):
-    """处理单个文件的异步函数"""
-    async with semaphore:
+async def translate_segment(file_path: Path, segments, index: int, key_pool: KeyPool,
+                            cache: TranslationCache, memory: TranslationMemory, clients: ClientPool,
+                            journal: TranslationJournal, metrics: MetricsCollector, hedger: Hedger,
+                            priority: float = 0, report: MaskReport = None):
+    """
+    翻译单个分段的异步函数，回复被截断时在分段内继续，失败返回None
+
+    priority 越大越先取得密钥；report 不为None时公式和图片替换为占位符发送，统计记入 report。
+    """
+    label = f"{file_path.name}[{index + 1}/{len(segments)}]"
+
+    cache_key = cache.make_key(segments[index].text, initial_prompt, MODEL)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        print(f"分段 {label} 命中缓存")
+        return cached
+
+    masked_text, originals = mask(segments[index].text) if report is not None else (None, [])
+
+    def finish(translation):
+        """还原占位符后写入缓存和翻译记忆；占位符有问题的译文不写入，重新运行时再次翻译"""
+        if report is not None:
+            translation, issues = unmask(translation, originals)
+            report.add_segment(originals, issues)
+            if issues:
+                print(f"分段 {label} 占位符校验失败: {'；'.join(issues)}")
+                return translation
+        cache.put(cache_key, translation)
+        memory.add(segments[index].text, translation)
+        return translation
+
+    # 从日志中恢复已提交的回复，已完成的分段直接返回
+    replies = journal.replies(index)
+    if journal.is_done(index):
+        print(f"分段 {label} 从日志恢复")
+        return finish(strip_sentinel("".join(replies)))
+
+    # 每个段落都有几乎相同的已译段落时直接复用，不发送请求
+    if not replies:
+        reused = memory.reuse(segments[index].text)
+        if reused is not None:
+            print(f"分段 {label} 复用翻译记忆")
+            cache.put(cache_key, reused)
+            return reused
+
+    # 相似段落的已有译文作为参考随原文发送，使重复内容的译法一致
+    content = build_segment_content(segments, index, CONTEXT_CHARS, masked_text)
+    if originals:
+        content = f"{MASK_INSTRUCTION}\n\n{content}"
+    content = memory.with_references(content, segments[index].text)
+    messages = [{"role": "system", "content": initial_prompt.format(content=content)}]
+    for reply in replies:
+        messages.append({"role": "assistant", "content": reply})
+        messages.append({"role": "user", "content": CONTINUE_PROMPT})
+    if replies:
+        print(f"分段 {label} 从日志恢复 {len(replies)} 轮回复，继续翻译")
+    # 按结束原因和译文对原文的覆盖情况判断是否译完
+    tracker = CompletionTracker(masked_text or segments[index].text, "".join(replies))
+    max_retries = 20
+    retry_count = 0
+
+    def record_failure(key, started, error):
+        metrics.record_failure(label, key, len(replies), started, retry_count, error)
+
+    while True:
+        attempt = None
         try:
-            print(f"开始处理文件: {file_path.name}")
-
-            client = OpenAI(
-                base_url=BASE_URL,
-                api_key=api_key
-            )
-
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            output_file = OUTPUT_DIR / f"translated_{file_path.name}"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write("")
-
-            messages = [{"role": "system", "content": initial_prompt.format(content=content)}]
-            max_retries = 20
+            print(f"分段 {label} 发送翻译请求...")
+            # 预计token数：输入加上与原文相当的输出
+            request_tokens = sum(estimate_tokens(m["content"]) for m in messages) + segments[index].tokens
+
+            async def send(key, hedge):
+                response = await clients.openai(BASE_URL, key.api_key).chat.completions.create(
+                    model=MODEL,
+                    messages=messages,
+                    timeout=300
+                )
+                if response.usage is not None:
+                    key_pool.record_usage(key, response.usage.total_tokens, request_tokens)
+                return response
+
+            # 每一轮请求都交给当前有余量的密钥，长时间未返回时在空闲密钥上对冲
+            attempt = await hedger.run(label, request_tokens, priority, segments[index].tokens, send, record_failure)
+            response, latency = attempt.result, attempt.latency
+
+            reply = response.choices[0].message.content
+            usage = openai_usage_tokens(response.usage) \
+                or (request_tokens - segments[index].tokens, estimate_tokens(reply), 0)
+            metrics.record(label, attempt.key.name, len(replies), latency, input_tokens=usage[0],
+                           output_tokens=usage[1], cached_tokens=usage[2], retries=retry_count)
+            if report is not None:
+                report.add_request(usage[1], latency)
+            print(f"分段 {label} 收到回复，长度：{len(reply)}")
+            replies.append(reply)
+            done = tracker.update(reply, response.choices[0].finish_reason)
+            if tracker.note:
+                print(f"分段 {label} {tracker.note}")
+            journal.append(segments[index], reply, done)
+
+            if done:
+                return finish(strip_sentinel("".join(replies)))
+
+            messages.append({"role": "assistant", "content": reply})
+            messages.append({"role": "user", "content": CONTINUE_PROMPT})
             retry_count = 0
 
-            while True:
-                try:
-                    print(f"文件 {file_path.name} 发送翻译请求...")
-
-                    with ThreadPoolExecutor() as executor:
-                        response = await asyncio.get_event_loop().run_in_executor(
-                            executor,
-                            lambda: client.chat.completions.create(
-                                model="claude-3-5-sonnet-20241022",
-                                messages=messages,
-                                timeout=300
-                            )
-                        )
-
-                    reply = response.choices[0].message.content
-                    print(f"文件 {file_path.name} 收到回复，长度：{len(reply)}")
-
-                    with open(output_file, 'a', encoding='utf-8') as f:
-                        f.write(reply + "\n\n")
-
-                    if "本次翻译任务完成" in reply:
-                        print(f"文件 {file_path.name} 翻译完成")
-                        break
-
-                    messages.append({"role": "assistant", "content": reply})
-                    messages.append({"role": "user",
-                                     "content": "继续翻译，一次翻译尽可能多的内容，若全部文本翻译完，则生成提示'本次翻译任务完成'"})
-                    retry_count = 0
-
-                except Exception as e:
-                    print(f"文件 {file_path.name} 处理出错: {str(e)}")
-                    retry_count += 1
-                    if retry_count > max_retries:
-                        print(f"文件 {file_path.name} 超过最大重试次数")
-                        return False
-                    print(f"文件 {file_path.name} 重试第 {retry_count} 次...")
-                    await asyncio.sleep(5)
-
-            return True
-
         except Exception as e:
-            print(f"文件 {file_path.name} 处理失败: {str(e)}")
+            print(f"分段 {label} 处理出错: {str(e)}")
+            # 请求本身的失败已由 hedger 记录，这里只记录收到回复之后的错误
+            if attempt is not None:
+                record_failure(attempt.key, attempt.started, e)
+            retry_count += 1
+            if retry_count > max_retries:
+                print(f"分段 {label} 超过最大重试次数")
+                return None
+            print(f"分段 {label} 重试第 {retry_count} 次...")
+            # 被限流的密钥已进入冷却，直接换其他密钥重试
+            if not is_rate_limit_error(e):
+                await asyncio.sleep(5)
+
+
+async def translate_file(file_path: Path, key_pool: KeyPool, cache: TranslationCache, memory: TranslationMemory,
+                         clients: ClientPool, metrics: MetricsCollector, hedger: Hedger):
+    """处理单个文件的异步函数：按标题和段落切分后并行翻译各分段，再按顺序拼接"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        segments = split_markdown(content, SEGMENT_MAX_TOKENS)
+        print(f"开始处理文件: {file_path.name}，共 {len(segments)} 个分段")
+
+        # 替换了占位符的回复单独记日志，切换 MASK_FORMULAS 后不会混用
+        journal_name = f"{file_path.name}.masked.jsonl" if MASK_FORMULAS else f"{file_path.name}.jsonl"
+        journal = TranslationJournal(JOURNAL_DIR / journal_name, segments)
+        report = MaskReport() if MASK_FORMULAS else None
+        if journal.resumed_count():
+            print(f"文件 {file_path.name} 从日志恢复 {journal.resumed_count()} 轮已提交的回复")
+
+        # 各分段的每一轮请求都从共用的密钥池中取密钥，所有文件中较长的分段先取得密钥
+        tasks = [
+            translate_segment(file_path, segments, segment.index, key_pool, cache, memory, clients, journal, metrics,
+                              hedger, priority=segment.tokens, report=report)
+            for segment in segments
+        ]
+        translations = await asyncio.gather(*tasks)
+        if report is not None:
+            report.print_summary(file_path.name)
+
+        if any(t is None for t in translations):
+            journal.close()
+            print(f"文件 {file_path.name} 有分段翻译失败，已完成的部分保存在日志中")
             return False
 
+        # 整个文件一次性原子写入，写完后删除日志
+        output_file = OUTPUT_DIR / f"translated_{file_path.name}"
+        atomic_write(output_file, assemble_segments(translations))
+        journal.remove()
+
+        print(f"文件 {file_path.name} 翻译完成")
+        return True
+
+    except Exception as e:
+        print(f"文件 {file_path.name} 处理失败: {str(e)}")
+        return False
+
 
 async def main():
     try:
@@ -115,15 +272,25 @@ async def main():
 
         print(f"找到 {len(md_files)} 个markdown文件")
 
-        # 创建信号量限制并发数
-        semaphore = asyncio.Semaphore(len(API_KEYS))
+        # 密钥池按每个密钥的余量分配请求，同时限制每个密钥的并发数
+        key_pool = KeyPool(API_KEYS, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                           MAX_IN_FLIGHT_PER_KEY, RATE_LIMIT_COOLDOWN,
+                           adaptive_limit=ADAPTIVE_MAX_IN_FLIGHT)
+        cache = TranslationCache(CACHE_FILE, CACHE_MAX_MB * 1024 * 1024)
+        memory = TranslationMemory(MEMORY_FILE, initial_prompt, MODEL)
+        clients = ClientPool(MAX_CONNECTIONS, MAX_KEEPALIVE_CONNECTIONS, KEEPALIVE_EXPIRY)
+        metrics = MetricsCollector("muliwork", METRICS_FILE, PROMETHEUS_FILE, METRICS_REFRESH_INTERVAL)
+        hedger = Hedger(key_pool, HEDGE_REQUESTS, HEDGE_PERCENTILE, HEDGE_MAX_EXTRA_FRACTION)
+
+        # 发送请求前先估计每个文件的token数、费用和整批的总耗时，预计耗时长的文件先开始
+        throughput = load_throughput(METRICS_FILE)
+        plans = plan_files(md_files, SEGMENT_MAX_TOKENS, CONTEXT_CHARS, initial_prompt, MODEL, cache, throughput)
+        print_forecast(plans, md_files, len(API_KEYS), MAX_IN_FLIGHT_PER_KEY, throughput,
+                       INPUT_COST_PER_1K, OUTPUT_COST_PER_1K, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                       adaptive_limit=ADAPTIVE_MAX_IN_FLIGHT)
 
         # 创建任务列表
-        tasks = []
-        for i, file_path in enumerate(md_files):
-            api_key = API_KEYS[i % len(API_KEYS)]
-            task = translate_file(file_path, api_key, semaphore)
-            tasks.append(task)
+        tasks = [translate_file(plan.path, key_pool, cache, memory, clients, metrics, hedger) for plan in plans]
 
         # 等待所有翻译任务完成
         results = await asyncio.gather(*tasks)
@@ -135,6 +302,15 @@ async def main():
         print(f"\n翻译任务完成:")
         print(f"成功: {success_count} 个文件")
         print(f"失败: {fail_count} 个文件")
+        key_pool.print_summary()
+        hedger.print_summary()
+        metrics.print_summary()
+        metrics.close()
+        cache.print_summary()
+        cache.close()
+        memory.print_summary()
+        memory.close()
+        await clients.aclose()
 
     except Exception as e:
         print(f"发生未预期的错误: {str(e)}")
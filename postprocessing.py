@@ -0,0 +1,15 @@
+"""
+顶层模块使用 后处理模块 中的函数时统一从这里导入
+
+后处理模块 中的脚本在各自目录下独立运行、按同级模块互相导入，这里把该目录加入导入路径后再导出。
+"""
+import sys
+from pathlib import Path
+
+POSTPROCESS_MODULE_DIR = Path(__file__).resolve().parent / "后处理模块"
+if str(POSTPROCESS_MODULE_DIR) not in sys.path:
+    sys.path.insert(0, str(POSTPROCESS_MODULE_DIR))
+
+from commd import file_hash, merge_markdown_files  # noqa: E402,F401
+from dollar_checker import DelimiterScanner, scan_lines  # noqa: E402,F401
+from pipeline import apply_stages, process_file  # noqa: E402,F401
@@ -0,0 +1,210 @@
+import heapq
+import json
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+from chunker import estimate_tokens, split_markdown, build_segment_content
+from metrics import percentile
+
+# 没有历史指标时使用的速度参考值
+DEFAULT_OUTPUT_TOKENS_PER_SECOND = 50.0
+DEFAULT_FIRST_TOKEN_SECONDS = 2.0
+# 校准速度时最多读取的历史请求数
+CALIBRATION_RECORDS = 5000
+
+
+@dataclass
+class Throughput:
+    """单个请求的速度模型：耗时 = 首字延迟 + 输出token数 / 输出速度"""
+    output_tokens_per_second: float
+    first_token_seconds: float
+    source: str
+
+    def duration(self, output_tokens: int) -> float:
+        return self.first_token_seconds + output_tokens / self.output_tokens_per_second
+
+
+@dataclass
+class SegmentJob:
+    """一个需要请求的分段"""
+    file: Path
+    index: int
+    input_tokens: int
+    output_tokens: int
+    duration: float
+
+
+@dataclass
+class FilePlan:
+    """单个文件的预检结果，jobs 只包含未命中缓存的分段"""
+    path: Path
+    segment_count: int
+    jobs: list
+    error: str = None
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(job.input_tokens for job in self.jobs)
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(job.output_tokens for job in self.jobs)
+
+    @property
+    def duration(self) -> float:
+        return sum(job.duration for job in self.jobs)
+
+    def cost(self, input_cost_per_1k: float, output_cost_per_1k: float) -> float:
+        return self.input_tokens / 1000 * input_cost_per_1k + self.output_tokens / 1000 * output_cost_per_1k
+
+
+def load_throughput(metrics_path: Path) -> Throughput:
+    """用以往运行写下的请求指标校准速度，没有记录时使用默认值"""
+    records = deque(maxlen=CALIBRATION_RECORDS)
+    if metrics_path and Path(metrics_path).exists():
+        with open(metrics_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # 批处理请求的耗时是整个批次的排队时间，不反映输出速度
+                if record.get("error") is None and record.get("output_tokens") and record.get("latency") \
+                        and not record.get("batch"):
+                    records.append(record)
+    if not records:
+        return Throughput(DEFAULT_OUTPUT_TOKENS_PER_SECOND, DEFAULT_FIRST_TOKEN_SECONDS, "默认值")
+
+    # 流式请求能分开首字延迟和输出速度；非流式请求只有总耗时，把它全部算作输出时间
+    streamed = [r for r in records if r.get("ttft") is not None and r.get("output_tokens_per_second")]
+    if streamed:
+        speed = percentile([r["output_tokens_per_second"] for r in streamed], 0.5)
+        first_token = percentile([r["ttft"] for r in streamed], 0.5)
+    else:
+        speed = percentile([r["output_tokens"] / r["latency"] for r in records], 0.5)
+        first_token = 0.0
+    return Throughput(speed, first_token, f"{metrics_path} 中的 {len(records)} 条请求记录")
+
+
+def plan_file(path: Path, max_tokens: int, context_chars: int, prompt: str, model: str,
+              cache, throughput: Throughput) -> FilePlan:
+    """切分单个文件并估计每个未命中缓存分段的token数和耗时"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return FilePlan(path, 0, [], error=str(e))
+
+    segments = split_markdown(content, max_tokens)
+    prompt_tokens = estimate_tokens(prompt)
+    jobs = []
+    for segment in segments:
+        if cache.contains(cache.make_key(segment.text, prompt, model)):
+            continue
+        input_tokens = prompt_tokens + estimate_tokens(build_segment_content(segments, segment.index, context_chars))
+        # 译文按与原文相当的token数估计
+        jobs.append(SegmentJob(path, segment.index, input_tokens, segment.tokens, throughput.duration(segment.tokens)))
+    return FilePlan(path, len(segments), jobs)
+
+
+def plan_files(md_files, max_tokens: int, context_chars: int, prompt: str, model: str,
+               cache, throughput: Throughput):
+    """预检所有文件，按预计耗时从长到短排序"""
+    plans = [plan_file(path, max_tokens, context_chars, prompt, model, cache, throughput) for path in md_files]
+    return sorted(plans, key=lambda plan: (-plan.duration, plan.path.name))
+
+
+def simulate_makespan(durations, workers: int) -> float:
+    """按给定顺序把任务依次交给最早空闲的通道，返回全部完成的时间"""
+    finish_times = [0.0] * max(1, workers)
+    for duration in durations:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + duration)
+    return max(finish_times)
+
+
+def format_duration(seconds: float) -> str:
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} 小时"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f} 分钟"
+    return f"{seconds:.0f} 秒"
+
+
+def format_range(low: float, high: float) -> str:
+    if format_duration(low) == format_duration(high):
+        return format_duration(low)
+    return f"{format_duration(low)} ~ {format_duration(high)}"
+
+
+def print_forecast(plans, md_files, key_count: int, max_in_flight: int, throughput: Throughput,
+                   input_cost_per_1k: float, output_cost_per_1k: float,
+                   requests_per_minute: float = 0, tokens_per_minute: float = 0, sequential: bool = False,
+                   estimate_makespan: bool = True, adaptive_limit: int = 0):
+    """
+    打印每个文件的费用预估和整批的总耗时预估，不发送任何请求
+
+    sequential 为True时文件逐个处理，总耗时为各文件耗时之和；否则所有分段共用全部密钥。
+    estimate_makespan 为False时只预估费用（如批处理接口的完成时间不由本地调度决定）。
+    adaptive_limit 大于 max_in_flight 时每个密钥的并发数在两者之间自适应，总耗时按两端的并发数给出范围。
+    续写轮次无法预先知道，未计入预估。
+    """
+    jobs = [job for plan in plans for job in plan.jobs]
+    cached = sum(plan.segment_count for plan in plans) - len(jobs)
+
+    print(f"\n=== 预检：{len(plans)} 个文件，需要翻译 {len(jobs)} 个分段，{cached} 个分段命中缓存 ===")
+    print(f"{'文件':<30} {'分段':>9} {'输入tokens':>11} {'输出tokens':>11} {'预计费用':>9} {'串行耗时':>10}")
+    for plan in plans:
+        if plan.error:
+            print(f"{plan.path.name:<30} 读取失败: {plan.error}")
+            continue
+        print(f"{plan.path.name:<30} {len(plan.jobs):>4}/{plan.segment_count:<4} {plan.input_tokens:>11,} "
+              f"{plan.output_tokens:>11,} ${plan.cost(input_cost_per_1k, output_cost_per_1k):>8.4f} "
+              f"{format_duration(plan.duration):>10}")
+
+    total_cost = sum(plan.cost(input_cost_per_1k, output_cost_per_1k) for plan in plans)
+    print(f"预计总费用: ${total_cost:.4f}（未计入续写轮次）")
+    print(f"速度参考: 输出 {throughput.output_tokens_per_second:.1f} tokens/秒，"
+          f"首字 {throughput.first_token_seconds:.1f} 秒（来自{throughput.source}）")
+    if not jobs or not estimate_makespan:
+        return
+
+    # 并发数自适应时分别按自适应上限（最快）和初始并发数（最慢）估计
+    concurrency = f"{max_in_flight}"
+    worker_counts = [max(1, key_count * max_in_flight)]
+    if adaptive_limit > max_in_flight:
+        concurrency = f"{max_in_flight}~{adaptive_limit}（自适应）"
+        worker_counts.insert(0, key_count * adaptive_limit)
+
+    if sequential:
+        # 文件逐个处理时，每个文件内部按分段从长到短分给全部密钥
+        makespans = [sum(simulate_makespan(sorted((job.duration for job in plan.jobs), reverse=True), workers)
+                         for plan in plans) for workers in worker_counts]
+        print(f"并发通道: {key_count} 个密钥 × {concurrency}，文件逐个处理")
+        print(f"预计总耗时: {format_range(makespans[0], makespans[-1])}")
+        return
+
+    # 所有分段从长到短分配（LPT），与按目录顺序分配的结果对比
+    order = {path: i for i, path in enumerate(md_files)}
+    longest_first, in_directory_order, lower_bounds = [], [], []
+    for workers in worker_counts:
+        # 总耗时的下限：全部通道满载、最长的分段，以及每个密钥的速率限制
+        bounds = [sum(job.duration for job in jobs) / workers, max(job.duration for job in jobs)]
+        if requests_per_minute:
+            bounds.append(len(jobs) / (requests_per_minute * key_count) * 60)
+        if tokens_per_minute:
+            total_tokens = sum(job.input_tokens + job.output_tokens for job in jobs)
+            bounds.append(total_tokens / (tokens_per_minute * key_count) * 60)
+        lower_bound = max(bounds)
+        lower_bounds.append(lower_bound)
+        longest_first.append(max(
+            simulate_makespan(sorted((job.duration for job in jobs), reverse=True), workers), lower_bound))
+        in_directory_order.append(max(simulate_makespan(
+            (job.duration for job in sorted(jobs, key=lambda job: (order.get(job.file, 0), job.index))), workers),
+            lower_bound))
+
+    workers = " ~ ".join(str(n) for n in reversed(worker_counts))
+    print(f"并发通道: {key_count} 个密钥 × {concurrency} = {workers}")
+    print(f"预计总耗时（最长分段优先）: {format_range(longest_first[0], longest_first[-1])}")
+    print(f"按目录顺序分配时的预计总耗时: {format_range(in_directory_order[0], in_directory_order[-1])}")
+    print(f"理论下限: {format_range(lower_bounds[0], lower_bounds[-1])}")
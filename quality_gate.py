@@ -0,0 +1,115 @@
+from chunker import cjk_pattern, estimate_tokens
+from postprocessing import DelimiterScanner
+
+# 译文的公式分隔符问题比原文多出该数量时中止
+MAX_EXTRA_DELIMITER_ISSUES = 2
+# 译文的token数超过原文的该倍数（再加上 LENGTH_SLACK_TOKENS）时中止
+MAX_LENGTH_RATIO = 3.0
+LENGTH_SLACK_TOKENS = 200
+# 每收到这么多字符检查一次循环：最近的输出末尾是同一段文字连续重复至少 LOOP_REPEATS 次
+# （原文本身有这样的连续重复时取原文最多重复次数的两倍），认为模型在循环输出
+LOOP_CHECK_CHARS = 256
+LOOP_NGRAM = 16  # 用末尾这么多个字符定位上一次重复
+LOOP_WINDOW = 4000
+LOOP_REPEATS = 5
+# 失控的回复通常一直输出到模型的单次输出上限，用于估计中止节省的token数
+RUNAWAY_OUTPUT_TOKENS = 8192
+
+
+class QualityAbort(Exception):
+    """流式回复没有通过质量检查，已提前中止"""
+
+    def __init__(self, reason: str, output_tokens: int, saved_tokens: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.output_tokens = output_tokens
+        self.saved_tokens = saved_tokens
+
+
+class StreamGate:
+    """
+    流式回复的增量质量检查
+
+    随delta到达逐行检查公式分隔符的配对，定期检查最近的输出是否在循环，并跟踪译文与原文的长度比。
+    超过阈值时 feed 返回中止原因；committed 为该分段之前已提交的回复，一起参与检查。
+    """
+
+    def __init__(self, source: str, committed: str = ""):
+        self.source_tokens = estimate_tokens(source)
+        # 原文本身有连续重复（如相同的表格行）时相应放宽
+        source_repeats = max((tail_repeats(source[max(0, end - LOOP_WINDOW):end])
+                              for end in range(LOOP_NGRAM, len(source) + 1, LOOP_CHECK_CHARS // 4)), default=0)
+        self.loop_repeats = max(LOOP_REPEATS, 2 * source_repeats)
+        self.allowed_issues = count_delimiter_issues(source) + MAX_EXTRA_DELIMITER_ISSUES
+        self.max_tokens = self.source_tokens * MAX_LENGTH_RATIO + LENGTH_SLACK_TOKENS
+        self.scanner = DelimiterScanner()
+        self.issues = 0
+        self.line = ""  # 尚未结束的一行
+        self.recent = ""  # 最近 LOOP_WINDOW 个字符
+        self.unchecked = 0  # 上次检查循环后收到的字符数
+        self.output_tokens = 0  # 本次请求收到的token数（估计）
+        self.total_tokens = 0.0  # 加上已提交的回复
+        self.looping = False
+        if committed:
+            self.feed(committed)
+            self.output_tokens = 0
+
+    def feed(self, text: str):
+        """检查一个delta，超过阈值时返回中止原因，否则返回None"""
+        cjk_count = len(cjk_pattern.findall(text))
+        tokens = cjk_count + (len(text) - cjk_count) * 2 / 7
+        self.output_tokens += tokens
+        self.total_tokens += tokens
+
+        lines = (self.line + text).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            self.issues += len(self.scanner.feed(line))
+
+        self.recent = (self.recent + text)[-LOOP_WINDOW:]
+        self.unchecked += len(text)
+        if self.unchecked >= LOOP_CHECK_CHARS:
+            self.unchecked = 0
+            repeats = tail_repeats(self.recent)
+            if repeats >= self.loop_repeats:
+                self.looping = True
+                return f"输出末尾同一段文字连续重复了 {repeats} 次: {self.recent[-LOOP_NGRAM:].strip()!r}"
+
+        if self.issues > self.allowed_issues:
+            return f"公式分隔符问题 {self.issues} 处，超过原文的问题数加 {MAX_EXTRA_DELIMITER_ISSUES}"
+        if self.total_tokens > self.max_tokens:
+            return f"译文约 {self.total_tokens:.0f} tokens，超过原文 {self.source_tokens} tokens 的 {MAX_LENGTH_RATIO:g} 倍"
+        return None
+
+    def abort(self, reason: str) -> QualityAbort:
+        """
+        构造中止异常，估计节省的输出token数
+
+        循环或超长的回复按一直输出到 RUNAWAY_OUTPUT_TOKENS 估计，公式错误的回复按输出到与原文等长估计。
+        """
+        runaway = self.looping or self.total_tokens > self.max_tokens
+        expected = RUNAWAY_OUTPUT_TOKENS if runaway else self.source_tokens - (self.total_tokens - self.output_tokens)
+        saved = max(0, round(expected - self.output_tokens))
+        return QualityAbort(reason, round(self.output_tokens), saved)
+
+
+def count_delimiter_issues(text: str) -> int:
+    """原文中已有的公式分隔符问题数（不计文件末尾未闭合的部分）"""
+    scanner = DelimiterScanner()
+    return sum(len(scanner.feed(line)) for line in text.split('\n'))
+
+
+def tail_repeats(text: str) -> int:
+    """文本末尾同一段文字连续重复的次数；末尾 LOOP_NGRAM 个字符之前没有出现过时返回0"""
+    ngram = text[-LOOP_NGRAM:]
+    if len(ngram) < LOOP_NGRAM or not ngram.strip():
+        return 0
+    previous = text.rfind(ngram, 0, len(text) - 1)
+    if previous == -1:
+        return 0
+    period = len(text) - LOOP_NGRAM - previous
+    unit = text[-period:]
+    count = 1
+    while text.endswith(unit, 0, len(text) - count * period):
+        count += 1
+    return count
@@ -0,0 +1,227 @@
+"""
+只重新翻译译文中有问题的分段
+
+按 muliwork.py 的参数重新切分源文件，用翻译缓存找到每个分段在译文中的位置，
+逐段检查公式分隔符，只把有问题的分段重新翻译后原地替换，其余内容保持不变。
+pending 中的文件已经过后处理流水线（daemon.py / pipeline.py），缓存的译文和重新翻译的译文
+都先经过同样的文本处理再查找和替换。
+
+用法:
+    python repair.py 后处理模块/pending --source-dir workmd
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass
+from pathlib import Path
+
+import muliwork
+from chunker import split_markdown
+from client_pool import ClientPool
+from hedging import Hedger
+from journal import TranslationJournal, atomic_write
+from key_pool import KeyPool
+from metrics import MetricsCollector
+from postprocessing import apply_stages, scan_lines
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
+
+# 每个文件最多重新翻译的轮数，重新翻译后仍有问题的分段在下一轮再次翻译
+REPAIR_ATTEMPTS = 3
+# muliwork.py 输出文件名的前缀
+OUTPUT_PREFIX = "translated_"
+
+
+@dataclass
+class Region:
+    """译文中的一段区域，对应一个或几个相邻的源分段"""
+    segments: list
+    start: int
+    end: int
+
+
+def find_regions(output: str, translations):
+    """
+    根据各分段的已知译文找出它们在整篇译文中的位置
+
+    translations 中为None的分段（缓存中没有或译文已被改动）与相邻的未知分段合并，
+    占据前后两个已知分段之间的全部内容。
+    """
+    regions = []
+    pending = []
+    cursor = 0
+
+    def flush_pending(end):
+        start = cursor
+        while start < end and output[start].isspace():
+            start += 1
+        while end > start and output[end - 1].isspace():
+            end -= 1
+        regions.append(Region(list(pending), start, end))
+        pending.clear()
+
+    for index, translation in enumerate(translations):
+        position = output.find(translation, cursor) if translation else -1
+        if position == -1:
+            pending.append(index)
+            continue
+        if pending:
+            flush_pending(position)
+        regions.append(Region([index], position, position + len(translation)))
+        cursor = position + len(translation)
+
+    if pending:
+        flush_pending(len(output))
+    return regions
+
+
+def locate_regions(output: str, translations):
+    """
+    找出各分段在译文中的位置，返回 (区域列表, 译文是否经过后处理)
+
+    分别用缓存的原始译文和经过后处理流水线的译文查找，定位到的区域多的为准；
+    后处理的图片链接按文件名改写（与 daemon.py 相同），使用 --image-dir 改写的图片所在分段按未知分段处理。
+    """
+    raw = find_regions(output, translations)
+    processed = find_regions(output, [apply_stages(t) if t else None for t in translations])
+    if len(processed) > len(raw):
+        return processed, True
+    return raw, False
+
+
+def region_issues(text: str):
+    """检查一段译文中的公式分隔符"""
+    return list(scan_lines(text.splitlines(True)))
+
+
+async def repair_file(output_file: Path, source_file: Path, key_pool: KeyPool, cache: TranslationCache,
+                      memory: TranslationMemory, clients: ClientPool, metrics: MetricsCollector,
+                      hedger: Hedger):
+    """检查并修复单个译文文件，返回 (重新翻译的分段数, 分段总数)"""
+    with open(source_file, 'r', encoding='utf-8') as f:
+        segments = split_markdown(f.read(), muliwork.SEGMENT_MAX_TOKENS)
+    with open(output_file, 'r', encoding='utf-8') as f:
+        output = f.read()
+
+    keys = [cache.make_key(segment.text, muliwork.initial_prompt, muliwork.MODEL) for segment in segments]
+    translations = [cache.get(key) for key in keys]
+    unknown = sum(1 for t in translations if t is None)
+    if unknown:
+        print(f"文件 {output_file.name} 有 {unknown} 个分段不在缓存中，这些分段按相邻区域整体处理")
+
+    repaired = set()
+    for attempt in range(1, REPAIR_ATTEMPTS + 1):
+        regions, processed = locate_regions(output, translations)
+        broken = []
+        for region in regions:
+            issues = region_issues(output[region.start:region.end])
+            if not issues:
+                continue
+            broken.append(region)
+            first_line = output.count('\n', 0, region.start) + 1
+            for issue in issues:
+                print(f"  {output_file.name}:{first_line + issue.line - 1}:{issue.column}: {issue.message}"
+                      f"（分段 {', '.join(str(i + 1) for i in region.segments)}）")
+
+        if not broken:
+            break
+
+        indices = [index for region in broken for index in region.segments]
+        print(f"文件 {output_file.name} 第 {attempt} 轮：重新翻译 {len(indices)}/{len(segments)} 个分段")
+
+        # 丢弃有问题的缓存译文，使翻译路径重新请求
+        for index in indices:
+            cache.discard(keys[index])
+        journal = TranslationJournal(muliwork.JOURNAL_DIR / f"{source_file.name}.repair.jsonl", segments)
+        results = await asyncio.gather(*(
+            muliwork.translate_segment(source_file, segments, index, key_pool, cache, memory, clients, journal,
+                                       metrics, hedger)
+            for index in indices
+        ))
+        journal.remove()
+        if any(result is None for result in results):
+            print(f"文件 {output_file.name} 有分段重新翻译失败")
+            break
+
+        new_translations = dict(zip(indices, results))
+        for region in reversed(broken):
+            replacement = "\n\n".join(new_translations[i] for i in region.segments if new_translations[i])
+            if processed:
+                replacement = apply_stages(replacement)
+            output = output[:region.start] + replacement + output[region.end:]
+        for index, translation in new_translations.items():
+            translations[index] = translation
+        repaired.update(indices)
+    else:
+        if any(region_issues(output[r.start:r.end]) for r in locate_regions(output, translations)[0]):
+            print(f"文件 {output_file.name} 经过 {REPAIR_ATTEMPTS} 轮重新翻译仍有问题")
+
+    if repaired:
+        atomic_write(output_file, output)
+        print(f"文件 {output_file.name} 已替换 {len(repaired)} 个分段的译文")
+    else:
+        print(f"文件 {output_file.name} 没有需要重新翻译的分段")
+    return len(repaired), len(segments)
+
+
+def collect_files(paths):
+    """展开命令行中的文件和文件夹"""
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.md")) if path.is_dir() else [path])
+    return files
+
+
+async def main(paths, source_dir: Path):
+    files = collect_files(paths)
+    if not files:
+        print("没有找到需要修复的markdown文件")
+        return
+
+    key_pool = KeyPool(muliwork.API_KEYS, muliwork.REQUESTS_PER_MINUTE, muliwork.TOKENS_PER_MINUTE,
+                       muliwork.MAX_IN_FLIGHT_PER_KEY, muliwork.RATE_LIMIT_COOLDOWN,
+                       adaptive_limit=muliwork.ADAPTIVE_MAX_IN_FLIGHT)
+    cache = TranslationCache(muliwork.CACHE_FILE, muliwork.CACHE_MAX_MB * 1024 * 1024)
+    memory = TranslationMemory(muliwork.MEMORY_FILE, muliwork.initial_prompt, muliwork.MODEL)
+    clients = ClientPool(muliwork.MAX_CONNECTIONS, muliwork.MAX_KEEPALIVE_CONNECTIONS, muliwork.KEEPALIVE_EXPIRY)
+    metrics = MetricsCollector("repair", muliwork.METRICS_FILE, muliwork.PROMETHEUS_FILE,
+                               muliwork.METRICS_REFRESH_INTERVAL)
+    hedger = Hedger(key_pool, muliwork.HEDGE_REQUESTS, muliwork.HEDGE_PERCENTILE, muliwork.HEDGE_MAX_EXTRA_FRACTION)
+
+    repaired_total = 0
+    segment_total = 0
+    for output_file in files:
+        name = output_file.name
+        source_file = source_dir / (name[len(OUTPUT_PREFIX):] if name.startswith(OUTPUT_PREFIX) else name)
+        if not source_file.exists():
+            print(f"找不到 {name} 对应的源文件 {source_file}，跳过")
+            continue
+        try:
+            repaired, total = await repair_file(output_file, source_file, key_pool, cache, memory, clients,
+                                                metrics, hedger)
+            repaired_total += repaired
+            segment_total += total
+        except Exception as e:
+            print(f"修复文件 {name} 时出错: {str(e)}")
+
+    print(f"\n修复完成：共重新翻译 {repaired_total}/{segment_total} 个分段")
+    key_pool.print_summary()
+    hedger.print_summary()
+    metrics.print_summary()
+    metrics.close()
+    cache.print_summary()
+    cache.close()
+    memory.print_summary()
+    memory.close()
+    await clients.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="只重新翻译译文中公式分隔符有问题的分段")
+    parser.add_argument("paths", nargs="*", default=["后处理模块/pending"], help="需要修复的译文文件或文件夹")
+    parser.add_argument("--source-dir", type=Path, default=muliwork.WORK_DIR, help="源文件所在的文件夹")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.paths, args.source_dir))
+    except KeyboardInterrupt:
+        print("\n程序被用户中断")
@@ -0,0 +1,71 @@
+import time
+from pathlib import Path
+from chunker import SENTINEL
+
+# 缓冲区刷新阈值
+DEFAULT_FLUSH_CHARS = 4096  # 缓冲的字符数超过该值时写入文件
+DEFAULT_FLUSH_INTERVAL = 1.0  # 距上次写入超过该秒数时写入文件
+
+
+class StreamSink:
+    """
+    流式回复的写入器
+
+    整个流期间保持文件句柄打开，按字符数或时间阈值批量写入；完整回复保存在列表中，
+    结束时只拼接一次。完成提示语被拆在两个delta之间时也能检测到。
+    """
+
+    def __init__(self, output_file: Path, sentinel: str = SENTINEL,
+                 flush_chars: int = DEFAULT_FLUSH_CHARS, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.file = open(output_file, 'a', encoding='utf-8')
+        self.sentinel = sentinel
+        self.flush_chars = flush_chars
+        self.flush_interval = flush_interval
+        self.parts = []  # 完整回复
+        self.buffer = []  # 尚未写入文件的部分
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        self.tail = ""  # 上一个delta末尾可能是提示语前缀的部分
+        self.completed = False
+
+    def write(self, text: str):
+        """写入一个delta"""
+        if not text:
+            return
+        self.parts.append(text)
+        self.buffer.append(text)
+        self.buffered_chars += len(text)
+
+        # 只在上一个delta的末尾和当前delta中查找提示语
+        if not self.completed:
+            window = self.tail + text
+            if self.sentinel in window:
+                self.completed = True
+            self.tail = window[-(len(self.sentinel) - 1):] if len(self.sentinel) > 1 else ""
+
+        if self.buffered_chars >= self.flush_chars or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """把缓冲区写入文件"""
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered_chars = 0
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def getvalue(self) -> str:
+        """返回目前收到的完整回复"""
+        return "".join(self.parts)
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from postprocessing import merge_markdown_files  # noqa: E402
+import commd  # noqa: E402
+
+CHAPTERS = 10
+
+
+def write_chapters(folder: Path):
+    folder.mkdir()
+    for i in range(1, CHAPTERS + 1):
+        (folder / f"ch{i}.md").write_text(f"# 第{i}章\n\n" + f"第{i}章的正文。\n" * i, encoding='utf-8')
+
+
+def expected_output(folder: Path) -> bytes:
+    return commd.SEPARATOR.encode('utf-8').join(
+        (folder / f"ch{i}.md").read_bytes() for i in range(1, CHAPTERS + 1))
+
+
+def record_copies(monkeypatch):
+    copied = []
+    copy_into = commd.copy_into
+
+    def recording_copy_into(outfile, path, size):
+        copied.append(Path(path).name)
+        copy_into(outfile, path, size)
+
+    monkeypatch.setattr(commd, "copy_into", recording_copy_into)
+    return copied
+
+
+def test_chapters_merged_in_natural_order(tmp_path):
+    folder = tmp_path / "chapters"
+    write_chapters(folder)
+    output = tmp_path / "merged.md"
+    merge_markdown_files(str(folder), str(output))
+
+    assert output.read_bytes() == expected_output(folder)
+    manifest = json.loads(Path(f"{output}.manifest.json").read_text(encoding='utf-8'))
+    assert [chapter["name"] for chapter in manifest["chapters"]] == [f"ch{i}.md" for i in range(1, CHAPTERS + 1)]
+
+
+def test_changed_middle_chapter_rewrites_from_its_offset(tmp_path, monkeypatch):
+    folder = tmp_path / "chapters"
+    write_chapters(folder)
+    output = tmp_path / "merged.md"
+    merge_markdown_files(str(folder), str(output))
+    manifest_file = Path(f"{output}.manifest.json")
+    before = json.loads(manifest_file.read_text(encoding='utf-8'))["chapters"]
+
+    # 变短的章节也要截断掉旧内容
+    (folder / "ch5.md").write_text("# 第5章\n\n改写后的正文。\n", encoding='utf-8')
+    copied = record_copies(monkeypatch)
+    merge_markdown_files(str(folder), str(output))
+
+    assert copied == [f"ch{i}.md" for i in range(5, CHAPTERS + 1)]
+    assert output.read_bytes() == expected_output(folder)
+    after = json.loads(manifest_file.read_text(encoding='utf-8'))["chapters"]
+    assert [c["offset"] for c in after[:5]] == [c["offset"] for c in before[:5]]
+    assert after[5]["offset"] < before[5]["offset"]
+    assert after[4]["offset"] + after[4]["size"] + len(commd.SEPARATOR.encode('utf-8')) == after[5]["offset"]
+
+
+def test_touched_but_unchanged_files_are_not_rewritten(tmp_path, monkeypatch):
+    folder = tmp_path / "chapters"
+    write_chapters(folder)
+    output = tmp_path / "merged.md"
+    merge_markdown_files(str(folder), str(output))
+
+    os.utime(folder / "ch3.md")
+    copied = record_copies(monkeypatch)
+    merge_markdown_files(str(folder), str(output))
+
+    assert copied == []
+    assert output.read_bytes() == expected_output(folder)
+
+
+def test_edited_output_is_rewritten_from_scratch(tmp_path, monkeypatch):
+    folder = tmp_path / "chapters"
+    write_chapters(folder)
+    output = tmp_path / "merged.md"
+    merge_markdown_files(str(folder), str(output))
+
+    # 合并结果被手动修改后清单中的偏移不再可信
+    with open(output, 'ab') as f:
+        f.write("手动添加的内容".encode('utf-8'))
+    copied = record_copies(monkeypatch)
+    merge_markdown_files(str(folder), str(output))
+
+    assert len(copied) == CHAPTERS
+    assert output.read_bytes() == expected_output(folder)
@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import completion  # noqa: E402
+from chunker import SENTINEL  # noqa: E402
+from completion import CompletionTracker  # noqa: E402
+
+PARAGRAPHS = 10
+
+
+def make_source() -> str:
+    return "".join(f"Let $x_{{{i}}}$ be a point of the space and consider its neighbourhoods.\n\n"
+                   for i in range(PARAGRAPHS))
+
+
+def make_translation(start: int = 0, end: int = PARAGRAPHS) -> str:
+    return "".join(f"设 $x_{{{i}}}$ 是空间中的一个点，考虑它的各个邻域。\n\n" for i in range(start, end))
+
+
+def test_truncated_reply_continues_even_when_covered():
+    tracker = CompletionTracker(make_source())
+    assert not tracker.update(make_translation(), "length")
+    assert not tracker.update(make_translation(), "max_tokens")
+    assert tracker.premature == 0
+
+
+def test_ended_reply_with_full_coverage_is_done_without_sentinel():
+    tracker = CompletionTracker(make_source())
+    assert tracker.update(make_translation(), "stop")
+    assert tracker.coverage == 1.0
+    assert tracker.saved_turns == 1
+
+
+def test_ended_reply_below_coverage_is_premature():
+    tracker = CompletionTracker(make_source())
+    assert not tracker.update(make_translation(0, 3), "end_turn")
+    assert tracker.coverage < completion.MIN_ANCHOR_COVERAGE
+    assert tracker.premature == 1
+    assert "提前结束" in tracker.note
+
+    # 继续翻译补齐剩余部分后判为完成
+    assert tracker.update(make_translation(3), "stop")
+    assert tracker.premature == 1
+
+
+def test_early_sentinel_below_coverage_is_premature():
+    tracker = CompletionTracker(make_source())
+    assert not tracker.update(make_translation(0, 3) + SENTINEL, "stop")
+    assert tracker.premature == 1
+
+
+def test_missing_finish_reason_falls_back_to_sentinel():
+    tracker = CompletionTracker(make_source())
+    assert not tracker.update(make_translation(), None)
+    assert tracker.update(SENTINEL, None)
+
+
+def test_premature_stops_are_capped():
+    tracker = CompletionTracker(make_source())
+    # 每轮都有进展，但到 MAX_PREMATURE_CONTINUES 次后不再继续
+    for turn in range(completion.MAX_PREMATURE_CONTINUES):
+        assert not tracker.update(make_translation(turn, turn + 1), "stop")
+    turns = completion.MAX_PREMATURE_CONTINUES
+    assert tracker.update(make_translation(turns, turns + 1), "stop")
+    assert tracker.premature == turns
+    assert "可能有遗漏" in tracker.note
+
+
+def test_premature_stop_without_progress_stops_continuing():
+    tracker = CompletionTracker(make_source())
+    assert not tracker.update(make_translation(0, 3), "stop")
+    assert tracker.update("", "stop")
+    assert tracker.premature == 1
+    assert "可能有遗漏" in tracker.note
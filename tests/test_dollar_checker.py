@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from postprocessing import DelimiterScanner, scan_lines  # noqa: E402
+
+
+def issues(text: str):
+    return [(issue.line, issue.column, issue.delimiter) for issue in scan_lines(text.split('\n'))]
+
+
+def test_balanced_inline_and_display_math():
+    text = "设 $x$ 和 $y$ 是实数，$a$$b$ 是相邻的两个公式。\n\n$$\nx^2 + y^2\n$$\n\n\\(z\\) 与 \\[w\\]"
+    assert issues(text) == []
+
+
+def test_unclosed_inline_dollar_ends_at_blank_line():
+    assert issues("设 $x 是实数\n\n下一段 $y$ 正常") == [(1, 3, '$')]
+
+
+def test_unclosed_display_math_reported_at_end_of_file():
+    assert issues("正文\n\n$$\nx^2 + y^2\n\n继续") == [(3, 1, '$$')]
+
+
+def test_display_math_delimiter_must_stand_alone():
+    found = issues("正文 $$x^2$$ 结束")
+    assert (1, 4, '$$') in found
+    assert (1, 9, '$$') in found
+
+
+def test_escaped_dollar_is_not_a_delimiter():
+    assert issues("价格为 \\$5，公式 $x$ 正常，反斜杠 \\\\ 也跳过") == []
+    # 转义的 \$ 不能闭合公式
+    assert issues("公式 $x \\$ 没有结束\n\n") == [(1, 4, '$')]
+
+
+def test_mismatched_delimiter_inside_open_formula():
+    assert issues("\\(x + $y\\)") == [(1, 7, '$')]
+
+
+def test_closer_without_opener():
+    assert issues("只有结束符号 \\) 和 \\]") == [(1, 8, '\\)'), (1, 13, '\\]')]
+
+
+def test_code_is_skipped():
+    assert issues("行内代码 `$x` 不算公式\n\n```\n$$ 不配对\n```\n\n$y$") == []
+
+
+def test_feed_reports_issues_line_by_line():
+    scanner = DelimiterScanner()
+    assert scanner.feed("第一行 $x") == []
+    assert [issue.line for issue in scanner.feed("")] == [1]
+    assert scanner.feed("$y$") == []
+    assert scanner.finish() == []
@@ -0,0 +1,72 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import key_pool  # noqa: E402
+from key_pool import KeyState  # noqa: E402
+
+
+def make_key(max_in_flight: int = 8, adaptive_limit: int = 16) -> KeyState:
+    key = KeyState("sk-test-0001", 0, 0, max_in_flight, adaptive_limit=adaptive_limit)
+    key.in_flight = key.max_in_flight
+    return key
+
+
+def test_overload_halves_once_per_window():
+    key = make_key()
+    started = time.monotonic()
+    # 同一批并发请求都在减少之前发出，只减少一次
+    for _ in range(5):
+        key.adapt(started, overloaded=True)
+    assert key.max_in_flight == int(8 * key_pool.DECREASE_FACTOR)
+
+    # 减少之后发出的请求再次过载时继续减少
+    key.adapt(time.monotonic(), overloaded=True)
+    assert key.max_in_flight == int(8 * key_pool.DECREASE_FACTOR ** 2)
+
+
+def test_decrease_stops_at_one():
+    key = make_key(max_in_flight=2)
+    for _ in range(5):
+        key.adapt(time.monotonic(), overloaded=True)
+    assert key.max_in_flight == 1
+
+
+def test_additive_increase_about_one_per_round():
+    key = make_key(max_in_flight=4)
+    # 每token耗时不变，并发用满：约每轮 max_in_flight 个请求加1
+    requests = 0
+    while key.max_in_flight == 4 and requests < 20:
+        key.adapt(time.monotonic(), overloaded=False, latency=1.0, tokens=100)
+        requests += 1
+    assert 4 <= requests <= 6
+    assert key.max_in_flight == 5
+    assert key.peak_in_flight == 5
+
+
+def test_no_increase_when_latency_degrades_or_not_saturated():
+    key = make_key(max_in_flight=4)
+    key.adapt(time.monotonic(), overloaded=False, latency=1.0, tokens=100)
+    limit = key.limit
+    key.adapt(time.monotonic(), overloaded=False, latency=1.0 * key_pool.LATENCY_TOLERANCE * 2, tokens=100)
+    assert key.limit == limit
+    key.in_flight = 1
+    key.adapt(time.monotonic(), overloaded=False, latency=1.0, tokens=100)
+    assert key.limit == limit
+
+
+def test_increase_capped_at_adaptive_limit():
+    key = make_key(max_in_flight=3, adaptive_limit=4)
+    for _ in range(50):
+        key.in_flight = key.max_in_flight
+        key.adapt(time.monotonic(), overloaded=False, latency=1.0, tokens=100)
+    assert key.max_in_flight == 4
+
+
+def test_fixed_concurrency_without_adaptive_limit():
+    key = make_key(max_in_flight=4, adaptive_limit=0)
+    key.adapt(time.monotonic(), overloaded=True)
+    key.adapt(time.monotonic(), overloaded=False, latency=1.0, tokens=100)
+    assert key.max_in_flight == 4
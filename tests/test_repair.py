@@ -0,0 +1,66 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+import muliwork  # noqa: E402
+import repair  # noqa: E402
+from chunker import assemble_segments, split_markdown  # noqa: E402
+from postprocessing import apply_stages  # noqa: E402
+from translation_cache import TranslationCache  # noqa: E402
+
+SEGMENT_MAX_TOKENS = 200
+
+
+def make_source(sections: int) -> str:
+    return "".join(f"# Section {i}\n\n" + "Some source text for this section. " * 30 + f"With $x_{i}$.\n\n"
+                   for i in range(sections))
+
+
+def make_translation(index: int, broken: bool = False) -> str:
+    """带单个换行（后处理时加倍）和图片链接（后处理时改写）的译文，broken 时行内公式缺少结束符号"""
+    formula = f"$x_{index}" if broken else f"$x_{index}$"
+    return (f"# 第{index}节\n\n本节的译文，包含 {formula} 和图片。\n"
+            f"![图{index}](C:/figures/fig{index}.png)\n第二行译文")
+
+
+def test_repair_pipeline_output_only_resends_broken_segment(tmp_path, monkeypatch):
+    monkeypatch.setattr(muliwork, "SEGMENT_MAX_TOKENS", SEGMENT_MAX_TOKENS)
+    monkeypatch.setattr(muliwork, "JOURNAL_DIR", tmp_path / "journal")
+
+    source_file = tmp_path / "workmd" / "ch1.md"
+    source_file.parent.mkdir()
+    source_file.write_text(make_source(4), encoding='utf-8')
+    segments = split_markdown(source_file.read_text(encoding='utf-8'), SEGMENT_MAX_TOKENS)
+    assert len(segments) == 4
+
+    good = [make_translation(i) for i in range(len(segments))]
+    cached = [make_translation(i, broken=(i == 2)) for i in range(len(segments))]
+    cache = TranslationCache(tmp_path / "cache.sqlite3")
+    for segment, translation in zip(segments, cached):
+        cache.put(cache.make_key(segment.text, muliwork.initial_prompt, muliwork.MODEL), translation)
+
+    # pending 中的文件与 daemon.py 一样经过了后处理流水线
+    output_file = tmp_path / "pending" / "translated_ch1.md"
+    output_file.parent.mkdir()
+    output_file.write_text(apply_stages(assemble_segments(cached)), encoding='utf-8')
+
+    sent = []
+
+    async def fake_translate_segment(file_path, segments, index, *args):
+        sent.append(index)
+        return good[index]
+
+    monkeypatch.setattr(muliwork, "translate_segment", fake_translate_segment)
+    repaired, total = asyncio.run(repair.repair_file(output_file, source_file, None, cache, None, None, None, None))
+    cache.close()
+
+    assert sent == [2]
+    assert (repaired, total) == (1, 4)
+    assert output_file.read_text(encoding='utf-8') == apply_stages(assemble_segments(good))
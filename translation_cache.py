@@ -0,0 +1,128 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# 缓存文件默认大小上限（字节），超出后按最久未使用淘汰
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# 淘汰时清理到上限的比例，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+
+def normalize_source(text: str) -> str:
+    """规范化源文本：统一换行符、去掉行尾空白、合并多余空行"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = '\n'.join(line.rstrip() for line in text.split('\n'))
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+class TranslationCache:
+    """
+    基于内容寻址的分段译文缓存，存放在输出目录下的SQLite文件中
+
+    键为 规范化源文本 + 提示模板 + 模型名 的SHA-256，命中时直接返回已保存的译文。
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                translation TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON translations(last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    @staticmethod
+    def make_key(source: str, prompt_template: str, model: str) -> str:
+        """计算分段的缓存键"""
+        digest = hashlib.sha256()
+        for part in (normalize_source(source), prompt_template, model):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """查询缓存，命中返回译文，否则返回None"""
+        with self.lock:
+            row = self.conn.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE translations SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def contains(self, key: str) -> bool:
+        """只检查是否有缓存，不计入命中统计，也不更新使用时间"""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM translations WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, translation: str):
+        """写入一条译文，必要时淘汰最久未使用的条目"""
+        size = len(translation.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM translations WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations (key, translation, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, translation, size, time.time())
+            )
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def discard(self, key: str):
+        """删除一条译文，用于丢弃有问题的译文后重新翻译"""
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self.conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+            self.total_bytes -= row[0]
+            self.conn.commit()
+
+    def _evict(self):
+        """按最久未使用淘汰，直到总大小低于上限的一定比例"""
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        rows = self.conn.execute("SELECT key, size FROM translations ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def print_summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+
+        print("\n=== 翻译缓存统计 ===")
+        print(f"缓存命中: {self.hits}")
+        print(f"缓存未命中: {self.misses}")
+        print(f"命中率: {hit_rate:.1f}%")
+        print(f"淘汰条目: {self.evictions}")
+        print(f"缓存大小: {self.total_bytes / 1024 / 1024:.2f} MB / {self.max_bytes / 1024 / 1024:.0f} MB")
@@ -0,0 +1,290 @@
+import gc
+import hashlib
+import re
+import sqlite3
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from chunker import split_blocks
+from postprocessing import scan_lines
+
+# MinHash签名长度和LSH分带：8个带、每带4个值，Jaccard相似度0.6以上的段落大概率成为候选
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+# 按连续3个词切分段落
+SHINGLE_WORDS = 3
+# 相似度不低于此值、且公式和数字完全相同的段落直接复用已有译文
+REUSE_THRESHOLD = 0.9
+# 相似度不低于此值的段落作为参考译文提供给模型
+REFERENCE_THRESHOLD = 0.6
+MAX_REFERENCES = 3
+REFERENCE_MAX_CHARS = 2000
+# 较短的段落（如单独的"证明."）不作为参考
+MIN_REFERENCE_CHARS = 40
+# 每次查询最多精确核对的候选数
+MAX_CANDIDATES = 10
+
+REFERENCE_HEADER = "【参考译文，以下是此前翻译过的相似段落，仅供保持术语和表述一致，不要翻译也不要输出】"
+
+# 复用译文前必须完全一致的部分：公式和数字
+anchor_pattern = re.compile(r'\$\$.*?\$\$|\$[^$]*\$|\\\(.*?\\\)|\\\[.*?\\\]|\d+(?:\.\d+)*', re.S)
+
+half_signature = struct.Struct(f'<{NUM_PERM // 2}I')
+signature_struct = struct.Struct(f'<{NUM_PERM}I')
+
+
+def shingles(text: str):
+    """把段落规范化后按连续的几个词切分，不足一组时整段作为一组"""
+    words = text.lower().split()
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(shingle_set) -> bytes:
+    """
+    计算MinHash签名
+
+    每组词用两次64字节的BLAKE2b摘要得到32个独立的哈希值，按列取最小值，
+    哈希计算都在C中完成，每组词约3微秒。
+    """
+    rows = []
+    for shingle in shingle_set:
+        data = shingle.encode('utf-8')
+        rows.append(half_signature.unpack(hashlib.blake2b(data, digest_size=64).digest())
+                    + half_signature.unpack(hashlib.blake2b(data, digest_size=64, person=b'tm').digest()))
+    return signature_struct.pack(*map(min, zip(*rows)))
+
+
+def band_keys(signature: bytes):
+    """LSH分带的桶键：每个带的签名字节的哈希值，只在本进程的内存索引中使用"""
+    width = ROWS * 4
+    return [hash(signature[band * width:(band + 1) * width]) for band in range(BANDS)]
+
+
+def estimate_similarity(a: bytes, b: bytes) -> float:
+    """用两个签名中相同位置取值相同的比例估计Jaccard相似度"""
+    return sum(x == y for x, y in zip(signature_struct.unpack(a), signature_struct.unpack(b))) / NUM_PERM
+
+
+def jaccard(a, b) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def normalized_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode('utf-8')).hexdigest()
+
+
+def paragraphs(text: str):
+    """按标题和段落边界切分，去掉空白段落"""
+    blocks = (text[start:end].strip() for start, end, _ in split_blocks(text))
+    return [block for block in blocks if block]
+
+
+@dataclass
+class Match:
+    """翻译记忆中的一条相似段落"""
+    entry_id: int
+    source: str
+    translation: str
+    similarity: float
+
+
+class TranslationMemory:
+    """
+    跨文档的模糊翻译记忆，存放在输出目录下的SQLite文件中
+
+    已翻译分段按段落与译文对齐后存入记忆，用MinHash + LSH分带索引。几乎相同的段落直接复用译文，
+    相似的段落作为参考译文随原文一起发给模型，使重复的定理、定义和图注译法一致。
+    提示模板或模型不同的记忆互不混用。
+    """
+
+    def __init__(self, db_path: Path, prompt_template: str, model: str):
+        self.db_path = Path(db_path)
+        self.scope = hashlib.sha256(f"{prompt_template}\0{model}".encode('utf-8')).hexdigest()[:16]
+        self.lock = threading.Lock()
+        self.buckets = [{} for _ in range(BANDS)]  # 每个带：桶键 -> 条目id，多个条目时为id列表
+        self.signatures = {}  # 条目id -> 签名字节
+        self.reused = 0
+        self.referenced = 0
+        self.added = 0
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS memory (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                source TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                UNIQUE (scope, source_hash)
+            )
+        """)
+        self.conn.commit()
+
+        # 加载几十万条签名会创建大量小对象，暂停垃圾回收避免反复扫描
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for entry_id, signature in self.conn.execute("SELECT id, signature FROM memory WHERE scope = ?",
+                                                         (self.scope,)):
+                self._index(entry_id, signature)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _index(self, entry_id: int, signature: bytes):
+        self.signatures[entry_id] = signature
+        # 大多数桶只有一个条目，直接存id，不为每个桶创建列表
+        for bucket, key in zip(self.buckets, band_keys(signature)):
+            existing = bucket.get(key)
+            if existing is None:
+                bucket[key] = entry_id
+            elif isinstance(existing, list):
+                existing.append(entry_id)
+            else:
+                bucket[key] = [existing, entry_id]
+
+    def candidates(self, signature: bytes):
+        """与签名至少有一个带完全相同的条目"""
+        found = set()
+        for bucket, key in zip(self.buckets, band_keys(signature)):
+            entry = bucket.get(key)
+            if isinstance(entry, list):
+                found.update(entry)
+            elif entry is not None:
+                found.add(entry)
+        return found
+
+    def lookup(self, text: str, threshold: float = REFERENCE_THRESHOLD):
+        """查找与段落相似度不低于 threshold 的记忆，按相似度从高到低返回"""
+        start = time.perf_counter()
+        query = shingles(text)
+        matches = []
+        if query and self.signatures:
+            signature = minhash(query)
+            # 先用签名估计相似度筛选，再对少数候选按原文精确计算
+            estimated = sorted(
+                ((estimate_similarity(signature, self.signatures[entry_id]), entry_id)
+                 for entry_id in self.candidates(signature)),
+                reverse=True
+            )[:MAX_CANDIDATES]
+            with self.lock:
+                for estimate, entry_id in estimated:
+                    if estimate < threshold - 0.2:
+                        break
+                    source, translation = self.conn.execute(
+                        "SELECT source, translation FROM memory WHERE id = ?", (entry_id,)).fetchone()
+                    similarity = jaccard(query, shingles(source))
+                    if similarity >= threshold:
+                        matches.append(Match(entry_id, source, translation, similarity))
+            matches.sort(key=lambda match: match.similarity, reverse=True)
+        self.lookups += 1
+        self.lookup_time += time.perf_counter() - start
+        return matches
+
+    def reusable(self, text: str):
+        """段落有几乎相同、且公式和数字完全一致的记忆时返回其译文，否则返回None"""
+        anchors = anchor_pattern.findall(text)
+        for match in self.lookup(text, REUSE_THRESHOLD):
+            if anchor_pattern.findall(match.source) == anchors:
+                return match.translation
+        return None
+
+    def reuse(self, segment_text: str):
+        """分段的每个段落都能直接复用时返回拼好的译文，否则返回None"""
+        translation = self.reusable(segment_text)
+        if translation is None:
+            blocks = paragraphs(segment_text)
+            if not blocks:
+                return None
+            translations = []
+            for block in blocks:
+                translation = self.reusable(block)
+                if translation is None:
+                    return None
+                translations.append(translation)
+            translation = "\n\n".join(translations)
+        self.reused += 1
+        return translation
+
+    def references(self, segment_text: str) -> str:
+        """找出分段中各段落最相似的记忆，格式化为随原文发送的参考译文，没有时返回空字符串"""
+        seen = set()
+        parts = []
+        used = 0
+        for block in paragraphs(segment_text):
+            if len(block) < MIN_REFERENCE_CHARS:
+                continue
+            for match in self.lookup(block)[:1]:
+                size = len(match.source) + len(match.translation)
+                if match.entry_id in seen or used + size > REFERENCE_MAX_CHARS:
+                    continue
+                seen.add(match.entry_id)
+                used += size
+                parts.append(f"原文：{match.source}\n译文：{match.translation}")
+            if len(parts) >= MAX_REFERENCES:
+                break
+        if not parts:
+            return ""
+        self.referenced += 1
+        return REFERENCE_HEADER + "\n" + "\n\n".join(parts)
+
+    def with_references(self, content: str, segment_text: str) -> str:
+        """在分段内容后附上参考译文"""
+        references = self.references(segment_text)
+        return f"{content}\n\n{references}" if references else content
+
+    def add(self, source_text: str, translation: str):
+        """
+        把一个分段的译文存入记忆
+
+        原文和译文的段落数一致时逐段对齐存入，另外整个分段也作为一条记忆；
+        公式分隔符有问题的译文不存入，避免错误被复用。
+        """
+        pairs = [(source_text.strip(), translation.strip())]
+        sources = paragraphs(source_text)
+        targets = paragraphs(translation)
+        if len(sources) > 1 and len(sources) == len(targets):
+            pairs.extend(zip(sources, targets))
+
+        rows = []
+        for source, target in pairs:
+            if not source or not target or any(scan_lines(target.splitlines(True))):
+                continue
+            shingle_set = shingles(source)
+            if shingle_set:
+                rows.append((source, target, minhash(shingle_set)))
+
+        with self.lock:
+            for source, target, signature in rows:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO memory (scope, source_hash, source, translation, signature) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.scope, normalized_hash(source), source, target, signature)
+                )
+                if cursor.rowcount:
+                    self._index(cursor.lastrowid, signature)
+                    self.added += 1
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def print_summary(self):
+        average = self.lookup_time / self.lookups * 1000 if self.lookups else 0.0
+        print("\n=== 翻译记忆统计 ===")
+        print(f"记忆条目: {len(self.signatures)}（本次新增 {self.added}）")
+        print(f"直接复用的分段: {self.reused}")
+        print(f"附带参考译文的分段: {self.referenced}")
+        print(f"平均每次查询耗时: {average:.3f} 毫秒（{self.lookups} 次）")
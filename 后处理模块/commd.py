@@ -1,10 +1,74 @@
+import hashlib
+import json
 import os
+import re
+import shutil
 from pathlib import Path
 
+# 合并时各文件之间的分隔符
+SEPARATOR = '\n\n---\n\n'
+
+# 不支持 sendfile 时 copyfileobj 使用的缓冲区大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def natural_key(name):
+    """自然排序的键：文件名中的数字按数值比较，ch2 排在 ch10 前面"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def file_hash(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_into(outfile, path, size):
+    """把文件内容追加到 outfile，优先在内核中用 sendfile 复制"""
+    with open(path, 'rb') as infile:
+        outfile.flush()
+        start = outfile.tell()
+        try:
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(outfile.fileno(), infile.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            outfile.seek(0, os.SEEK_END)
+        except (AttributeError, OSError):
+            # 不支持 sendfile 的平台（如Windows）用大缓冲区复制
+            outfile.seek(start)
+            outfile.truncate()
+            shutil.copyfileobj(infile, outfile, COPY_BUFFER_SIZE)
+
+
+def load_manifest(manifest_file):
+    """读取上次合并的清单，不存在或损坏时返回None"""
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(manifest_file, manifest):
+    """先写临时文件再替换，避免清单写到一半"""
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_file, manifest_file)
+
 
 def merge_markdown_files(folder_path, output_file='merged_output.md'):
     """
-    将指定文件夹下的所有markdown文件按文件名排序合并
+    将指定文件夹下的所有markdown文件按文件名自然排序合并
+
+    旁边的 <output_file>.manifest.json 记录每个文件在合并结果中的偏移和内容哈希，
+    再次运行时只从第一个有变化的文件开始重写。
 
     Args:
         folder_path (str): markdown文件所在的文件夹路径
@@ -14,36 +78,78 @@ def merge_markdown_files(folder_path, output_file='merged_output.md'):
     if not os.path.exists(folder_path):
         raise FileNotFoundError(f"文件夹 '{folder_path}' 不存在")
 
-    # 获取所有markdown文件
-    markdown_files = []
-    for file in Path(folder_path).glob('*.md'):
-        markdown_files.append(str(file))
-
-    # 按文件名排序
-    markdown_files.sort()
+    # 获取所有markdown文件，按自然顺序排序
+    markdown_files = sorted(Path(folder_path).glob('*.md'), key=lambda p: natural_key(p.name))
 
     if not markdown_files:
         print(f"在 '{folder_path}' 中没有找到markdown文件")
         return
 
-    # 合并文件内容
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        for i, md_file in enumerate(markdown_files):
-            print(f"正在处理: {md_file}")
+    manifest_file = f"{output_file}.manifest.json"
+    separator = SEPARATOR.encode('utf-8')
+    old = load_manifest(manifest_file)
+    old_chapters = []
+    if old and old.get("separator") == SEPARATOR and os.path.exists(output_file) \
+            and os.path.getsize(output_file) == old.get("size"):
+        old_chapters = old["chapters"]
+
+    # 大小和修改时间都没变的文件沿用上次的哈希，其余重新计算
+    chapters = []
+    for i, md_file in enumerate(markdown_files):
+        stat = md_file.stat()
+        previous = old_chapters[i] if i < len(old_chapters) else None
+        if previous and previous["name"] == md_file.name and previous["size"] == stat.st_size \
+                and previous["mtime_ns"] == stat.st_mtime_ns:
+            digest = previous["sha256"]
+        else:
+            digest = file_hash(md_file)
+        chapters.append({"name": md_file.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                         "sha256": digest, "offset": 0})
 
-            # 读取文件内容
-            with open(md_file, 'r', encoding='utf-8') as infile:
-                content = infile.read()
+    # 找到第一个与上次不同的文件
+    first_changed = 0
+    while first_changed < min(len(chapters), len(old_chapters)):
+        current, previous = chapters[first_changed], old_chapters[first_changed]
+        if current["name"] != previous["name"] or current["sha256"] != previous["sha256"]:
+            break
+        current["offset"] = previous["offset"]
+        first_changed += 1
+
+    if first_changed == len(chapters) == len(old_chapters):
+        # 内容没有变化，只更新清单中的修改时间
+        save_manifest(manifest_file, {"separator": SEPARATOR, "size": old["size"], "chapters": chapters})
+        print(f"所有文件都没有变化，{output_file} 无需更新")
+        return
+
+    # 从第一个变化的文件开始重写
+    if first_changed:
+        truncate_at = old_chapters[first_changed - 1]["offset"] + old_chapters[first_changed - 1]["size"]
+        mode = 'r+b'
+        print(f"前 {first_changed} 个文件没有变化，从第 {first_changed + 1} 个文件开始重写")
+    else:
+        truncate_at = 0
+        mode = 'wb'
+
+    with open(output_file, mode) as outfile:
+        outfile.truncate(truncate_at)
+        outfile.seek(truncate_at)
+        for i in range(first_changed, len(chapters)):
+            md_file = markdown_files[i]
+            print(f"正在处理: {md_file}")
 
             # 写入分隔符（除了第一个文件）
             if i > 0:
-                outfile.write('\n\n---\n\n')
+                outfile.write(separator)
 
             # 写入文件内容
-            outfile.write(content)
+            chapters[i]["offset"] = outfile.tell()
+            copy_into(outfile, md_file, chapters[i]["size"])
+        size = outfile.tell()
+
+    save_manifest(manifest_file, {"separator": SEPARATOR, "size": size, "chapters": chapters})
 
     print(f"\n合并完成！输出文件: {output_file}")
-    print(f"共处理了 {len(markdown_files)} 个markdown文件")
+    print(f"共处理了 {len(markdown_files)} 个markdown文件，重写了 {len(markdown_files) - first_changed} 个")
 
 
 # 使用示例
@@ -1,7 +1,159 @@
 # dollar_checker.py
+import argparse
+import json
 import os
-from pathlib import Path
+import re
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+# 开始符号 -> 结束符号
+MATH_DELIMITERS = {'$': '$', '$$': '$$', '\\(': '\\)', '\\[': '\\]'}
+# 行内公式不能跨越空行
+INLINE_DELIMITERS = {'$', '\\('}
+# 代码块的开始行，最多缩进三个空格
+FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+# 一行中需要关注的字符：转义、美元符号、行内代码
+SPECIAL_PATTERN = re.compile(r'[\\$`]')
+
+
+@dataclass
+class DelimiterIssue:
+    """一处未配对或嵌套错误的分隔符，行号和列号从1开始"""
+    line: int
+    column: int
+    delimiter: str
+    message: str
+
+
+class DelimiterScanner:
+    """
+    逐行扫描markdown文本，找出未配对或嵌套错误的公式分隔符
+
+    跳过代码块、行内代码和转义的 \\$，支持 $、$$、\\(...\\)、\\[...\\]，
+    并检查 $$ 公式块是否单独成行。只保存当前打开的公式，内存占用与文件大小无关。
+    """
+
+    def __init__(self):
+        self.line_no = 0
+        self.math = None  # 当前打开的公式：(开始符号, 行号, 列号)
+        self.fence = None  # 当前打开的代码块：(符号, 长度, 行号)
+
+    def feed(self, line: str):
+        """扫描一行，返回这一行发现的问题"""
+        self.line_no += 1
+        line = line.rstrip('\r\n')
+        issues = []
+
+        match = FENCE_PATTERN.match(line)
+        if self.fence is not None:
+            char, length, _ = self.fence
+            if match and match.group(1)[0] == char and len(match.group(1)) >= length \
+                    and not line[match.end():].strip():
+                self.fence = None
+            return issues
+
+        if match:
+            self.close_math(issues)
+            self.fence = (match.group(1)[0], len(match.group(1)), self.line_no)
+            return issues
+
+        if not line.strip():
+            # 空行结束段落，行内公式不能跨段落
+            if self.math is not None and self.math[0] in INLINE_DELIMITERS:
+                self.close_math(issues)
+            return issues
+
+        position = 0
+        while True:
+            match = SPECIAL_PATTERN.search(line, position)
+            if match is None:
+                break
+            i = match.start()
+            char = line[i]
+
+            if char == '\\':
+                token = line[i:i + 2]
+                if token in ('\\(', '\\[', '\\)', '\\]'):
+                    self.handle(token, line, i, issues)
+                # 其余的反斜杠连同后一个字符一起跳过，包括 \$ 和 \\
+                position = i + 2
+
+            elif char == '$':
+                token = '$$' if line.startswith('$$', i) else '$'
+                if token == '$$' and self.math is not None and self.math[0] == '$':
+                    # $a$$b$ 是两个相邻的行内公式
+                    token = '$'
+                self.handle(token, line, i, issues)
+                position = i + len(token)
+
+            elif self.math is None:
+                # 行内代码：找到等长的反引号串，找不到时反引号按普通字符处理
+                run = len(line) - len(line[i:].lstrip('`'))
+                position = i + run
+                end = line.find('`' * run, position)
+                while end != -1 and line.startswith('`', end + run):
+                    end = line.find('`' * run, end + run + 1)
+                if end != -1:
+                    position = end + run
+
+            else:
+                position = i + 1
+
+        return issues
+
+    def handle(self, token: str, line: str, i: int, issues: list):
+        """处理一个分隔符"""
+        column = i + 1
+        if self.math is None:
+            if token not in MATH_DELIMITERS:
+                issues.append(DelimiterIssue(self.line_no, column, token, f"{token} 没有对应的开始符号"))
+                return
+            if token == '$$' and line[:i].strip(' \t>'):
+                issues.append(DelimiterIssue(self.line_no, column, token, "公式块的开始符号 $$ 需要单独成行"))
+            self.math = (token, self.line_no, column)
+            return
+
+        opener, line_no, opener_column = self.math
+        if token == MATH_DELIMITERS[opener]:
+            if token == '$$' and line[i + 2:].strip():
+                issues.append(DelimiterIssue(self.line_no, column, token, "公式块的结束符号 $$ 需要单独成行"))
+            self.math = None
+        else:
+            issues.append(DelimiterIssue(self.line_no, column, token,
+                                         f"{token} 出现在第{line_no}行第{opener_column}列开始的 {opener} 公式中"))
+
+    def close_math(self, issues: list):
+        """当前公式在应该结束的位置没有结束"""
+        if self.math is not None:
+            opener, line_no, column = self.math
+            issues.append(DelimiterIssue(line_no, column, opener, f"{opener} 没有对应的结束符号"))
+            self.math = None
+
+    def finish(self):
+        """文件结束，返回仍未闭合的代码块和公式"""
+        issues = []
+        if self.fence is not None:
+            char, length, line_no = self.fence
+            issues.append(DelimiterIssue(line_no, 1, char * length, "代码块没有闭合"))
+        self.close_math(issues)
+        return issues
+
+
+def scan_lines(lines):
+    """扫描若干行文本，依次产出发现的问题"""
+    scanner = DelimiterScanner()
+    for line in lines:
+        yield from scanner.feed(line)
+    yield from scanner.finish()
+
+
+def validate_file(file_path):
+    """逐行检查一个文件，返回可以直接写成JSON的结果"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        issues = [asdict(issue) for issue in scan_lines(f)]
+    return {"file": str(file_path), "passed": not issues, "issues": issues}
 
 
 class DollarChecker:
@@ -14,38 +166,62 @@ class DollarChecker:
         self.passed_dir.mkdir(exist_ok=True)
         self.failed_dir.mkdir(exist_ok=True)
 
-    def check_dollar_signs(self, content: str) -> bool:
-        """检查文本中 $$ 和 $ 的个数是否都是偶数"""
-        double_dollars = content.count('$$')
-        single_dollars = content.count('$') - (2 * double_dollars)
-        return double_dollars % 2 == 0 and single_dollars % 2 == 0
+    @staticmethod
+    def check_dollar_signs(content: str) -> bool:
+        """检查文本中的公式分隔符是否全部正确配对"""
+        return next(scan_lines(content.splitlines()), None) is None
+
+    def process_directory(self, workers: int = None, report: str = None):
+        """
+        多进程检查指定目录下的所有markdown文件
 
-    def process_directory(self):
-        """处理指定目录下的所有markdown文件"""
+        Args:
+            workers (int): 进程数，默认为CPU核数
+            report (str): JSON结果的输出文件，为 "-" 时输出到终端
+        """
         print(f"\n开始检查文件夹 {self.input_dir} 中的文件...")
 
-        for filename in os.listdir(self.input_dir):
-            if not filename.endswith('.md'):
-                continue
+        files = sorted(self.input_dir / filename for filename in os.listdir(self.input_dir)
+                       if filename.endswith('.md'))
+        results = []
 
-            file_path = self.input_dir / filename
-            print(f"检查文件: {filename}")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(validate_file, file_path) for file_path in files]
+            for file_path, future in zip(files, futures):
+                filename = file_path.name
+                try:
+                    result = future.result()
+                    results.append(result)
 
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                    if result["passed"]:
+                        shutil.copy2(file_path, self.passed_dir / filename)
+                        print(f"文件 {filename} 检查通过，已复制到 {self.passed_dir}")
+                    else:
+                        for issue in result["issues"]:
+                            print(f"  {filename}:{issue['line']}:{issue['column']}: {issue['message']}")
+                        shutil.move(file_path, self.failed_dir / filename)
+                        print(f"文件 {filename} 检查未通过，已移动到 {self.failed_dir}")
 
-                if self.check_dollar_signs(content):
-                    shutil.copy2(file_path, self.passed_dir / filename)
-                    print(f"文件 {filename} 检查通过，已复制到 {self.passed_dir}")
-                else:
-                    shutil.move(file_path, self.failed_dir / filename)
-                    print(f"文件 {filename} 检查未通过，已移动到 {self.failed_dir}")
+                except Exception as e:
+                    results.append({"file": str(file_path), "passed": False, "error": str(e), "issues": []})
+                    print(f"处理文件 {filename} 时出错: {str(e)}")
 
-            except Exception as e:
-                print(f"处理文件 {filename} 时出错: {str(e)}")
+        if report == "-":
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        elif report:
+            with open(report, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"检查结果已写入 {report}")
 
 
 if __name__ == "__main__":
-    checker = DollarChecker("outputmd", "reprocessing", "pending")
-    checker.process_directory()
+    parser = argparse.ArgumentParser(description="检查markdown中的公式分隔符")
+    parser.add_argument("input_dir", nargs="?", default="outputmd", help="待检查的文件夹")
+    parser.add_argument("--passed", default="reprocessing", help="通过检查的文件复制到此目录")
+    parser.add_argument("--failed", default="pending", help="未通过检查的文件移动到此目录")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为CPU核数")
+    parser.add_argument("--json", default=None, help="JSON结果的输出文件，为 - 时输出到终端")
+    args = parser.parse_args()
+
+    checker = DollarChecker(args.input_dir, args.passed, args.failed)
+    checker.process_directory(workers=args.workers, report=args.json)
@@ -1,15 +1,40 @@
+import hashlib
+import json
 import os
 import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
 
 # 设置输入输出目录
 input_folder = './inputimages'  # 输入文件夹，包含所有的markdown文件
 output_folder = './outputimages'  # 输出文件夹，保存修改后的markdown文件
+images_folder = os.path.join(output_folder, 'images')  # 图片按内容哈希放到输出文件夹下的images目录
+# 除markdown文件所在目录外，还在这些目录中查找图片（链接是其他机器上的绝对路径时按文件名查找）
+image_search_dirs = [input_folder]
 
-# 创建output文件夹（如果不存在的话）
-os.makedirs(output_folder, exist_ok=True)
+# 改写后的图片链接前缀
+IMAGE_URL_PREFIX = './images/'
+# 记录已哈希的图片和已放置的文件，再次运行时大小和修改时间没变的图片不再哈希
+MANIFEST_NAME = '.manifest.json'
+# 并行哈希和链接图片的线程数，hashlib 和文件系统调用都会释放GIL
+IMAGE_WORKERS = 8
+# 计算哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 1024 * 1024
 
 # 正则表达式，匹配markdown中的图片语法
 image_pattern = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+windows_path_pattern = re.compile(r'^[A-Za-z]:[/\\]')
+
+
+def file_hash(path):
+    """计算图片内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 # 用于处理和替换路径的函数
@@ -25,21 +50,164 @@ def modify_image_path(image_path):
     return f'./images/{filename}'
 
 
-# 处理一个markdown文件的函数
-def process_markdown_file(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # 替换所有图片路径为HTML img标签，并加入缩放样式
+# 替换文本中所有图片路径为HTML img标签，并加入缩放样式
+def rewrite_image_links(content, links=None):
+    """links 为 原链接 -> 新路径 的映射（见 ImageAssets.sync），不在映射中的链接按文件名指向 ./images/"""
     def replace_image(match):
         alt_text = match.group(1)  # 获取图片的alt文本
         image_path = match.group(2)  # 获取图片的路径
-        new_path = modify_image_path(image_path)
+        new_path = links.get(image_path) if links else None
+        if new_path is None:
+            new_path = modify_image_path(image_path)
         # 返回HTML格式的img标签，并添加缩放样式
         return f'<img src="{new_path}" alt="{alt_text}" style="zoom:50%;" />'
 
     # 使用正则表达式替换图片路径
-    modified_content = re.sub(image_pattern, replace_image, content)
+    return re.sub(image_pattern, replace_image, content)
+
+
+def resolve_image(image_path, md_dir, search_dirs=()):
+    """找到图片链接指向的文件，返回绝对路径；网络图片或找不到时返回None"""
+    path = unquote(image_path.strip().strip('<>').split(' "')[0])
+    if re.match(r'^[a-z][a-z0-9+.-]*://', path, re.I) or path.startswith('data:'):
+        return None
+    name = re.split(r'[/\\]', path)[-1]
+    if os.path.isabs(path) or windows_path_pattern.match(path):
+        candidates = [Path(path)]
+    else:
+        candidates = [Path(md_dir) / path] + [Path(d) / path for d in search_dirs]
+    # 其他机器上的绝对路径或目录结构不同时，按文件名查找
+    candidates += [Path(d) / name for d in (md_dir, *search_dirs)]
+    for candidate in candidates:
+        if candidate.is_file():
+            return str(candidate.resolve())
+    return None
+
+
+def link_file(source, target):
+    """
+    把图片放到目标位置，返回使用的方式
+
+    优先硬链接，不占额外空间；跨文件系统时用 copy_file_range，支持的文件系统上内核会用reflink共享数据块；
+    都不可用时才复制字节。先写临时文件再改名，中断时不会留下不完整的图片。
+    """
+    try:
+        os.link(source, target)
+        return 'link'
+    except FileExistsError:
+        return 'exists'
+    except OSError:
+        pass
+
+    tmp_file = f"{target}.tmp"
+    method = 'copy'
+    with open(source, 'rb') as src, open(tmp_file, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), size - offset)
+                if copied == 0:
+                    break
+                offset += copied
+            method = 'copy_range'
+        except (AttributeError, OSError):
+            src.seek(offset)
+            shutil.copyfileobj(src, dst)
+    os.replace(tmp_file, target)
+    return method
+
+
+class ImageAssets:
+    """
+    markdown引用的图片按内容哈希去重后放到 images_dir
+
+    每个被引用的文件都要能找到，找不到的逐个报告；内容相同的图片只放一份，文件名相同但内容不同的图片
+    不会互相覆盖。目标文件名为 <SHA-256前16位><扩展名>，由内容决定，重复运行时链接不变。
+    清单记录每个源文件的大小、修改时间和哈希，未变化的图片不再哈希，已放置的文件不再链接。
+    """
+
+    def __init__(self, images_dir, search_dirs=(), workers=IMAGE_WORKERS):
+        self.images_dir = Path(images_dir)
+        self.search_dirs = list(search_dirs)
+        self.workers = workers
+        self.manifest_file = self.images_dir / MANIFEST_NAME
+        self.sources = {}  # 源文件绝对路径 -> {"size", "mtime_ns", "sha256"}
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    self.sources = json.load(f).get("sources", {})
+            except (OSError, ValueError):
+                self.sources = {}
+
+    def save_manifest(self):
+        tmp_file = f"{self.manifest_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"sources": self.sources}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+
+    def sync(self, md_files):
+        """
+        解析、哈希并放置所有markdown文件引用的图片
+
+        Returns:
+            dict: markdown文件 -> {原链接: 新路径}，找不到的图片不在映射中
+        """
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        references = {}  # markdown文件 -> {原链接: 源文件}
+        missing = 0
+        for md_file in md_files:
+            with open(md_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+            resolved = {}
+            for match in image_pattern.finditer(content):
+                image_path = match.group(2)
+                if image_path in resolved:
+                    continue
+                source = resolve_image(image_path, os.path.dirname(os.path.abspath(md_file)), self.search_dirs)
+                if source is None and not re.match(r'^[a-z][a-z0-9+.-]*://', image_path.strip(), re.I):
+                    line = content.count('\n', 0, match.start()) + 1
+                    print(f"{md_file}:{line}: 找不到图片 {image_path}")
+                    missing += 1
+                resolved[image_path] = source
+            references[md_file] = {link: source for link, source in resolved.items() if source is not None}
+
+        # 大小和修改时间都没变的图片沿用清单中的哈希，其余并行哈希
+        unique = sorted({source for links in references.values() for source in links.values()})
+        stats = {source: os.stat(source) for source in unique}
+        stale = [source for source in unique
+                 if self.sources.get(source, {}).get("size") != stats[source].st_size
+                 or self.sources.get(source, {}).get("mtime_ns") != stats[source].st_mtime_ns]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for source, digest in zip(stale, executor.map(file_hash, stale)):
+                self.sources[source] = {"size": stats[source].st_size, "mtime_ns": stats[source].st_mtime_ns,
+                                        "sha256": digest}
+
+            targets = {}  # 目标文件名 -> 任一内容相同的源文件
+            names = {}
+            for source in unique:
+                name = self.sources[source]["sha256"][:16] + os.path.splitext(source)[1].lower()
+                names[source] = name
+                targets.setdefault(name, source)
+            pending = [(source, self.images_dir / name) for name, source in targets.items()
+                       if not (self.images_dir / name).exists()]
+            methods = list(executor.map(lambda item: link_file(*item), pending))
+        self.save_manifest()
+
+        counts = {method: methods.count(method) for method in set(methods)}
+        print(f"图片: 引用 {len(unique)} 个文件，去重后 {len(targets)} 个，重新哈希 {len(stale)} 个，"
+              f"新放置 {len(pending)} 个（硬链接 {counts.get('link', 0)}，copy_file_range {counts.get('copy_range', 0)}，"
+              f"复制 {counts.get('copy', 0)}），找不到 {missing} 处")
+        return {md_file: {link: IMAGE_URL_PREFIX + names[source] for link, source in links.items()}
+                for md_file, links in references.items()}
+
+
+# 处理一个markdown文件的函数
+def process_markdown_file(input_file, output_file, links=None):
+    with open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    modified_content = rewrite_image_links(content, links)
 
     # 将修改后的内容写入到输出文件
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -47,14 +215,22 @@ def process_markdown_file(input_file, output_file):
 
 
 if __name__ == "__main__":
+    # 创建output文件夹（如果不存在的话）
+    os.makedirs(output_folder, exist_ok=True)
+
     # 遍历输入文件夹中的所有markdown文件
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.md'):
-            input_file_path = os.path.join(input_folder, filename)
-            output_file_path = os.path.join(output_folder, filename)
-
-            # 处理每个markdown文件
-            process_markdown_file(input_file_path, output_file_path)
-            print(f'Processed {filename}')
+    md_files = [os.path.join(input_folder, filename) for filename in sorted(os.listdir(input_folder))
+                if filename.endswith('.md')]
+
+    # 先解析所有引用的图片，按内容哈希去重后硬链接到输出文件夹的images目录
+    links = ImageAssets(images_folder, image_search_dirs).sync(md_files)
+
+    for input_file_path in md_files:
+        filename = os.path.basename(input_file_path)
+        output_file_path = os.path.join(output_folder, filename)
+
+        # 处理每个markdown文件
+        process_markdown_file(input_file_path, output_file_path, links[input_file_path])
+        print(f'Processed {filename}')
 
     print("All files processed successfully!")
@@ -0,0 +1,162 @@
+"""
+后处理流水线：每个文件只读取一次，在内存中依次执行 特殊字符修复 → 图片格式统一 → 公式符号检查，
+多进程并行处理后按文件名自然顺序流式合并，最后输出各阶段耗时
+
+用法:
+    python pipeline.py ../outputmd --passed reprocessing --failed pending --merged merged_output.md
+    # 同时把引用的图片按内容哈希去重后硬链接到 reprocessing/images
+    python pipeline.py ../outputmd --image-dir reprocessing/images --image-source ../workmd
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from commd import SEPARATOR, natural_key
+from dollar_checker import DollarChecker
+from image import ImageAssets, rewrite_image_links
+from repro import process_markdown_text
+
+# 依次执行的文本处理阶段，每个阶段接收并返回整个文件的文本
+STAGES = [
+    ("repro", process_markdown_text),
+    ("image", rewrite_image_links),
+]
+
+# 最后执行的检查阶段，返回文件是否通过
+VALIDATORS = [
+    ("dollar", DollarChecker.check_dollar_signs),
+]
+
+
+def apply_stages(content, image_links=None, timings=None):
+    """依次执行 STAGES 中的文本处理阶段，timings 不为None时记入各阶段耗时"""
+    for name, stage in STAGES:
+        start = time.perf_counter()
+        content = stage(content, image_links) if stage is rewrite_image_links else stage(content)
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
+    return content
+
+
+def process_file(file_path: Path, image_links=None):
+    """
+    在子进程中处理单个文件，image_links 为 ImageAssets.sync 给出的该文件的图片链接映射
+
+    Returns:
+        tuple: (文件名, 处理后的文本, 是否通过检查, 各阶段耗时, 出错信息)
+    """
+    timings = {}
+    try:
+        start = time.perf_counter()
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        timings["read"] = time.perf_counter() - start
+
+        content = apply_stages(content, image_links, timings)
+
+        passed = True
+        for name, validator in VALIDATORS:
+            start = time.perf_counter()
+            passed = validator(content) and passed
+            timings[name] = time.perf_counter() - start
+
+        return file_path.name, content, passed, timings, None
+
+    except Exception as e:
+        return file_path.name, None, False, timings, str(e)
+
+
+def run_pipeline(input_dir, passed_dir, failed_dir, merged_file, workers=None, image_dir=None,
+                 image_search_dirs=()):
+    """
+    处理目录下的所有markdown文件
+
+    通过检查的文件写入 passed_dir 并按文件名顺序合并到 merged_file，未通过的写入 failed_dir。
+
+    Args:
+        input_dir (str): 翻译结果所在的文件夹
+        passed_dir (str): 通过检查的文件输出目录
+        failed_dir (str): 未通过检查的文件输出目录
+        merged_file (str): 合并后的输出文件
+        workers (int): 进程数，默认为CPU核数
+        image_dir (str): 给出时先解析所有引用的图片，按内容哈希去重后硬链接到该目录
+        image_search_dirs (list): 除markdown文件所在目录外查找图片的目录
+    """
+    input_dir, passed_dir, failed_dir = Path(input_dir), Path(passed_dir), Path(failed_dir)
+    if not input_dir.exists():
+        raise FileNotFoundError(f"文件夹 '{input_dir}' 不存在")
+    passed_dir.mkdir(exist_ok=True)
+    failed_dir.mkdir(exist_ok=True)
+
+    files = sorted(input_dir.glob('*.md'), key=lambda p: natural_key(p.name))
+    if not files:
+        print(f"在 '{input_dir}' 中没有找到markdown文件")
+        return
+
+    print(f"开始处理 {len(files)} 个文件...")
+    total_start = time.perf_counter()
+    stage_totals = {}
+    image_links = [None] * len(files)
+    if image_dir:
+        start = time.perf_counter()
+        links = ImageAssets(image_dir, image_search_dirs).sync(files)
+        image_links = [links[f] for f in files]
+        stage_totals["assets"] = time.perf_counter() - start
+    write_time = 0.0
+    passed_count = 0
+    failed_count = 0
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(files) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(merged_file, 'w', encoding='utf-8') as merged:
+        # map 按提交顺序返回结果，处理完一个就写入合并文件一个
+        for name, content, passed, timings, error in executor.map(process_file, files, image_links, chunksize=chunksize):
+            for stage, elapsed in timings.items():
+                stage_totals[stage] = stage_totals.get(stage, 0.0) + elapsed
+
+            if error is not None:
+                print(f"处理文件 {name} 时出错: {error}")
+                failed_count += 1
+                continue
+
+            start = time.perf_counter()
+            if passed:
+                with open(passed_dir / name, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                if passed_count:
+                    merged.write(SEPARATOR)
+                merged.write(content)
+                passed_count += 1
+            else:
+                with open(failed_dir / name, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                failed_count += 1
+                print(f"文件 {name} 检查未通过，已写入 {failed_dir}")
+            write_time += time.perf_counter() - start
+
+    total_time = time.perf_counter() - total_start
+
+    print(f"\n处理完成！通过 {passed_count} 个，未通过 {failed_count} 个，合并输出: {merged_file}")
+    print("\n=== 各阶段耗时（所有进程累计）===")
+    for stage, elapsed in stage_totals.items():
+        print(f"{stage}: {elapsed:.3f} 秒")
+    print(f"写出与合并: {write_time:.3f} 秒")
+    print(f"总耗时（墙钟）: {total_time:.3f} 秒，使用 {workers} 个进程")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="后处理流水线")
+    parser.add_argument("input_dir", nargs="?", default="outputmd", help="翻译结果所在的文件夹")
+    parser.add_argument("--passed", default="reprocessing", help="通过检查的文件输出目录")
+    parser.add_argument("--failed", default="pending", help="未通过检查的文件输出目录")
+    parser.add_argument("--merged", default="merged_output.md", help="合并后的输出文件")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为CPU核数")
+    parser.add_argument("--image-dir", default=None, help="按内容哈希去重后放置引用图片的目录，如 reprocessing/images")
+    parser.add_argument("--image-source", action="append", default=[], help="查找图片的目录，可重复")
+    args = parser.parse_args()
+
+    run_pipeline(args.input_dir, args.passed, args.failed, args.merged, args.workers, args.image_dir,
+                 args.image_source)
@@ -1,60 +1,59 @@
 import os
 import re
-import ast  # 引入ast模块，用于安全地还原repr格式
+
+# 一次扫描同时识别四种记号（依次对应四个分组）：
+#   1. 数学公式（包括单个$和双个$$的情况），只修复其中的\right、\rbrack、\nabla
+#   2. 表格中的|\n|，保持原样
+#   3. 前后都不是换行的单个换行，替换成两个换行（前面是字面量\n时也不替换）
+#   4. 后面不是换行的字面量\n，在其后补一个换行
+# 各分组的前后判断与原先在repr文本上做的多遍替换完全等价
+TOKEN_PATTERN = re.compile(
+    r'(\$\$[^$]+\$\$|\$[^$]+\$)'
+    r'|(\|\n\|)'
+    r'|((?<!\n)(?<!\\n)\n(?!\n))'
+    r'|(\\n(?!\n))'
+)
+
+# 公式中的修复：repr文本里的\r和\n在原文中分别是回车和换行
+RBRACK_PATTERN = re.compile(r'ightbrack')
+RIGHT_PATTERN = re.compile(r'(?<![rR\r])ight')
+NABLA_PATTERN = re.compile(r'(?<![n\n])abla(?![a-zA-Z])')
+
+
+def process_formula(formula):
+    """修复公式中丢失反斜杠的\\right、\\rbrack和\\nabla"""
+    if 'ight' in formula:
+        formula = RBRACK_PATTERN.sub(r'ight\\rbrack', formula)
+        formula = RIGHT_PATTERN.sub(r'\\right', formula)
+    if 'abla' in formula:
+        formula = NABLA_PATTERN.sub(r'\\nabla', formula)
+    return formula
+
+
+def replace_token(match):
+    group = match.lastindex
+    if group == 1:
+        return process_formula(match.group(1))
+    if group == 2:
+        return match.group(2)
+    if group == 3:
+        return '\n\n'
+    return '\\n\n'
+
 
 def process_markdown_text(content):
     """
     处理Markdown文本，规范化换行符和数学公式
 
+    在原文上一次扫描完成，不再生成repr副本和公式占位符，输出与原先的实现一致。
+
     Args:
         content (str): 输入的Markdown文本
 
     Returns:
         str: 处理后的文本
     """
-    # 将内容转换为repr格式
-    repr_content = repr(content)
-
-    formulas = []
-
-    def save_formula(match):
-        formulas.append(match.group(0))
-        return f"###FORMULA###" + str(len(formulas) - 1) + "###"
-
-    # 保存所有数学公式（包括单个$和双个$$的情况）
-    pattern = r'\$\$[^$]+\$\$|\$[^$]+\$'
-    protected_text = re.sub(pattern, save_formula, repr_content)
-
-    # 处理非公式文本中的单个\\n，注意要忽略|\\n|的情况
-    # 首先匹配|\\n|这种情况并暂时替换为特殊标记
-    protected_text = re.sub(r'\|\\n\|', r'###PIPE_N###', protected_text)
-
-    # 然后处理所有的\\n，替换成\\n\\n
-    protected_text = re.sub(r'(?<!\\n)\\n(?!\\n)', r'\\n\\n', protected_text)
-
-    # 恢复|\\n|为原样
-    protected_text = protected_text.replace('###PIPE_N###', r'|\n|')
-
-
-    def process_formula(formula):
-        # 处理公式中的特定字符
-        formula = re.sub(r'ightbrack', r'ight\\\\rbrack', formula)
-        formula = re.sub(r'(?<![rR])(ight)', r'\\\\right', formula)
-        formula = re.sub(r'(?<!n)abla(?![a-zA-Z])', r'\\\\nabla', formula)
-        return formula
-
-    def restore_formula(match):
-        formula_str = match.group(0)
-        index = int(formula_str.split('###')[2])
-        formula = formulas[index]
-        return process_formula(formula)
-
-    # 恢复处理后的公式
-    final_repr_text = re.sub(r'###FORMULA###\d+###', restore_formula, protected_text)
-
-    final_text = ast.literal_eval(final_repr_text)  # 安全还原为普通文本
-    # 确保恢复后的文本中的换行符正确显示
-    return final_text
+    return TOKEN_PATTERN.sub(replace_token, content)
 
 
 def process_markdown_files_in_directory(directory_path):